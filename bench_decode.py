@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: decode + process time of one MapServer pjson batch
+
+Rebuilds a 2,000-feature pjson query response from the recorded
+riyadh_parcels_sample.json (attributes under their MapServer field names;
+the sample only keeps centroids, so each parcel gets a small polygon around
+its centroid) and times, per batch:
+
+  dicts     json.loads, then ParcelTable.from_features on feature dicts
+            (the path before esri_json)
+  columnar  esri_json.decode_body straight into a FeatureBatch, then
+            ParcelTable.from_features on its columns
+  ... with the stdlib parser as well when orjson is installed
+
+Both paths must produce identical records.
+
+Usage:
+    python3 bench_decode.py [--sample riyadh_parcels_sample.json] [--repeat 30]
+"""
+
+import argparse
+import json
+import math
+import time
+
+import esri_json
+from landuse_rules import APARTMENT
+from parcel_table import COLUMNS, ParcelTable
+
+
+def sample_response(path):
+    """pjson body shaped like a parcel-layer query response, from an exported sample"""
+    with open(path, encoding="utf-8") as f:
+        records = json.load(f)["parcels"]
+
+    features = []
+    for i, rec in enumerate(records):
+        attributes = {field: rec.get(column) for column, (field, _) in COLUMNS.items()}
+        ring = None
+        if rec.get("latitude") and rec.get("longitude"):
+            # 5-9 vertex clockwise ring, closed, about 20 m across
+            n = 5 + i % 5
+            ring = [[rec["longitude"] + 0.0002 * math.cos(-2 * math.pi * k / n),
+                     rec["latitude"] + 0.00015 * math.sin(-2 * math.pi * k / n)] for k in range(n)]
+            ring.append(ring[0])
+        feature = {"attributes": attributes}
+        if ring:
+            feature["geometry"] = {"rings": [ring]}
+        features.append(feature)
+
+    response = {
+        "objectIdFieldName": "OBJECTID",
+        "geometryType": "esriGeometryPolygon",
+        "fields": [{"name": field} for field, _ in COLUMNS.values()],
+        "features": features,
+        "exceededTransferLimit": False
+    }
+    return json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+
+def dicts_path(body):
+    return ParcelTable.from_features(json.loads(body)["features"], APARTMENT)
+
+
+def columnar_path(body):
+    return ParcelTable.from_features(esri_json.decode_body(body)["features"], APARTMENT)
+
+
+def stdlib_columnar_path(body):
+    parser = esri_json.orjson
+    esri_json.orjson = None
+    try:
+        return columnar_path(body)
+    finally:
+        esri_json.orjson = parser
+
+
+def best_of(fn, body, repeat):
+    """Fastest of `repeat` runs in milliseconds (least disturbed by other load)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(body)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(sample="riyadh_parcels_sample.json", repeat=30):
+    body = sample_response(sample)
+    reference = dicts_path(body).records()
+    print(f"Batch: {len(reference):,} features, {len(body) / 1e6:.2f} MB of pjson")
+
+    paths = [("dicts (json + feature dicts)", dicts_path), ("columnar (esri_json)", columnar_path)]
+    if esri_json.orjson is not None:
+        paths.append(("columnar, stdlib json", stdlib_columnar_path))
+    else:
+        print("orjson not installed: the columnar path uses the stdlib parser")
+
+    baseline = None
+    for name, fn in paths:
+        if fn(body).records() != reference:
+            raise SystemExit(f"{name}: records differ from the dicts path")
+        ms = best_of(fn, body, repeat)
+        baseline = baseline or ms
+        print(f"  {name:<30} {ms:7.2f} ms/batch  ({baseline / ms:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MapServer pjson decoding paths")
+    parser.add_argument("--sample", type=str, default="riyadh_parcels_sample.json", help="Exported parcel sample")
+    parser.add_argument("--repeat", type=int, default=30, help="Runs per path (the fastest is reported)")
+    args = parser.parse_args()
+    main(sample=args.sample, repeat=args.repeat)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Overpass fetch plans against the local Overpass stand-in
+
+Compares the old plan (one full-bbox request per QUERIES filter, results
+deduplicated afterwards) with merged union queries over spatial tiles
+(osm_overpass). Per plan it reports requests, response megabytes, unique
+elements kept, tile splits, the time until the first element was usable,
+wall time and peak traced Python memory. The per-filter plan runs without
+the 2 s pause the old loop slept between requests.
+
+With --edits N the stand-in is then advanced by a day of N edits, and a
+full re-fetch is compared with a refresh of an element store (osm_store)
+from the augmented diff; the refreshed store is checked against the
+re-fetch.
+
+Usage:
+    python3 bench_osm.py [--elements 400000] [--max-elements 0] [--latency 0] [--bandwidth 0] [--edits 0]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from fetch_osm_riyadh import QUERIES, RIYADH_BBOX, extract_info, fetch_osm_data
+from osm_overpass import OverpassClient, bbox_tuple, merge_filters
+from osm_store import OsmStore
+from overpass_standin import ElementStore, OverpassStandIn
+
+
+class Tally:
+    """Unique elements kept by a plan, and when the first one arrived"""
+
+    def __init__(self):
+        self.seen = set()
+        self.start = time.perf_counter()
+        self.first = None
+
+    def add(self, elements):
+        for elem in elements:
+            osm_id = f"{elem.get('type')}_{elem.get('id')}"
+            if osm_id not in self.seen and extract_info(elem):
+                self.seen.add(osm_id)
+                if self.first is None:
+                    self.first = time.perf_counter() - self.start
+
+
+def run_per_filter(server):
+    tally = Tally()
+    for name, query_filter in QUERIES.items():
+        tally.add(fetch_osm_data(query_filter, name, url=server.url))
+    return tally, 0
+
+
+def run_tiled(server, grid, workers):
+    tally = Tally()
+    client = OverpassClient(server.url, workers=workers, rate=0)
+    for _, elements, _ in client.fetch_tiles(merge_filters(QUERIES.values()), bbox_tuple(RIYADH_BBOX), grid):
+        tally.add(elements)
+    return tally, client.splits
+
+
+def run_refresh(server, store):
+    tally = Tally()
+    client = OverpassClient(server.url, rate=0)
+    changes = client.fetch_diff(merge_filters(QUERIES.values()), bbox_tuple(RIYADH_BBOX), store.last_sync)
+    store.apply(changes, client.timestamp, client.bytes)
+    tally.add(store.elements.values())
+    return tally, client.splits
+
+
+def fill_store(server, directory, grid, workers):
+    """Element store filled by a full tiled fetch, as fetch_osm_riyadh --store does on its first run"""
+    client = OverpassClient(server.url, workers=workers, rate=0)
+    store = OsmStore(directory)
+    store.begin_full()
+    for _, elements, _ in client.fetch_tiles(merge_filters(QUERIES.values()), bbox_tuple(RIYADH_BBOX), grid):
+        store.put_batch(elements)
+    store.commit(client.timestamp, client.bytes)
+    store.close()
+    # Reopened, as the next run would, so the elements are loaded for the diff
+    return OsmStore(directory)
+
+
+def main(elements=400000, max_elements=0, latency=0.0, bandwidth=0.0, grids=(2, 4), workers=2, edits=0):
+    print(f"Generating {elements:,} synthetic OSM elements...")
+    store = ElementStore(elements)
+    server = OverpassStandIn(store, latency=latency / 1000, max_elements=max_elements or None,
+                             bandwidth=bandwidth * 1e6).start()
+    print(f"Stand-in at {server.url} | statement budget {max_elements or 'unlimited'} elements | "
+          f"bandwidth {f'{bandwidth:g} MB/s' if bandwidth else 'unthrottled'}")
+
+    plans = [("per-filter", lambda: run_per_filter(server))]
+    for grid in grids:
+        plans.append((f"tiled-{grid}x{grid}-w{workers}", lambda grid=grid: run_tiled(server, grid, workers)))
+
+    results = []
+    tallies = {}
+    directory = tempfile.TemporaryDirectory()
+    try:
+        if edits:
+            print("Filling an element store...")
+            osm_store = fill_store(server, directory.name, grids[-1], workers)
+            counts = server.advance(edits)
+            print("Advanced the stand-in by a day: " + ", ".join(f"{n:,} {kind}" for kind, n in counts.items()))
+            plans += [(f"refetch-{grids[-1]}x{grids[-1]}", lambda: run_tiled(server, grids[-1], workers)),
+                      ("diff-refresh", lambda: run_refresh(server, osm_store))]
+
+        for name, run in plans:
+            print(f"Running {name}...")
+            server.reset_stats()
+            tracemalloc.start()
+            start = time.perf_counter()
+            tally, splits = run()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stats = dict(server.stats)
+            tallies[name] = tally
+            results.append((name, stats.get("requests", 0), stats.get("bytes", 0) / 1e6, len(tally.seen), splits,
+                            stats.get("runtime_errors", 0), tally.first or 0.0, elapsed, peak / 1e6))
+    finally:
+        server.stop()
+        directory.cleanup()
+
+    print("-" * 96)
+    print(f"{'plan':<18} {'requests':>9} {'MB':>8} {'elements':>10} {'splits':>7} {'timeouts':>9} "
+          f"{'first s':>8} {'seconds':>8} {'peak MB':>8}")
+    for name, requests, mb, kept, splits, timeouts, first, elapsed, peak in results:
+        print(f"{name:<18} {requests:>9,} {mb:>8.1f} {kept:>10,} {splits:>7,} {timeouts:>9,} "
+              f"{first:>8.1f} {elapsed:>8.1f} {peak:>8.0f}")
+    print("-" * 96)
+    if edits:
+        refreshed, refetched = tallies["diff-refresh"].seen, tallies[f"refetch-{grids[-1]}x{grids[-1]}"].seen
+        print(f"Refreshed store {'matches' if refreshed == refetched else 'DIFFERS from'} the re-fetch "
+              f"({len(refreshed ^ refetched):,} elements differ)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Overpass fetch plans against a local stand-in")
+    parser.add_argument("--elements", type=int, default=400000, help="Synthetic OSM elements")
+    parser.add_argument("--max-elements", type=int, default=0,
+                        help="Stand-in statement budget before a query times out (0 = unlimited)")
+    parser.add_argument("--latency", type=float, default=0, help="Injected latency per request (ms)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Stand-in download speed per request (MB/s)")
+    parser.add_argument("--grid", type=int, action="append", default=None, help="Tiled plan grid size (repeatable)")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent tiles in the tiled plans")
+    parser.add_argument("--edits", type=int, default=0,
+                        help="Edits in a simulated day, to compare a re-fetch with a diff refresh (0 = skip)")
+    args = parser.parse_args()
+    main(elements=args.elements, max_elements=args.max_elements, latency=args.latency, bandwidth=args.bandwidth,
+         grids=args.grid or (2, 4), workers=args.workers, edits=args.edits)
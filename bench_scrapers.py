@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end scraper throughput against the local MapServer stand-in
+
+Starts mapserver_standin in-process and runs each scraper configuration as
+its own process in a scratch directory, pointed at the stand-in through
+UMAPS_PROXY_URL / UMAPS_HOME_URL. Per configuration it reports:
+
+  records     crawl_records_total from the run's --metrics snapshot
+  rec/s       records over wall time (process start to exit)
+  requests    requests the stand-in answered, and how many were 403s
+  peak MB     maximum resident set size of the scraper process
+
+The stand-in's latency and 403 throttle apply to every run, so the same
+configurations can be compared on a fast link or under realistic pressure.
+
+Usage:
+    python3 bench_scrapers.py [--parcels 200000] [--latency 50] [--rate-limit 0]
+    python3 bench_scrapers.py --only all-manifest-w4 --only all-ranges-w4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mapserver_standin import RIYADH_CITY_ID, ParcelStore, StandInServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXTRA_CITY = "00100002"
+
+# name -> scraper command line (relative to the repo); every run gets --metrics
+CONFIGURATIONS = [
+    ("paged", ["scrape_riyadh_parcels.py", "--limit", "20000", "--rate", "0"]),
+    ("paged-manifest", ["scrape_riyadh_parcels.py", "--limit", "20000", "--rate", "0", "--manifest"]),
+    ("all-manifest-w1", ["scrape_all_riyadh.py", "--workers", "1", "--rate", "0", "--restart"]),
+    ("all-manifest-w4", ["scrape_all_riyadh.py", "--workers", "4", "--rate", "0", "--restart"]),
+    ("all-manifest-w8", ["scrape_all_riyadh.py", "--workers", "8", "--rate", "0", "--restart"]),
+    ("all-ranges-w4", ["scrape_all_riyadh.py", "--workers", "4", "--rate", "0", "--restart", "--plan", "ranges"]),
+    ("all-tiles-w4", ["scrape_all_riyadh.py", "--workers", "4", "--rate", "0", "--restart", "--plan", "tiles"]),
+    ("all-pbf-w4", ["scrape_all_riyadh.py", "--workers", "4", "--rate", "0", "--restart", "--format", "pbf"]),
+    ("cities-w4", ["parcel_crawl.py", RIYADH_CITY_ID, EXTRA_CITY, "--workers", "4", "--rate", "0", "--restart"]),
+]
+
+
+def metric_total(snapshot, name):
+    """Sum of a counter over all its label sets"""
+    return sum(c["value"] for c in snapshot.get("counters", ()) if c["name"] == name)
+
+
+def run_configuration(server, name, argv, timeout=None):
+    """Run one scraper process against the stand-in; returns a result row"""
+    env = dict(os.environ, UMAPS_PROXY_URL=server.proxy_url, UMAPS_HOME_URL=server.root_url,
+               PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+        command = [sys.executable, os.path.join(HERE, argv[0])] + argv[1:] + ["--metrics", "metrics.json"]
+        log_path = os.path.join(workdir, "run.log")
+        server.reset_stats()
+        start = time.perf_counter()
+        with open(log_path, "wb") as log:
+            process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            deadline = time.monotonic() + timeout if timeout else None
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                if deadline and time.monotonic() > deadline:
+                    process.kill()
+                    pid, status, usage = os.wait4(process.pid, 0)
+                    break
+                time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        requests = dict(server.stats)
+
+        snapshot = {}
+        metrics_path = os.path.join(workdir, "metrics.json")
+        if os.path.exists(metrics_path):
+            with open(metrics_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        if os.waitstatus_to_exitcode(status) != 0:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            print(f"  {name} exited with status {os.waitstatus_to_exitcode(status)}:\n{tail}")
+
+    records = metric_total(snapshot, "crawl_records_total")
+    return {
+        "name": name,
+        "records": records,
+        "seconds": elapsed,
+        "records_per_second": records / elapsed if elapsed else 0.0,
+        "requests": sum(n for key, n in requests.items() if key != "features"),
+        "throttled": requests.get("throttled", 0),
+        "retries": metric_total(snapshot, "crawl_retries_total"),
+        # ru_maxrss is in KiB on Linux
+        "peak_mb": usage.ru_maxrss / 1024,
+        "exit_code": os.waitstatus_to_exitcode(status)
+    }
+
+
+def print_table(results):
+    print("-" * 84)
+    print(f"{'configuration':<18} {'records':>9} {'seconds':>8} {'rec/s':>9} {'requests':>9} "
+          f"{'403s':>6} {'retries':>8} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['name']:<18} {r['records']:>9,} {r['seconds']:>8.1f} {r['records_per_second']:>9,.0f} "
+              f"{r['requests']:>9,} {r['throttled']:>6,} {r['retries']:>8,} {r['peak_mb']:>8.0f}")
+    print("-" * 84)
+
+
+def main(parcels=200000, city_parcels=50000, latency=0.0, jitter=0.0, rate_limit=0.0, burst=None, only=None,
+         timeout=None, output=None, sample="riyadh_parcels_sample.json"):
+    configurations = [(name, argv) for name, argv in CONFIGURATIONS if not only or name in only]
+    if not configurations:
+        raise SystemExit(f"No configuration matches {only}; choose from {[name for name, _ in CONFIGURATIONS]}")
+
+    print(f"Generating {parcels:,} Riyadh + {city_parcels:,} {EXTRA_CITY} parcels...")
+    store = ParcelStore(parcels, [(EXTRA_CITY, city_parcels)], sample=os.path.join(HERE, sample))
+    server = StandInServer(store, latency=latency / 1000, jitter=jitter / 1000, rate_limit=rate_limit,
+                           burst=burst).start()
+    print(f"Stand-in at {server.proxy_url} | latency {latency:g} ms (+{jitter:g} ms jitter) | "
+          f"rate limit {rate_limit:g} req/s")
+
+    results = []
+    try:
+        for name, argv in configurations:
+            print(f"Running {name}: {' '.join(argv)}")
+            results.append(run_configuration(server, name, argv, timeout))
+            r = results[-1]
+            print(f"  {r['records']:,} records in {r['seconds']:.1f}s ({r['records_per_second']:,.0f}/s), "
+                  f"{r['requests']:,} requests, peak {r['peak_mb']:.0f} MB")
+    finally:
+        server.stop()
+
+    print_table(results)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"parcels": parcels, "city_parcels": city_parcels, "latency_ms": latency, "jitter_ms": jitter,
+                       "rate_limit": rate_limit, "results": results}, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the parcel scrapers against a local MapServer stand-in")
+    parser.add_argument("--parcels", type=int, default=200000, help="Synthetic Riyadh parcels")
+    parser.add_argument("--city-parcels", type=int, default=50000, help=f"Synthetic parcels for {EXTRA_CITY}")
+    parser.add_argument("--latency", type=float, default=0, help="Injected latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="Mean extra exponential latency (ms)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Stand-in 403s beyond this many requests/sec")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size for --rate-limit")
+    parser.add_argument("--only", action="append", default=None, metavar="NAME",
+                        help="Run only this configuration (repeatable)")
+    parser.add_argument("--timeout", type=float, default=None, help="Kill a configuration after this many seconds")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results as JSON")
+    parser.add_argument("--sample", type=str, default="riyadh_parcels_sample.json",
+                        help="Recorded parcels the stand-in copies attributes from")
+    args = parser.parse_args()
+    main(parcels=args.parcels, city_parcels=args.city_parcels, latency=args.latency, jitter=args.jitter,
+         rate_limit=args.rate_limit, burst=args.burst, only=args.only, timeout=args.timeout, output=args.output,
+         sample=args.sample)
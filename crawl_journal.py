@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Crash-safe crawl journal for the parcel scrapers
+
+A journal directory holds two append-only NDJSON files:
+  parcels.ndjson - one processed parcel per line
+  ledger.ndjson  - one line per completed OID range, written only after the
+                   range's parcels are on disk, with the data file size at
+                   that point
+
+On open, anything in parcels.ndjson past the last ledger entry belongs to a
+batch that never completed and is cut off, so a resumed crawl never sees
+duplicates or half-written records.
+
+A refresh patches the journal in place by appending replacement ranges
+marked "replaces": they supersede the part of every earlier range they
+overlap, and readers only see the newest data for each part of the OID
+axis. The rest of an overlapped range stays live ("trimmed" to it), so a
+block re-fetched in halves loses nothing if the run stops in between.
+
+Each ledger entry also names what its range is over ("keys": "oid" for
+OBJECTIDs, "tiles" for quadtree Morton keys), so a journal cannot be
+resumed or refreshed as the other kind (keys=None reads either, but cannot
+record). An entry without "keys" is an error.
+"""
+
+import json
+import os
+import time
+
+
+class JournalKindError(ValueError):
+    """The journal holds ranges over different keys than the caller crawls"""
+
+
+class CrawlJournal:
+    def __init__(self, directory, keys="oid"):
+        self.directory = directory
+        self.keys = keys
+        self.data_path = os.path.join(directory, "parcels.ndjson")
+        self.ledger_path = os.path.join(directory, "ledger.ndjson")
+        os.makedirs(directory, exist_ok=True)
+
+        self.ranges = []  # live ledger entries, in completion order
+        self.count = 0
+        self.apartments = 0
+        self.data_file = None
+
+        offset = self._load_ledger()
+        unnamed = sum(1 for e in self.ranges if "keys" not in e)
+        if unnamed:
+            raise JournalKindError(f"{directory} has {unnamed:,} ledger entries that do not say what they range over")
+        found = {e["keys"] for e in self.ranges} - {keys}
+        if keys is not None and found:
+            raise JournalKindError(f"{directory} journals {'/'.join(sorted(found))} ranges, not {keys} ranges")
+        self._truncate(self.data_path, offset)
+
+        self.data_file = open(self.data_path, "ab")
+        self.ledger_file = open(self.ledger_path, "ab")
+
+    def _load_ledger(self):
+        """Read completed ranges and return the data size they account for"""
+        if not os.path.exists(self.ledger_path):
+            return 0
+
+        valid_bytes = 0
+        data_end = 0
+        with open(self.ledger_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a crash
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                entry["data_start"] = data_end
+                data_end = entry["offset"]
+                self._add(entry)
+
+        self._truncate(self.ledger_path, valid_bytes)
+        return data_end
+
+    def _add(self, entry):
+        """Make a ledger entry live, trimming the ranges a replacement overlaps to the parts it leaves"""
+        if entry.get("replaces"):
+            kept = []
+            for old in self.ranges:
+                if old["start"] < entry["end"] and entry["start"] < old["end"]:
+                    self.count -= old["count"]
+                    self.apartments -= old["apartments"]
+                    for start, end in ((old["start"], entry["start"]), (entry["end"], old["end"])):
+                        if start < end:
+                            piece = self._trimmed(old, start, end)
+                            self.count += piece["count"]
+                            self.apartments += piece["apartments"]
+                            kept.append(piece)
+                else:
+                    kept.append(old)
+            self.ranges = kept
+        self.ranges.append(entry)
+        self.count += entry["count"]
+        self.apartments += entry["apartments"]
+
+    def _trimmed(self, entry, start, end):
+        """The live part [start, end) of an entry: same data, counted over the parcels inside it"""
+        piece = dict(entry, start=start, end=end, trimmed=True)
+        parcels = list(self.iter_range(piece))
+        piece["count"] = len(parcels)
+        piece["apartments"] = sum(1 for p in parcels if p["is_apartment"])
+        return piece
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def completed(self):
+        """Set of (start_oid, end_oid) ranges already on disk"""
+        return {(e["start"], e["end"]) for e in self.ranges}
+
+    def record_batch(self, oid_range, parcels, replaces=False):
+        """
+        Durably append one range's parcels, then mark the range complete.
+        With replaces=True the range supersedes any earlier overlapping ones.
+        """
+        if self.keys is None:
+            raise JournalKindError("A journal opened with keys=None is read-only")
+        data_start = self.data_file.tell()
+        lines = [json.dumps(p, ensure_ascii=False) + "\n" for p in parcels]
+        self.data_file.write("".join(lines).encode("utf-8"))
+        self._sync(self.data_file)
+
+        apartments = sum(1 for p in parcels if p["is_apartment"])
+        entry = {
+            "start": oid_range[0],
+            "end": oid_range[1],
+            "count": len(parcels),
+            "apartments": apartments,
+            "offset": self.data_file.tell(),
+            "fetched_at": time.time(),
+            "keys": self.keys
+        }
+        if replaces:
+            entry["replaces"] = True
+        self.ledger_file.write((json.dumps(entry) + "\n").encode("utf-8"))
+        self._sync(self.ledger_file)
+
+        entry["data_start"] = data_start
+        self._add(entry)
+
+    def iter_range(self, entry):
+        """Parcels stored for one live ledger entry"""
+        if self.data_file is not None:
+            self.data_file.flush()
+        with open(self.data_path, "rb") as f:
+            f.seek(entry["data_start"])
+            data = f.read(entry["offset"] - entry["data_start"])
+        for line in data.decode("utf-8").splitlines():
+            parcel = json.loads(line)
+            if not entry.get("trimmed") or entry["start"] <= parcel["object_id"] < entry["end"]:
+                yield parcel
+
+    def iter_parcels(self):
+        """Stream every live journaled parcel back from disk, in OID order"""
+        for entry in sorted(self.ranges, key=lambda e: e["start"]):
+            yield from self.iter_range(entry)
+
+    def close(self):
+        self.data_file.close()
+        self.ledger_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
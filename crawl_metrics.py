@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Crawl telemetry: counters and histograms with periodic snapshots
+
+Metrics are keyed by name plus labels (endpoint, stage, status, ...):
+  counters    monotonically increasing totals (requests, records, retries)
+  gauges      current values (the adaptive request rate and concurrency)
+  histograms  fixed buckets plus count and sum, so p50/p90/p99 can be read
+              from a snapshot without keeping every sample
+
+One process-wide registry (get_metrics()) is fed by the shared UMAPS client
+(every HTTP response), the decoders and the crawl loops. MetricsWriter writes
+it every `interval` seconds to a JSON file, or to a Prometheus textfile
+(node_exporter textfile collector format) if the path ends in ".prom".
+JSON snapshots also carry per-second rates of every counter since the
+previous snapshot, e.g. records/sec over time.
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Request latency, seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Local pipeline stages (decode, classify, write), seconds
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+# Response bodies, bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Cumulative-style histogram over fixed upper bounds (the last bucket is +Inf)"""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th sample"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.bounds):
+                    return self.bounds[-1] if self.bounds else None
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def summary(self):
+        out = {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None}
+        for q in QUANTILES:
+            out[f"p{round(q * 100)}"] = self.quantile(q)
+        return out
+
+
+def _label_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters, gauges and histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}      # (name, labels) -> value
+        self.started = time.time()
+        self._last_snapshot = (time.time(), {})
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, buckets=STAGE_BUCKETS, **labels):
+        """Observe the wall time of a with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets, **labels)
+
+    def timed(self, name, fn, buckets=STAGE_BUCKETS, **labels):
+        """fn wrapped so every call is timed into `name`"""
+        def wrapper(*args, **kwargs):
+            with self.timer(name, buckets, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def stage(self, stage):
+        """Shorthand for timing one pipeline stage (fetch, decode, classify, write)"""
+        return self.timer("crawl_stage_seconds", stage=stage)
+
+    def snapshot(self):
+        """JSON-friendly view, with counter rates since the previous snapshot"""
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: h.summary() for key, h in self.histograms.items()}
+            since, previous = self._last_snapshot
+            self._last_snapshot = (now, counters)
+
+        interval = max(now - since, 1e-9)
+        return {
+            "time": now,
+            "uptime_seconds": now - self.started,
+            "interval_seconds": now - since,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value,
+                 "per_second": (value - previous.get((name, labels), 0)) / interval}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(gauges.items())
+            ],
+            "histograms": [
+                dict({"name": name, "labels": dict(labels)}, **summary)
+                for (name, labels), summary in sorted(histograms.items())
+            ]
+        }
+
+    def prometheus_text(self):
+        """Text exposition format, one TYPE line per metric name"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, list(h.bounds), list(h.counts), h.count, h.sum)
+                                for key, h in self.histograms.items())
+
+        lines = []
+        typed = set()
+        for kind, metrics in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in metrics:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        for (name, labels), bounds, counts, count, total in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(bounds + ["+Inf"], counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace `path` with a snapshot (.prom -> Prometheus text, else JSON)"""
+        if path.endswith(".prom"):
+            text = self.prometheus_text()
+        else:
+            text = json.dumps(self.snapshot(), indent=2)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+            self.started = time.time()
+            self._last_snapshot = (self.started, {})
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The process-wide registry every fetcher reports into"""
+    return _metrics
+
+
+class MetricsWriter:
+    """Background thread writing snapshots of a registry every `interval` seconds"""
+
+    def __init__(self, path, interval=30.0, metrics=None):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics or get_metrics()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.metrics.write(self.path)
+            except OSError as e:
+                print(f"  Could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        """Stop the thread and write a final snapshot"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.metrics.write(self.path)
+        print(f"Metrics written to {self.path}")
+
+
+def start_metrics(path, interval=30.0):
+    """MetricsWriter for a --metrics argument, or None if it was not given"""
+    if not path:
+        return None
+    return MetricsWriter(path, interval).start()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Schema-driven decoding of MapServer query responses
+
+A pjson feature response is parsed with orjson when it is installed (the
+standard json module otherwise) and then turned into the same columnar
+esri_pbf.FeatureBatch the protobuf decoder produces: one value list per
+field of the response schema and one flat array of ring vertices. From there
+ParcelTable and the polygon kernel read columns directly instead of calling
+.get() on every field of every feature.
+
+The schema is the response's own "fields" list, i.e. the outFields that were
+asked for. Responses without features (counts, id lists, errors, layer info)
+come back as plain dicts. decode_body() also accepts f=pbf bodies, so it is
+the one entry point for every query response.
+"""
+
+import json
+from operator import itemgetter
+
+from crawl_metrics import get_metrics
+from esri_pbf import FeatureBatch, PbfDecodeError, decode_feature_collection
+from parcel_geometry import flatten_rings
+
+try:
+    import orjson
+except ImportError:  # the standard library parser is slower but equivalent
+    orjson = None
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def schema_names(data, features):
+    """Field names of a response: its "fields" list, else the first feature's attributes"""
+    names = [f["name"] for f in data.get("fields") or () if "name" in f]
+    if not names and features:
+        names = list(features[0].get("attributes") or {})
+    return names
+
+
+def attribute_columns(features, names):
+    """One value list per field name; a missing attribute comes out None"""
+    attrs = [f.get("attributes") or {} for f in features]
+    if not names or not attrs:
+        return {name: [] for name in names}
+    try:
+        # Every attribute present (the normal case): pick whole rows, transpose in C
+        rows = list(map(itemgetter(*names), attrs))
+    except KeyError:
+        return {name: [a.get(name) for a in attrs] for name in names}
+    if len(names) == 1:
+        return {names[0]: rows}
+    return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def columnar_features(data, fields=None):
+    """
+    Replace data["features"] (a list of feature dicts) with a FeatureBatch.
+    `fields` overrides the schema, e.g. with the outFields of the query.
+    """
+    features = data["features"]
+    names = list(fields) if fields is not None else schema_names(data, features)
+    columns = attribute_columns(features, names)
+    coords, ring_feature, ring_starts = flatten_rings(features)
+    data["features"] = FeatureBatch(
+        data.get("fields") or [{"name": n} for n in names], columns, coords, ring_feature, ring_starts,
+        len(features)
+    )
+    return data
+
+
+def decode_body(content, fields=None):
+    """
+    Decode a query response body, JSON or PBF. Feature responses come back
+    with a columnar FeatureBatch as "features" either way. Empty bodies and
+    markup (a proxy's HTML error page) raise ValueError, not PbfDecodeError.
+    """
+    content = content.lstrip()
+    if not content or content[:1] == b"<":
+        raise ValueError(f"Not a query response: {content[:60]!r}")
+    if content[:1] in (b"{", b"["):
+        with get_metrics().timer("crawl_stage_seconds", stage="decode", format="json"):
+            data = loads(content)
+            if isinstance(data, dict) and isinstance(data.get("features"), list) and "error" not in data:
+                return columnar_features(data, fields)
+            return data
+    try:
+        with get_metrics().timer("crawl_stage_seconds", stage="decode", format="pbf"):
+            return decode_feature_collection(content)
+    except (IndexError, ValueError, UnicodeDecodeError) as e:
+        raise PbfDecodeError(f"Invalid PBF response: {e}") from e
+
+
+def decode_response(response, fields=None):
+    """decode_body for a requests Response"""
+    return decode_body(response.content, fields)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Decoder for ArcGIS `f=pbf` query responses (FeatureCollectionPBuffer)
+
+The protobuf format is a fraction of the size of pjson: attribute values are
+typed, field names are sent once, and geometry comes as quantized integer
+deltas. Attributes are decoded straight into one list per field and every
+ring of the response into one flat coordinate array, so a FeatureBatch feeds
+ParcelTable and the polygon kernel without building a dict per feature.
+
+FeatureBatch still behaves like the JSON `features` list (len, iteration,
+indexing, slicing), so code that reads `feature["attributes"]` keeps working.
+esri_json.decode_body picks between this decoder and JSON per response.
+"""
+
+import numpy as np
+
+from pbf_wire import (
+    LENGTH_DELIMITED, VARINT, iter_fields, packed_sint64, packed_varints, read_double,
+    read_float, read_string, read_varint, signed64, zigzag_decode
+)
+
+class PbfDecodeError(ValueError):
+    """Response body is neither JSON nor a valid FeatureCollectionPBuffer"""
+
+
+# FeatureCollectionPBuffer.QuantizeOriginPostion
+UPPER_LEFT = 0
+LOWER_LEFT = 1
+
+
+class FeatureBatch:
+    """Columnar features of one response: attribute lists plus flat rings"""
+
+    def __init__(self, fields, columns, coords, ring_feature, ring_starts, count):
+        self.fields = fields
+        self.columns = columns
+        self.coords = coords
+        self.ring_feature = ring_feature
+        self.ring_starts = ring_starts
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def column(self, field):
+        """Values of one attribute field, None for every row if it was not returned"""
+        values = self.columns.get(field)
+        return values if values is not None else [None] * self.count
+
+    def attribute_rows(self):
+        """One attributes dict per feature, as the JSON response would give"""
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*self.columns.values())] if names else [{} for _ in range(self.count)]
+
+    def flat_rings(self):
+        """(coords, ring_feature, ring_starts) in the layout of parcel_geometry.flatten_rings"""
+        return self.coords, self.ring_feature, self.ring_starts
+
+    def _rings(self, i):
+        lo, hi = np.searchsorted(self.ring_feature, [i, i + 1])
+        n_vertices = len(self.coords)
+        rings = []
+        for r in range(lo, hi):
+            stop = self.ring_starts[r + 1] if r + 1 < len(self.ring_starts) else n_vertices
+            rings.append(self.coords[self.ring_starts[r]:stop].tolist())
+        return rings
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self._slice(start, max(start, stop))
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("feature index out of range")
+        feature = {"attributes": {name: values[index] for name, values in self.columns.items()}}
+        rings = self._rings(index)
+        if rings:
+            feature["geometry"] = {"rings": rings}
+        return feature
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def _slice(self, start, stop):
+        r0, r1 = np.searchsorted(self.ring_feature, [start, stop])
+        n_vertices = len(self.coords)
+        v0 = self.ring_starts[r0] if r0 < len(self.ring_starts) else n_vertices
+        v1 = self.ring_starts[r1] if r1 < len(self.ring_starts) else n_vertices
+        return FeatureBatch(
+            self.fields,
+            {name: values[start:stop] for name, values in self.columns.items()},
+            self.coords[v0:v1],
+            self.ring_feature[r0:r1] - start,
+            self.ring_starts[r0:r1] - v0,
+            stop - start
+        )
+
+    def take(self, rows):
+        """New batch of the given (ascending) feature positions, rings included"""
+        rows = np.asarray(rows, dtype=np.int64)
+        keep = np.zeros(self.count, dtype=bool)
+        keep[rows] = True
+        renumber = np.cumsum(keep) - 1
+
+        lengths = np.diff(np.append(self.ring_starts, len(self.coords)))
+        ring_keep = keep[self.ring_feature] if len(self.ring_feature) else np.zeros(0, dtype=bool)
+        kept_lengths = lengths[ring_keep]
+        return FeatureBatch(
+            self.fields,
+            {name: [values[i] for i in rows.tolist()] for name, values in self.columns.items()},
+            self.coords[np.repeat(ring_keep, lengths)],
+            renumber[self.ring_feature[ring_keep]],
+            np.concatenate(([0], np.cumsum(kept_lengths)[:-1])).astype(np.int64) if len(kept_lengths) else kept_lengths,
+            len(rows)
+        )
+
+
+def attribute_values(features, field):
+    """One attribute across a JSON features list or a FeatureBatch"""
+    if isinstance(features, FeatureBatch):
+        return features.column(field)
+    return [(f.get("attributes") or {}).get(field) for f in features]
+
+
+def _value(buf, pos, end):
+    """Decode one FeatureCollectionPBuffer.Value in buf[pos:end] (None if unset)"""
+    if pos >= end:
+        return None
+    key = buf[pos]
+    kind = key >> 3
+    pos += 1
+    if kind == 1:
+        length = buf[pos]
+        if length < 0x80:
+            return str(buf[pos + 1:pos + 1 + length], "utf-8")
+        length, pos = read_varint(buf, pos)
+        return str(buf[pos:pos + length], "utf-8")
+    if kind == 2:
+        return read_float(buf[pos:pos + 4])
+    if kind == 3:
+        return read_double(buf[pos:pos + 8])
+    value = buf[pos]
+    if value >= 0x80:
+        value, _ = read_varint(buf, pos)
+    if kind == 4 or kind == 8:
+        return zigzag_decode(value)
+    if kind == 6:
+        return signed64(value)
+    if kind == 9:
+        return bool(value)
+    return value
+
+
+def _decode_transform(view):
+    origin = UPPER_LEFT
+    scale = [1.0, 1.0]
+    translate = [0.0, 0.0]
+    for field, _, value in iter_fields(view):
+        if field == 1:
+            origin = value
+        elif field in (2, 3):
+            target = scale if field == 2 else translate
+            for axis, _, raw in iter_fields(value):
+                if axis in (1, 2):
+                    target[axis - 1] = read_double(raw)
+    return origin, scale, translate
+
+
+def _geometry_parts(buf, pos, end):
+    """Packed ring lengths and coordinates of one Geometry message"""
+    lengths = coords = None
+    while pos < end:
+        key = buf[pos]
+        if key & 7 != LENGTH_DELIMITED:
+            _, pos = read_varint(buf, pos + 1)  # geometryType
+            continue
+        size, pos = read_varint(buf, pos + 1)
+        if key >> 3 == 2:
+            lengths = buf[pos:pos + size]
+        elif key >> 3 == 3:
+            coords = buf[pos:pos + size]
+        pos += size
+    return lengths, coords
+
+
+def _decode_features(features, n_fields):
+    """
+    Walk every Feature message once. Returns per-field value lists plus the
+    still-encoded geometry of each feature that has one: its index, packed
+    ring lengths and packed coordinates.
+    """
+    columns = [[] for _ in range(n_fields)]
+    geometry_feature = []
+    length_chunks = []
+    coord_chunks = []
+
+    for i, buf in enumerate(features):
+        pos, end = 0, len(buf)
+        column = 0
+        while pos < end:
+            field = buf[pos] >> 3
+            length = buf[pos + 1]
+            if length < 0x80:
+                pos += 2
+            else:
+                length, pos = read_varint(buf, pos + 1)
+            if field == 1:
+                if column < n_fields:
+                    columns[column].append(_value(buf, pos, pos + length))
+                column += 1
+            elif field == 2:
+                lengths, coords = _geometry_parts(buf, pos, pos + length)
+                if lengths and coords is not None:
+                    geometry_feature.append(i)
+                    length_chunks.append(lengths)
+                    coord_chunks.append(coords)
+            pos += length
+
+        # Missing trailing attributes come out null, like absent JSON keys
+        for c in range(column, n_fields):
+            columns[c].append(None)
+
+    return columns, geometry_feature, length_chunks, coord_chunks
+
+
+def _decode_rings(geometry_feature, length_chunks):
+    """
+    Ring lengths of every geometry in one pass.
+    Returns (ring_lengths, ring_feature, vertices per geometry).
+    """
+    if not length_chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    data = b"".join(length_chunks)
+    ring_lengths = packed_varints(data).astype(np.int64)
+
+    # Every byte without the continuation bit closes one ring length
+    chunk_starts = np.cumsum([0] + [len(c) for c in length_chunks[:-1]])
+    closes = (np.frombuffer(data, dtype=np.uint8) < 0x80).astype(np.int64)
+    rings_per_geometry = np.add.reduceat(closes, chunk_starts)
+
+    ring_feature = np.repeat(np.asarray(geometry_feature, dtype=np.int64), rings_per_geometry)
+    first_ring = np.cumsum(rings_per_geometry) - rings_per_geometry
+    vertices = np.add.reduceat(ring_lengths, first_ring)
+    return ring_lengths, ring_feature, vertices
+
+
+def _decode_coords(coord_chunks, vertex_counts, dims, origin, scale, translate):
+    """Undo delta encoding per geometry and dequantize to map coordinates"""
+    if not coord_chunks:
+        return np.empty((0, 2))
+
+    deltas = packed_sint64(b"".join(coord_chunks))
+    n_vertices = int(vertex_counts.sum())
+    if len(deltas) != n_vertices * dims:
+        raise ValueError("Geometry coordinate count does not match ring lengths")
+    deltas = deltas.reshape(-1, dims)[:, :2]
+
+    # Deltas restart at every geometry: running sum minus the sum before it
+    totals = np.cumsum(deltas, axis=0)
+    geometry_ends = np.cumsum(vertex_counts)
+    before = np.zeros((len(vertex_counts), 2), dtype=np.int64)
+    before[1:] = totals[geometry_ends[:-1] - 1]
+    quantized = totals - np.repeat(before, vertex_counts, axis=0)
+
+    coords = np.empty((n_vertices, 2))
+    coords[:, 0] = translate[0] + quantized[:, 0] * scale[0]
+    if origin == UPPER_LEFT:
+        coords[:, 1] = translate[1] - quantized[:, 1] * scale[1]
+    else:
+        coords[:, 1] = translate[1] + quantized[:, 1] * scale[1]
+    return coords
+
+
+def _decode_feature_result(view):
+    fields = []
+    features = []
+    transform = (UPPER_LEFT, [1.0, 1.0], [0.0, 0.0])
+    result = {"exceededTransferLimit": False}
+    has_z = has_m = False
+
+    for field, _, value in iter_fields(view):
+        if field == 1:
+            result["objectIdFieldName"] = read_string(value)
+        elif field == 9:
+            result["exceededTransferLimit"] = bool(value)
+        elif field == 10:
+            has_z = bool(value)
+        elif field == 11:
+            has_m = bool(value)
+        elif field == 12:
+            transform = _decode_transform(value)
+        elif field == 13:
+            for part, _, raw in iter_fields(value):
+                if part == 1:
+                    fields.append({"name": read_string(raw)})
+        elif field == 15:
+            features.append(value)
+
+    names = [f["name"] for f in fields]
+    columns, geometry_feature, length_chunks, coord_chunks = _decode_features(features, len(names))
+    ring_lengths, ring_feature, vertex_counts = _decode_rings(geometry_feature, length_chunks)
+    coords = _decode_coords(coord_chunks, vertex_counts, 2 + has_z + has_m, *transform)
+    ring_starts = np.cumsum(ring_lengths) - ring_lengths
+
+    result["fields"] = fields
+    result["features"] = FeatureBatch(
+        fields, dict(zip(names, columns)), coords, ring_feature, ring_starts, len(features)
+    )
+    return result
+
+
+def decode_feature_collection(buf):
+    """
+    Decode a FeatureCollectionPBuffer into the dict shape of the pjson
+    response: {"features": FeatureBatch, "exceededTransferLimit": ...},
+    {"count": n} or {"objectIds": [...]}.
+    """
+    view = memoryview(buf)
+    for field, _, value in iter_fields(view):
+        if field != 2:
+            continue
+        for kind, _, result in iter_fields(value):
+            if kind == 1:
+                return _decode_feature_result(result)
+            if kind == 2:
+                for part, _, count in iter_fields(result):
+                    if part == 1:
+                        return {"count": count}
+                return {"count": 0}
+            if kind == 3:
+                ids = {"objectIds": []}
+                for part, wire_type, raw in iter_fields(result):
+                    if part == 1:
+                        ids["objectIdFieldName"] = read_string(raw)
+                    elif part == 3:
+                        ids["objectIds"].extend([raw] if wire_type == VARINT else packed_varints(raw).tolist())
+                return ids
+    raise ValueError("Response has no query result")
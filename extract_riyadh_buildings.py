@@ -8,317 +8,7 @@ import json
 import csv
 from collections import defaultdict
 
-# Category mapping - maps sub-categories to main categories
-CATEGORY_MAPPING = {
-    # Residential
-    'apartment': 'Residential',
-    'chalet': 'Residential',
-    'hostel': 'Residential',
-    
-    # Hotels & Tourism
-    'hotel': 'Hotels & Tourism',
-    'motel': 'Hotels & Tourism',
-    'resort': 'Hotels & Tourism',
-    'guest_house': 'Hotels & Tourism',
-    'attraction': 'Hotels & Tourism',
-    'viewpoint': 'Hotels & Tourism',
-    'museum': 'Hotels & Tourism',
-    'information': 'Hotels & Tourism',
-    'artwork': 'Hotels & Tourism',
-    
-    # Religious / Places of Worship
-    'place_of_worship': 'Religious',
-    'religion': 'Religious',
-    
-    # Entertainment & Leisure
-    'theme_park': 'Entertainment',
-    'amusement_arcade': 'Entertainment',
-    'cinema': 'Entertainment',
-    'theatre': 'Entertainment',
-    'zoo': 'Entertainment',
-    'park': 'Entertainment',
-    'playground': 'Entertainment',
-    'dog_park': 'Entertainment',
-    'garden': 'Entertainment',
-    'nature_reserve': 'Entertainment',
-    'picnic_site': 'Entertainment',
-    'bandstand': 'Entertainment',
-    'arts_centre': 'Entertainment',
-    
-    # Sports & Fitness
-    'fitness_centre': 'Sports & Fitness',
-    'fitness_station': 'Sports & Fitness',
-    'sports_centre': 'Sports & Fitness',
-    'sports_hall': 'Sports & Fitness',
-    'stadium': 'Sports & Fitness',
-    'swimming_pool': 'Sports & Fitness',
-    'golf_course': 'Sports & Fitness',
-    'bowling_alley': 'Sports & Fitness',
-    'miniature_golf': 'Sports & Fitness',
-    'horse_riding': 'Sports & Fitness',
-    'water_sports': 'Sports & Fitness',
-    'pitch': 'Sports & Fitness',
-    'track': 'Sports & Fitness',
-    'dance': 'Sports & Fitness',
-    
-    # Healthcare
-    'hospital': 'Healthcare',
-    'clinic': 'Healthcare',
-    'dentist': 'Healthcare',
-    'doctors': 'Healthcare',
-    'pharmacy': 'Healthcare',
-    'veterinary': 'Healthcare',
-    'nursing_home': 'Healthcare',
-    'hospice': 'Healthcare',
-    'rehabilitation': 'Healthcare',
-    'optician': 'Healthcare',
-    'optometrist': 'Healthcare',
-    'physiotherapist': 'Healthcare',
-    'therapist': 'Healthcare',
-    'alternative': 'Healthcare',
-    'laboratory': 'Healthcare',
-    'medical_supply': 'Healthcare',
-    'healthcare': 'Healthcare',
-    
-    # Education
-    'school': 'Education',
-    'kindergarten': 'Education',
-    'college': 'Education',
-    'university': 'Education',
-    'library': 'Education',
-    'language_school': 'Education',
-    'driving_school': 'Education',
-    'educational_institution': 'Education',
-    'research': 'Education',
-    'science_park': 'Education',
-    
-    # Government & Services
-    'police': 'Government & Services',
-    'fire_station': 'Government & Services',
-    'post_office': 'Government & Services',
-    'post_box': 'Government & Services',
-    'post_depot': 'Government & Services',
-    'courthouse': 'Government & Services',
-    'townhall': 'Government & Services',
-    'prison': 'Government & Services',
-    'government': 'Government & Services',
-    'diplomatic': 'Government & Services',
-    'checkpoint': 'Government & Services',
-    'administrative': 'Government & Services',
-    'water_utility': 'Government & Services',
-    
-    # Finance & Banking
-    'bank': 'Finance & Banking',
-    'atm': 'Finance & Banking',
-    'bureau_de_change': 'Finance & Banking',
-    'financial': 'Finance & Banking',
-    'insurance': 'Finance & Banking',
-    'pawnbroker': 'Finance & Banking',
-    
-    # Restaurants & Cafes
-    'restaurant': 'Restaurants & Cafes',
-    'cafe': 'Restaurants & Cafes',
-    'fast_food': 'Restaurants & Cafes',
-    'food_court': 'Restaurants & Cafes',
-    'ice_cream': 'Restaurants & Cafes',
-    'hookah_lounge': 'Restaurants & Cafes',
-    'internet_cafe': 'Restaurants & Cafes',
-    'Juice bar': 'Restaurants & Cafes',
-    'juice': 'Restaurants & Cafes',
-    
-    # Shops & Retail
-    'supermarket': 'Shops & Retail',
-    'convenience': 'Shops & Retail',
-    'department_store': 'Shops & Retail',
-    'mall': 'Shops & Retail',
-    'marketplace': 'Shops & Retail',
-    'general': 'Shops & Retail',
-    'variety_store': 'Shops & Retail',
-    'clothes': 'Shops & Retail',
-    'shoes': 'Shops & Retail',
-    'bag': 'Shops & Retail',
-    'jewelry': 'Shops & Retail',
-    'books': 'Shops & Retail',
-    'stationery': 'Shops & Retail',
-    'toys': 'Shops & Retail',
-    'games': 'Shops & Retail',
-    'video_games': 'Shops & Retail',
-    'gift': 'Shops & Retail',
-    'florist': 'Shops & Retail',
-    'party': 'Shops & Retail',
-    'bookmaker': 'Shops & Retail',
-    
-    # Food & Grocery
-    'bakery': 'Food & Grocery',
-    'butcher': 'Food & Grocery',
-    'greengrocer': 'Food & Grocery',
-    'grocery': 'Food & Grocery',
-    'seafood': 'Food & Grocery',
-    'deli': 'Food & Grocery',
-    'confectionery': 'Food & Grocery',
-    'chocolate': 'Food & Grocery',
-    'pastry': 'Food & Grocery',
-    'pasta': 'Food & Grocery',
-    'tea': 'Food & Grocery',
-    'coffee': 'Food & Grocery',
-    'beverages': 'Food & Grocery',
-    'wine': 'Food & Grocery',
-    'spices': 'Food & Grocery',
-    'nuts': 'Food & Grocery',
-    'health_food': 'Food & Grocery',
-    'food': 'Food & Grocery',
-    'farm': 'Food & Grocery',
-    'dairy': 'Food & Grocery',
-    'herbalist': 'Food & Grocery',
-    
-    # Electronics & Technology
-    'electronics': 'Electronics & Tech',
-    'computer': 'Electronics & Tech',
-    'mobile_phone': 'Electronics & Tech',
-    'hifi': 'Electronics & Tech',
-    'audio_video': 'Electronics & Tech',
-    'camera': 'Electronics & Tech',
-    'electrical': 'Electronics & Tech',
-    
-    # Home & Garden
-    'furniture': 'Home & Garden',
-    'bed': 'Home & Garden',
-    'houseware': 'Home & Garden',
-    'interior_decoration': 'Home & Garden',
-    'kitchen': 'Home & Garden',
-    'lighting': 'Home & Garden',
-    'tiles': 'Home & Garden',
-    'doors': 'Home & Garden',
-    'window_blind': 'Home & Garden',
-    'window_blind;chemist': 'Home & Garden',
-    'paint': 'Home & Garden',
-    'garden_centre': 'Home & Garden',
-    'appliance': 'Home & Garden',
-    'hardware': 'Home & Garden',
-    'doityourself': 'Home & Garden',
-    'tools': 'Home & Garden',
-    'tool_hire': 'Home & Garden',
-    
-    # Beauty & Personal Care
-    'beauty': 'Beauty & Personal Care',
-    'hairdresser': 'Beauty & Personal Care',
-    'hairdresser_supply': 'Beauty & Personal Care',
-    'cosmetics': 'Beauty & Personal Care',
-    'perfumery': 'Beauty & Personal Care',
-    'massage': 'Beauty & Personal Care',
-    'chemist': 'Beauty & Personal Care',
-    'tobacco': 'Beauty & Personal Care',
-    
-    # Automotive
-    'car': 'Automotive',
-    'car_parts': 'Automotive',
-    'car_repair': 'Automotive',
-    'car_rental': 'Automotive',
-    'car_wash': 'Automotive',
-    'motorcycle': 'Automotive',
-    'motorcycle_parking': 'Automotive',
-    'motorcycle_rental': 'Automotive',
-    'tyres': 'Automotive',
-    'vehicle_inspection': 'Automotive',
-    'fuel': 'Automotive',
-    'charging_station': 'Automotive',
-    'compressed_air': 'Automotive',
-    'gas': 'Automotive',
-    'tractors': 'Automotive',
-    
-    # Transportation & Parking
-    'parking': 'Transportation',
-    'parking_entrance': 'Transportation',
-    'parking_space': 'Transportation',
-    'taxi': 'Transportation',
-    'bus_station': 'Transportation',
-    'bus_stop': 'Transportation',
-    'bicycle': 'Transportation',
-    'bicycle_rental': 'Transportation',
-    'bicycle_parking': 'Transportation',
-    
-    # Business & Office
-    'office': 'Business & Office',
-    'company': 'Business & Office',
-    'coworking': 'Business & Office',
-    'consulting': 'Business & Office',
-    'it': 'Business & Office',
-    'advertising_agency': 'Business & Office',
-    'employment_agency': 'Business & Office',
-    'estate_agent': 'Business & Office',
-    'lawyer': 'Business & Office',
-    'notary': 'Business & Office',
-    'telecommunication': 'Business & Office',
-    'courier': 'Business & Office',
-    'logistics': 'Business & Office',
-    'publisher': 'Business & Office',
-    'trade': 'Business & Office',
-    'wholesale': 'Business & Office',
-    'storage_rental': 'Business & Office',
-    'energy_supplier': 'Business & Office',
-    
-    # Services
-    'dry_cleaning': 'Services',
-    'laundry': 'Services',
-    'tailor': 'Services',
-    'copyshop': 'Services',
-    'photo': 'Services',
-    'locksmith': 'Services',
-    'travel_agency': 'Services',
-    'ticket': 'Services',
-    
-    # Community
-    'community_centre': 'Community',
-    'social_centre': 'Community',
-    'social_facility': 'Community',
-    'events_venue': 'Community',
-    'conference_centre': 'Community',
-    'exhibition_centre': 'Community',
-    'charity': 'Community',
-    'ngo': 'Community',
-    'foundation': 'Community',
-    'association': 'Community',
-    'childcare': 'Community',
-    'public_bath': 'Community',
-    
-    # Pets & Animals
-    'pet': 'Pets & Animals',
-    'pet_grooming': 'Pets & Animals',
-    'animal_shelter': 'Pets & Animals',
-    'animal_boarding': 'Pets & Animals',
-    'animal_breeding': 'Pets & Animals',
-    
-    # Baby & Kids
-    'baby_goods': 'Baby & Kids',
-    
-    # Sports Equipment & Outdoors
-    'sports': 'Sports Equipment',
-    'outdoor': 'Sports Equipment',
-    'weapons': 'Sports Equipment',
-    'musical_instrument': 'Sports Equipment',
-    
-    # Other/Misc
-    'art': 'Other',
-    'craft': 'Other',
-    'WorkShop': 'Other',
-    'centre': 'Other',
-    'yes': 'Other',
-    'drinking_water': 'Other',
-    'fountain': 'Other',
-    'bench': 'Other',
-    'bbq': 'Other',
-    'shelter': 'Other',
-    'toilets': 'Other',
-    'telephone': 'Other',
-    'vending_machine': 'Other',
-    'waste_basket': 'Other',
-    'waste_disposal': 'Other',
-    'weighbridge': 'Other',
-    'bleachers': 'Other',
-    'outdoor_seating': 'Other',
-    'حلول_مياه': 'Other',
-    'شركة_ابناء_محمد_بن_خلف_بن_قويد': 'Other',
-}
+from place_categories import TAXONOMY
 
 # Category colors (burgundy theme variations)
 CATEGORY_COLORS = {
@@ -349,9 +39,11 @@ CATEGORY_COLORS = {
     'Other': '#6C3461',                      # Plum
 }
 
-def get_category(sub_category):
-    """Get main category from sub-category"""
-    return CATEGORY_MAPPING.get(sub_category, 'Other')
+def get_category(sub_category, key=None):
+    """Get main category (map legend group) from sub-category, and its tag key when known"""
+    if key:
+        return TAXONOMY.group(TAXONOMY.pair_category(key, sub_category))
+    return TAXONOMY.group(TAXONOMY.value_category(sub_category))
 
 def load_data():
     """Load all data files"""
@@ -387,10 +79,14 @@ def process_data(businesses_extracted, businesses_geo, apartments, villas):
     category_counts = defaultdict(int)
     
     # Process businesses_extracted [lat, lon, name, category_type, sub_category]
+    # category_type is the OSM tag key; each (key, value) pair is looked up once
+    groups = {}
     for item in businesses_extracted:
         if len(item) >= 5:
             lat, lon, name, cat_type, sub_cat = item[0], item[1], item[2], item[3], item[4]
-            main_category = get_category(sub_cat)
+            if (cat_type, sub_cat) not in groups:
+                groups[(cat_type, sub_cat)] = get_category(sub_cat, cat_type)
+            main_category = groups[(cat_type, sub_cat)]
             all_places.append({
                 'lat': lat,
                 'lon': lon,
@@ -407,7 +103,9 @@ def process_data(businesses_extracted, businesses_geo, apartments, villas):
         if len(item) >= 4:
             lat, lon, name, sub_cat = item[0], item[1], item[2], item[3]
             if (lat, lon) not in seen_coords:
-                main_category = get_category(sub_cat)
+                if sub_cat not in groups:
+                    groups[sub_cat] = get_category(sub_cat)
+                main_category = groups[sub_cat]
                 all_places.append({
                     'lat': lat,
                     'lon': lon,
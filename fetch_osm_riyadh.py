@@ -2,14 +2,29 @@
 """
 Fetch all buildings and places from OpenStreetMap for Riyadh
 Using Overpass API
+
+The QUERIES filters are merged into one union query per spatial tile
+(see osm_overpass), and tiles are fetched in parallel. Responses are parsed
+as they stream in, and items go straight to the JSON and CSV outputs.
+
+With --store DIR the matching elements are also kept in an OSM element
+store (osm_store). Later runs then ask Overpass only for what changed since
+the store's last sync (an augmented diff), apply it, and write the outputs
+from the store.
 """
 
 import requests
 import json
 import csv
+import textwrap
 import time
 from collections import defaultdict
 
+from osm_overpass import OVERPASS_URL, OverpassClient, bbox_tuple, format_bbox, merge_filters
+from osm_pbf import read_elements, replication_timestamp
+from osm_store import OsmStore
+from place_categories import TAXONOMY
+
 # Riyadh bounding box (expanded to cover greater Riyadh area)
 RIYADH_BBOX = {
     'south': 24.4,
@@ -18,8 +33,6 @@ RIYADH_BBOX = {
     'east': 47.1
 }
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
-
 # Categories to fetch
 QUERIES = {
     # Buildings by type
@@ -81,8 +94,8 @@ QUERIES = {
     'building_yes': '[building=yes]',
 }
 
-def fetch_osm_data(query_filter, category_name):
-    """Fetch data from Overpass API"""
+def fetch_osm_data(query_filter, category_name, url=OVERPASS_URL):
+    """Fetch one filter over the whole bbox (single-category lookups; main() uses tiled union queries)"""
     bbox = f"{RIYADH_BBOX['south']},{RIYADH_BBOX['west']},{RIYADH_BBOX['north']},{RIYADH_BBOX['east']}"
     
     query = f"""
@@ -98,7 +111,7 @@ def fetch_osm_data(query_filter, category_name):
     print(f"  Fetching {category_name}...", end=" ", flush=True)
     
     try:
-        response = requests.post(OVERPASS_URL, data={'data': query}, timeout=300)
+        response = requests.post(url, data={'data': query}, timeout=300)
         response.raise_for_status()
         data = response.json()
         elements = data.get('elements', [])
@@ -152,160 +165,141 @@ def extract_info(element):
         'osm_type': element.get('type')
     }
 
+# Tag fields every extract_info record carries ('' when the element lacks the tag)
+TAG_FIELDS = ['building', 'amenity', 'shop', 'tourism', 'leisure', 'landuse', 'religion']
+
 def categorize(item):
-    """Assign main category based on tags"""
-    # Residential
-    if item['building'] in ['residential', 'apartments', 'house', 'villa', 'detached', 'terrace']:
-        if item['building'] == 'villa':
-            return 'Residential - Villas'
-        elif item['building'] == 'apartments':
-            return 'Residential - Apartments'
-        else:
-            return 'Residential'
-    
-    # Religious / Places of Worship
-    if item['amenity'] == 'place_of_worship' or item['building'] in ['mosque', 'church', 'temple', 'chapel']:
-        if item['religion'] == 'muslim' or item['building'] == 'mosque':
-            return 'Mosques'
-        elif item['religion'] == 'christian' or item['building'] == 'church':
-            return 'Churches'
-        else:
-            return 'Places of Worship'
-    
-    # Commercial
-    if item['building'] in ['commercial', 'retail', 'office', 'mall']:
-        return 'Commercial Buildings'
-    
-    # Hotels & Tourism
-    if item['building'] == 'hotel' or item['tourism'] in ['hotel', 'motel', 'hostel', 'guest_house']:
-        return 'Hotels'
-    if item['tourism'] in ['attraction', 'museum', 'viewpoint', 'artwork']:
-        return 'Tourist Attractions'
-    
-    # Healthcare
-    if item['amenity'] in ['hospital', 'clinic', 'doctors', 'dentist'] or item['building'] == 'hospital':
-        return 'Healthcare'
-    if item['amenity'] == 'pharmacy':
-        return 'Pharmacies'
-    
-    # Education
-    if item['amenity'] in ['school', 'university', 'college', 'kindergarten'] or item['building'] in ['school', 'university']:
-        return 'Education'
-    
-    # Government & Services
-    if item['building'] in ['government', 'public', 'civic'] or item['amenity'] in ['police', 'fire_station', 'courthouse', 'townhall']:
-        return 'Government & Services'
-    
-    # Restaurants & Cafes
-    if item['amenity'] in ['restaurant', 'cafe', 'fast_food', 'food_court', 'bar']:
-        return 'Restaurants & Cafes'
-    
-    # Shops & Retail
-    if item['shop']:
-        shop_type = item['shop']
-        if shop_type in ['supermarket', 'convenience', 'grocery']:
-            return 'Supermarkets & Grocery'
-        elif shop_type in ['clothes', 'shoes', 'fashion', 'jewelry']:
-            return 'Fashion & Clothing'
-        elif shop_type in ['electronics', 'computer', 'mobile_phone']:
-            return 'Electronics'
-        elif shop_type in ['car', 'car_parts', 'car_repair', 'tyres']:
-            return 'Automotive Shops'
-        else:
-            return 'Shops & Retail'
-    
-    # Finance
-    if item['amenity'] in ['bank', 'atm', 'bureau_de_change']:
-        return 'Banks & Finance'
-    
-    # Entertainment & Leisure
-    if item['leisure'] in ['park', 'garden', 'playground']:
-        return 'Parks & Gardens'
-    if item['leisure'] in ['sports_centre', 'stadium', 'fitness_centre', 'swimming_pool']:
-        return 'Sports & Fitness'
-    if item['amenity'] in ['cinema', 'theatre', 'nightclub']:
-        return 'Entertainment'
-    
-    # Transportation
-    if item['amenity'] in ['fuel', 'charging_station', 'car_wash', 'car_rental']:
-        return 'Fuel & Car Services'
-    if item['amenity'] == 'parking':
-        return 'Parking'
-    
-    # Industrial
-    if item['building'] in ['industrial', 'warehouse', 'factory']:
-        return 'Industrial'
-    
-    # General buildings
-    if item['building'] == 'yes':
-        return 'Other Buildings'
-    
-    return 'Other'
+    """Assign main category based on tags (place_categories.CATEGORY_RULES)"""
+    return TAXONOMY.category(item)
+
+CSV_FIELDS = [
+    'latitude', 'longitude', 'name', 'category', 
+    'building', 'amenity', 'shop', 'tourism', 'leisure', 'religion',
+    'osm_id', 'osm_type'
+]
 
-def main():
+class ItemWriter:
+    """Writes items to the JSON and CSV outputs one at a time as they arrive"""
+    
+    def __init__(self, json_path='riyadh_osm_data.json', csv_path='riyadh_osm_buildings.csv'):
+        self.json_file = open(json_path, 'w', encoding='utf-8')
+        self.csv_file = open(csv_path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.csv_file, fieldnames=CSV_FIELDS)
+        self.writer.writeheader()
+        self.count = 0
+    
+    def write(self, item):
+        # Same layout as json.dump(items, indent=2), one item at a time
+        self.json_file.write('[\n' if not self.count else ',\n')
+        self.json_file.write(textwrap.indent(json.dumps(item, ensure_ascii=False, indent=2), '  '))
+        self.writer.writerow({
+            'latitude': item['lat'],
+            'longitude': item['lon'],
+            'name': item['name'],
+            'category': item['category'],
+            'building': item['building'],
+            'amenity': item['amenity'],
+            'shop': item['shop'],
+            'tourism': item['tourism'],
+            'leisure': item['leisure'],
+            'religion': item['religion'],
+            'osm_id': item['osm_id'],
+            'osm_type': item['osm_type']
+        })
+        self.count += 1
+    
+    def close(self):
+        self.json_file.write('\n]' if self.count else '[]')
+        self.json_file.close()
+        self.csv_file.close()
+
+def main(workers=2, grid=2, rate=1.0, max_rate=None, pbf=None, processes=None, store_dir=None):
+    """
+    Write riyadh_osm_data.json and riyadh_osm_buildings.csv and return
+    (items written, {category: count}). Items go straight to the files as
+    they are extracted, so no list of them is returned; read the JSON file
+    for the items themselves.
+    """
     print("="*60)
     print("FETCHING RIYADH DATA FROM OPENSTREETMAP")
     print("="*60)
     print(f"Area: {RIYADH_BBOX}")
     print()
     
-    all_items = []
-    seen_ids = set()
-    
-    # Fetch each category
-    print("Fetching data from OpenStreetMap Overpass API...")
-    for name, query_filter in QUERIES.items():
-        elements = fetch_osm_data(query_filter, name)
-        
-        for elem in elements:
-            osm_id = f"{elem.get('type')}_{elem.get('id')}"
-            if osm_id not in seen_ids:
-                info = extract_info(elem)
-                if info:
-                    all_items.append(info)
-                    seen_ids.add(osm_id)
-        
-        # Be nice to the API
-        time.sleep(2)
-    
-    print(f"\nTotal unique items fetched: {len(all_items)}")
-    
-    # Categorize all items
-    print("\nCategorizing items...")
+    # Elements are extracted, categorized and written while the responses stream in
     category_counts = defaultdict(int)
-    for item in all_items:
-        item['category'] = categorize(item)
-        category_counts[item['category']] += 1
-    
-    # Save to JSON
-    print("\nSaving to riyadh_osm_data.json...")
-    with open('riyadh_osm_data.json', 'w', encoding='utf-8') as f:
-        json.dump(all_items, f, ensure_ascii=False, indent=2)
+    writer = ItemWriter()
+    start_time = time.time()
+    first_item = None
+    tile_counts = defaultdict(int)
+    
+    # One union query per tile instead of one full-area query per category
+    filters = merge_filters(QUERIES.values())
+    store = OsmStore(store_dir) if store_dir else None
+    # An extract replaces what the store holds; otherwise a synced store is only diffed
+    filling = store is not None and (bool(pbf) or not store.last_sync)
+    if filling and pbf and store.last_sync and not replication_timestamp(pbf):
+        print(f"Leaving {store_dir} as of {store.last_sync}: {pbf} does not say which database time it reflects")
+        filling = False
+    if store is not None and store.last_sync and not pbf:
+        # Only what changed since the last sync is downloaded; the outputs are rebuilt from the store
+        client = OverpassClient(workers=workers, rate=rate, max_rate=max_rate)
+        print(f"Refreshing {store_dir} ({len(store.elements):,} elements) with the changes since {store.last_sync}...")
+        changes = client.fetch_diff(filters, bbox_tuple(RIYADH_BBOX), store.last_sync)
+        created, modified, deleted = store.apply(changes, client.timestamp or store.last_sync, client.bytes)
+        print(f"  {created:,} created, {modified:,} modified, {deleted:,} deleted (now as of {store.last_sync})")
+        kind = "Store"
+        source = [("elements", list(store.elements.values()), True)]
+    elif pbf:
+        # A local extract yields the same elements, decoded on a process pool
+        client = None
+        kind = "Extract"
+        source = read_elements(pbf, filters, bbox_tuple(RIYADH_BBOX), processes)
+        print(f"Reading OpenStreetMap extract {pbf} ({len(QUERIES)} categories in {len(filters)} clauses, "
+              f"{processes or 'all'} processes)...")
+    else:
+        client = OverpassClient(workers=workers, rate=rate, max_rate=max_rate)
+        kind = "Tile"
+        source = client.fetch_tiles(filters, bbox_tuple(RIYADH_BBOX), grid)
+        print(f"Fetching data from OpenStreetMap Overpass API ({len(QUERIES)} categories in {len(filters)} clauses, "
+              f"{grid}x{grid} tiles, {workers} workers)...")
+    print("Streaming to riyadh_osm_data.json and riyadh_osm_buildings.csv")
+    if filling:
+        # A full fetch becomes the store's new base for later refreshes, written as it arrives
+        store.begin_full()
+    try:
+        for tile, elements, done in source:
+            items = [info for info in map(extract_info, elements) if info]
+            for info, category in zip(items, TAXONOMY.categorize(items, TAG_FIELDS)):
+                info['category'] = category
+                category_counts[category] += 1
+                writer.write(info)
+            tile_counts[tile] += len(elements)
+            if filling:
+                store.put_batch(elements)
+            if first_item is None and writer.count:
+                first_item = time.time() - start_time
+                print(f"  First items after {first_item:.1f}s")
+            if done:
+                label = format_bbox(tile) if isinstance(tile, tuple) else tile
+                print(f"  {kind} {label}: {tile_counts.pop(tile, 0):,} elements (total {writer.count:,})")
+    finally:
+        writer.close()
+    
+    if filling:
+        # Tiles may be answered at different database times: the oldest one is safe to diff from
+        timestamp = client.timestamp if client else replication_timestamp(pbf)
+        if timestamp:
+            store.commit(timestamp, client.bytes if client else 0)
+            print(f"Stored {store.filled:,} elements in {store_dir} as of {timestamp}")
+        else:
+            print(f"Not stored in {store_dir}: the source did not say which database time it reflects")
+    if store is not None:
+        store.close()
     
-    # Save to CSV
-    print("Saving to riyadh_osm_buildings.csv...")
-    with open('riyadh_osm_buildings.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            'latitude', 'longitude', 'name', 'category', 
-            'building', 'amenity', 'shop', 'tourism', 'leisure', 'religion',
-            'osm_id', 'osm_type'
-        ])
-        writer.writeheader()
-        for item in all_items:
-            writer.writerow({
-                'latitude': item['lat'],
-                'longitude': item['lon'],
-                'name': item['name'],
-                'category': item['category'],
-                'building': item['building'],
-                'amenity': item['amenity'],
-                'shop': item['shop'],
-                'tourism': item['tourism'],
-                'leisure': item['leisure'],
-                'religion': item['religion'],
-                'osm_id': item['osm_id'],
-                'osm_type': item['osm_type']
-            })
+    if client:
+        print(f"Overpass: {client.summary()}")
+    print(f"\nTotal unique items fetched: {writer.count} in {time.time() - start_time:.1f}s")
     
     # Print summary
     print("\n" + "="*60)
@@ -323,10 +317,26 @@ def main():
     print(f"{'TOTAL':30} {total:>8,}")
     print("="*60)
     
-    return all_items, category_counts
+    return writer.count, category_counts
 
 if __name__ == '__main__':
-    all_items, category_counts = main()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Fetch Riyadh buildings and places from OpenStreetMap")
+    parser.add_argument("--workers", type=int, default=2, help="Tiles queried concurrently")
+    parser.add_argument("--grid", type=int, default=2, help="Start with grid x grid tiles (busy tiles split further)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Starting request rate (requests/sec, adaptive)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Ceiling for the adaptive request rate (0 = none)")
+    parser.add_argument("--pbf", type=str, default=None, help="Read a local .osm.pbf extract instead of Overpass")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Processes decoding the --pbf extract (default: all CPUs)")
+    parser.add_argument("--store", type=str, default=None,
+                        help="OSM element store directory; once filled, runs only fetch the changes since its last sync "
+                             "(with --pbf the store is rebuilt from the extract)")
+    args = parser.parse_args()
+    
+    total, category_counts = main(workers=args.workers, grid=args.grid, rate=args.rate, max_rate=args.max_rate,
+                                  pbf=args.pbf, processes=args.processes, store_dir=args.store)
     print("\n✅ Data saved to:")
     print("   - riyadh_osm_data.json")
     print("   - riyadh_osm_buildings.csv")
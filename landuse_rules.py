@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Land-use labels and the apartment classification rules
+
+The rules are data: a list of (reason, conditions) where every condition is
+column -> (operator, value) on ParcelTable column names. A parcel is an
+apartment when all conditions of at least one rule hold. RuleSet compiles
+the table into whole-column masks:
+  - dictionary-encoded columns are tested once per distinct value and the
+    result is expanded through the codes
+  - numeric columns are compared as arrays
+so a batch (or a million parcels) is classified in a few array operations.
+
+Ordered comparisons treat a null as 0, like the old `units or 0`; equality
+and membership never match a null.
+
+Records already on disk (journal, exports) can be reclassified with
+reclassify_records() after a rule change, without fetching anything again.
+"""
+
+import operator
+
+import numpy as np
+
+from parcel_table import CategoryColumn
+
+# Main land use codes (MAINLANDUSE)
+LANDUSE_TYPES = {
+    100000: "سكني (Residential)",
+    200000: "تجاري (Commercial)",
+    300000: "خدمات عامة (Public Services)",
+    400000: "مرافق عامة (Public Facilities)",
+    500000: "زراعي (Agricultural)",
+    600000: "صناعي (Industrial)",
+    700000: "ترفيهي (Recreational)",
+    800000: "طرق (Roads)",
+    900000: "مياه (Water)",
+    1000000: "سكني متعدد الوحدات (Multi-Unit Residential/Apartments)",
+    5555: "غير محدد (Undefined)",
+    0: "فارغ (Empty)"
+}
+
+# Subtype codes (SUBTYPE)
+SUBTYPE_TYPES = {
+    101000: "سكني فردي (Single Residential/Villa)",
+    102000: "سكني متعدد (Multi Residential)",
+    103000: "سكني مجمع (Residential Complex)",
+    1001000: "عمارة سكنية (Apartment Building)",
+    1002000: "مجمع سكني (Residential Complex)",
+    1006000: "سكني مختلط (Mixed Residential)",
+    201000: "تجاري عام (General Commercial)",
+    202000: "مركز تجاري (Shopping Center)",
+    203000: "سوق (Market)",
+    204000: "محلات (Shops)",
+    205000: "مكاتب (Offices)",
+    206000: "فندق (Hotel)",
+    207000: "مختلط تجاري سكني (Mixed Commercial/Residential)",
+    208000: "خدمات تجارية (Commercial Services)",
+    301000: "تعليمي (Educational)",
+    302000: "صحي (Healthcare)",
+    303000: "ديني (Religious)",
+    304000: "حكومي (Government)",
+    305000: "أمني (Security)",
+    306000: "حديقة عامة (Public Park)",
+    307000: "مقبرة (Cemetery)",
+    401000: "كهرباء (Electricity)",
+    402000: "مياه (Water)",
+    403000: "صرف صحي (Sewage)",
+    404000: "اتصالات (Telecommunications)",
+    405000: "نقل (Transportation)",
+    501000: "زراعي عام (General Agricultural)",
+    502000: "مزرعة (Farm)",
+    503000: "بستان (Orchard)",
+    504000: "حظيرة (Barn)",
+    506000: "مشتل (Nursery)",
+    507000: "أرض زراعية فارغة (Empty Agricultural Land)",
+    601000: "صناعي عام (General Industrial)",
+    602000: "مصنع (Factory)",
+    603000: "ورشة (Workshop)",
+    604000: "مستودع (Warehouse)",
+    605000: "منطقة صناعية (Industrial Zone)",
+    701000: "ترفيهي عام (General Recreational)",
+    801000: "شارع رئيسي (Main Street)",
+    802000: "شارع فرعي (Side Street)",
+    901000: "مسطح مائي (Water Body)",
+    904000: "قناة مياه (Water Channel)"
+}
+
+APARTMENT_LABEL = "شقق (Apartment)"
+NON_APARTMENT_LABEL = "غير شقق (Non-Apartment)"
+
+APARTMENT_RULES = [
+    ("multi-unit residential land use", {"mainlanduse_code": ("==", 1000000)}),
+    ("apartment-related subtype", {"subtype_code": ("in", (102000, 1001000, 1002000, 1006000))}),
+    ("mixed commercial/residential subtype", {"subtype_code": ("==", 207000)}),
+    ("more than two residential units", {"residential_units": (">", 2)}),
+    ("residential with 3+ floors and several units",
+     {"mainlanduse_code": ("==", 100000), "floors": (">=", 3), "residential_units": (">", 1)}),
+]
+
+ORDERED = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le
+}
+
+# Exported records name some columns differently (parcel_crawl's layout)
+RECORD_ALIASES = {
+    "mainlanduse_code": "mainlanduse",
+    "subtype_code": "subtype"
+}
+LABEL_KEYS = ("parcel_type", "type")
+
+
+def landuse_name(code):
+    return LANDUSE_TYPES.get(code, f"Unknown ({code})")
+
+
+def subtype_name(code):
+    return SUBTYPE_TYPES.get(code, f"Unknown ({code})")
+
+
+def apartment_labels(apartment):
+    """Apartment / non-apartment label per row of a boolean mask"""
+    return np.where(apartment, APARTMENT_LABEL, NON_APARTMENT_LABEL).tolist()
+
+
+def _test_value(value, op, operand):
+    """One condition on one Python value"""
+    if op in ORDERED:
+        return ORDERED[op](0 if value is None or value != value else value, operand)
+    if op == "in":
+        return value in operand
+    if op == "==":
+        return value == operand
+    return value != operand
+
+
+def _test_column(column, op, operand):
+    """One condition on a whole column -> boolean mask"""
+    if isinstance(column, CategoryColumn):
+        table = np.array([_test_value(v, op, operand) for v in column.values] or [False], dtype=bool)
+        return table.take(column.codes)
+    values = np.asarray(column, dtype=np.float64)
+    if op in ORDERED:
+        mask = ORDERED[op](values, operand)  # NaN compares False
+        if ORDERED[op](0, operand):
+            mask |= np.isnan(values)
+        return mask
+    if op == "in":
+        return np.isin(values, list(operand))
+    if op == "==":
+        return values == operand
+    return values != operand
+
+
+class RuleSet:
+    """
+    A compiled rule table. Call it with a dict of columns (a ParcelTable's
+    .columns) to get the boolean mask of parcels matching any rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        for reason, conditions in rules:
+            compiled = []
+            for column, (op, operand) in conditions.items():
+                if op not in ORDERED and op not in ("==", "!=", "in"):
+                    raise ValueError(f"Unknown operator {op!r} in rule {reason!r}")
+                if op == "in":
+                    operand = tuple(operand)
+                compiled.append((column, op, operand))
+            self.rules.append((reason, compiled))
+        self.columns = sorted({column for _, conditions in self.rules for column, _, _ in conditions})
+
+    def rule_masks(self, columns):
+        """(reason, mask) per rule; condition masks are shared between rules"""
+        n = len(columns[self.columns[0]]) if self.columns else 0
+        cache = {}
+        for reason, conditions in self.rules:
+            mask = np.ones(n, dtype=bool)
+            for condition in conditions:
+                if condition not in cache:
+                    column, op, operand = condition
+                    cache[condition] = _test_column(columns[column], op, operand)
+                mask &= cache[condition]
+            yield reason, mask
+
+    def __call__(self, columns):
+        result = None
+        for _, mask in self.rule_masks(columns):
+            result = mask if result is None else result | mask
+        if result is None:
+            return np.zeros(len(next(iter(columns.values()), ())), dtype=bool)
+        return result
+
+    def explain(self, columns):
+        """{reason: parcels matched}, to see what a rule change moves"""
+        return {reason: int(mask.sum()) for reason, mask in self.rule_masks(columns)}
+
+
+APARTMENT = RuleSet(APARTMENT_RULES)
+
+
+def record_columns(records, names):
+    """Dictionary-encoded rule input columns from exported record dicts"""
+    columns = {}
+    for name in names:
+        key = name
+        if records and name not in records[0]:
+            key = RECORD_ALIASES.get(name, name)
+        columns[name] = CategoryColumn.encode([r.get(key) for r in records])
+    return columns
+
+
+def reclassify_records(records, rules=APARTMENT):
+    """
+    Re-run the rules on already processed records, updating is_apartment and
+    the apartment label in place. Returns the number of apartments.
+    """
+    apartment = rules(record_columns(records, rules.columns)) if records else np.zeros(0, dtype=bool)
+    flags = apartment.tolist()
+    labels = apartment_labels(apartment)
+    label_key = next((key for key in LABEL_KEYS if records and key in records[0]), None)
+    for record, flag, label in zip(records, flags, labels):
+        record["is_apartment"] = flag
+        if label_key:
+            record[label_key] = label
+    return int(apartment.sum())
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the UMAPS proxy and the parcel MapServer layer
+
+Serves synthetic parcels with the query semantics the scrapers rely on, so
+throughput can be measured without touching the government endpoint:
+
+  where              CITY_ID = '...', DISTRICT_ID = '...',
+                     OBJECTID >|>=|<|<=|= n, 1=1, joined with AND
+                     (parentheses are ignored); anything else is a 400
+                     error, as the real layer answers unsupported SQL
+  geometry           an envelope (JSON or xmin,ymin,xmax,ymax, lon/lat) with
+                     spatialRel esriSpatialRelIntersects or
+                     esriSpatialRelEnvelopeIntersects
+  objectIds          exact id lists (GET or POSTed form)
+  resultRecordCount  capped at maxRecordCount (2,000), with
+                     exceededTransferLimit when more rows match
+  returnCountOnly, returnIdsOnly, returnExtentOnly, outFields, returnGeometry
+  f=pjson|json|pbf   pbf bodies are FeatureCollectionPBuffer messages
+
+Requests are proxied the same way as on the real site:
+  <server>/newProxyUDP/proxy.ashx?<MapServer layer URL>/query?<params>
+
+Latency can be injected per request (a fixed part plus exponential jitter),
+and a token bucket answers requests beyond --rate-limit with the same 403
+JSON error the real proxy sends when it throttles.
+
+Parcels are generated deterministically from a seed. Riyadh's OBJECTIDs fill
+the window scrape_all_riyadh sweeps; extra cities follow it. Attributes are
+copied from the recorded riyadh_parcels_sample.json when it is available,
+except DISTRICT_ID, which follows from the location (an 8 x 8 grid of
+districts per city) so district queries are spatially coherent.
+Point the scrapers at it with UMAPS_PROXY_URL and UMAPS_HOME_URL (see
+umaps_client), or use bench_scrapers.py, which does that for you.
+
+Usage:
+    python3 mapserver_standin.py --port 8765 --latency 150 --rate-limit 20
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import numpy as np
+
+from parcel_table import COLUMNS
+from pbf_wire import bytes_field, double_field, encode_varint, pack_varints, varint_field, zigzag_encode
+
+PROXY_PATH = "/newProxyUDP/proxy.ashx"
+RIYADH_CITY_ID = "00100001"
+RIYADH_PARCELS = 1239506
+RIYADH_OID_WINDOW = (32448872, 35134944)
+MAX_RECORD_COUNT = 2000
+FIELDS = [field for field, _ in COLUMNS.values()] + ["CITY_ID"]
+
+THROTTLED = {"error": {"code": 403, "message": "You do not have permissions to access this resource or perform this operation.", "details": []}}
+BAD_QUERY = {"error": {"code": 400, "message": "Unable to complete operation.", "details": ["Unable to perform query operation."]}}
+
+# Used when no recorded sample is at hand
+FALLBACK_TEMPLATES = [
+    {"MAINLANDUSE": 100000, "SUBTYPE": 101000, "DETAILSLANDUSE": 101011, "RESIDENTIALUNITS": 2, "NOOFFLOORS": 2,
+     "COMMERCIALUNITS": 0, "MEASUREDAREA": 600.0},
+    {"MAINLANDUSE": 1000000, "SUBTYPE": 1001000, "DETAILSLANDUSE": 1001011, "RESIDENTIALUNITS": 8, "NOOFFLOORS": 4,
+     "COMMERCIALUNITS": 0, "MEASUREDAREA": 900.0},
+    {"MAINLANDUSE": 400000, "SUBTYPE": 405000, "DETAILSLANDUSE": None, "RESIDENTIALUNITS": 0, "NOOFFLOORS": 0,
+     "COMMERCIALUNITS": 0, "MEASUREDAREA": 2500.0},
+]
+
+_TERM = re.compile(r"^(?:(CITY_ID|DISTRICT_ID)\s*=\s*'([^']*)'|(OBJECTID)\s*(>=|<=|>|<|=)\s*(-?\d+)|1\s*=\s*1)$",
+                   re.I)
+SPATIAL_RELATIONS = ("esriSpatialRelIntersects", "esriSpatialRelEnvelopeIntersects")
+PARCEL_BBOX = (46.45, 24.45, 46.95, 24.95)
+DISTRICT_GRID = 8
+
+
+def load_templates(sample):
+    """Attribute rows (MapServer field names) to draw synthetic parcels from"""
+    if not sample or not os.path.exists(sample):
+        return FALLBACK_TEMPLATES
+    with open(sample, encoding="utf-8") as f:
+        records = json.load(f)["parcels"]
+    skip = {"OBJECTID", "PARCEL_ID"}
+    return [{field: rec.get(column) for column, (field, _) in COLUMNS.items() if field not in skip} for rec in records]
+
+
+class ParcelStore:
+    """Synthetic parcel layer held as NumPy columns, sorted by OBJECTID"""
+
+    def __init__(self, parcels=RIYADH_PARCELS, cities=(), seed=1, sample="riyadh_parcels_sample.json"):
+        rng = np.random.default_rng(seed)
+        self.templates = load_templates(sample)
+        self.city_ids = [RIYADH_CITY_ID] + [city for city, _ in cities]
+
+        # Riyadh is scattered over its real OID window (gaps and all); extra cities follow
+        lo, hi = RIYADH_OID_WINDOW
+        span = max(hi - lo, parcels)
+        oids = [lo + np.sort(rng.choice(span, parcels, replace=False))]
+        city = [np.zeros(parcels, dtype=np.int16)]
+        next_oid = lo + span
+        for i, (_, count) in enumerate(cities, start=1):
+            oids.append(next_oid + np.cumsum(rng.integers(1, 4, count)))
+            city.append(np.full(count, i, dtype=np.int16))
+            next_oid = int(oids[-1][-1]) + 1 if count else next_oid
+
+        self.object_ids = np.concatenate(oids).astype(np.int64)
+        self.city = np.concatenate(city)
+        n = len(self.object_ids)
+        self.template = rng.integers(0, len(self.templates), n)
+        self.latitude = rng.uniform(PARCEL_BBOX[1], PARCEL_BBOX[3], n)
+        self.longitude = rng.uniform(PARCEL_BBOX[0], PARCEL_BBOX[2], n)
+
+        # Half extents of each parcel's square, and its district cell
+        area = np.array([t.get("MEASUREDAREA") or 400.0 for t in self.templates], dtype=np.float64)
+        self.half_height = np.sqrt(area)[self.template] / 2 / 111320.0
+        self.half_width = self.half_height / np.cos(np.radians(self.latitude))
+        cell_x = ((self.longitude - PARCEL_BBOX[0]) / (PARCEL_BBOX[2] - PARCEL_BBOX[0]) * DISTRICT_GRID).astype(np.int64)
+        cell_y = ((self.latitude - PARCEL_BBOX[1]) / (PARCEL_BBOX[3] - PARCEL_BBOX[1]) * DISTRICT_GRID).astype(np.int64)
+        self.district = np.minimum(cell_y, DISTRICT_GRID - 1) * DISTRICT_GRID + np.minimum(cell_x, DISTRICT_GRID - 1) + 1
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def select(self, where):
+        """Row positions matching a where clause, or None if it is not understood"""
+        lo, hi = 0, len(self.object_ids)
+        city = None
+        district = None
+        text = where.replace("(", " ").replace(")", " ").strip()
+        for term in re.split(r"\s+AND\s+", text, flags=re.I) if text else []:
+            match = _TERM.match(term.strip())
+            if not match:
+                return None
+            if match.group(1) and match.group(1).upper() == "DISTRICT_ID":
+                district = match.group(2)
+            elif match.group(1):
+                if match.group(2) not in self.city_ids:
+                    return np.empty(0, dtype=np.int64)
+                city = self.city_ids.index(match.group(2))
+            elif match.group(3):
+                op, value = match.group(4), int(match.group(5))
+                if op in (">", ">="):
+                    lo = max(lo, int(np.searchsorted(self.object_ids, value, "right" if op == ">" else "left")))
+                elif op in ("<", "<="):
+                    hi = min(hi, int(np.searchsorted(self.object_ids, value, "left" if op == "<" else "right")))
+                else:
+                    lo = max(lo, int(np.searchsorted(self.object_ids, value, "left")))
+                    hi = min(hi, int(np.searchsorted(self.object_ids, value, "right")))
+        rows = np.arange(lo, max(lo, hi))
+        if city is not None:
+            rows = rows[self.city[rows] == city]
+        if district is not None:
+            city_id, number = district[:-3], district[-3:]
+            if city_id not in self.city_ids or not number.isdigit():
+                return np.empty(0, dtype=np.int64)
+            rows = rows[(self.city[rows] == self.city_ids.index(city_id)) & (self.district[rows] == int(number))]
+        return rows
+
+    def intersecting(self, rows, envelope):
+        """The rows whose square touches the (xmin, ymin, xmax, ymax) envelope"""
+        xmin, ymin, xmax, ymax = envelope
+        lon = self.longitude[rows]
+        lat = self.latitude[rows]
+        hw = self.half_width[rows]
+        hh = self.half_height[rows]
+        keep = (lon - hw <= xmax) & (lon + hw >= xmin) & (lat - hh <= ymax) & (lat + hh >= ymin)
+        return rows[keep]
+
+    def extent(self, rows):
+        """Envelope of the given rows' squares, or None if there are none"""
+        if not len(rows):
+            return None
+        return (float((self.longitude[rows] - self.half_width[rows]).min()),
+                float((self.latitude[rows] - self.half_height[rows]).min()),
+                float((self.longitude[rows] + self.half_width[rows]).max()),
+                float((self.latitude[rows] + self.half_height[rows]).max()))
+
+    def rows_for_ids(self, ids):
+        """Row positions of the given OBJECTIDs; unknown ids are skipped"""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        pos = np.searchsorted(self.object_ids, ids)
+        found = pos < len(self.object_ids)
+        found[found] = self.object_ids[pos[found]] == ids[found]
+        return pos[found]
+
+    def attributes(self, rows, fields):
+        """One attributes dict per row, restricted to `fields`"""
+        out = []
+        for oid, template, city, district in zip(self.object_ids[rows].tolist(), self.template[rows].tolist(),
+                                                 self.city[rows].tolist(), self.district[rows].tolist()):
+            source = self.templates[template]
+            row = {}
+            for field in fields:
+                if field == "OBJECTID":
+                    row[field] = oid
+                elif field == "PARCEL_ID":
+                    row[field] = str(oid - RIYADH_OID_WINDOW[0] + 3000000)
+                elif field == "CITY_ID":
+                    row[field] = self.city_ids[city]
+                elif field == "DISTRICT_ID":
+                    row[field] = f"{self.city_ids[city]}{district:03d}"
+                else:
+                    row[field] = source.get(field)
+            out.append(row)
+        return out
+
+    def rings(self, rows):
+        """Rings of each row: one closed clockwise square sized from the parcel's area"""
+        out = []
+        for lat, lon, dx, dy in zip(self.latitude[rows].tolist(), self.longitude[rows].tolist(),
+                                    self.half_width[rows].tolist(), self.half_height[rows].tolist()):
+            out.append([[[lon - dx, lat + dy], [lon + dx, lat + dy], [lon + dx, lat - dy],
+                         [lon - dx, lat - dy], [lon - dx, lat + dy]]])
+        return out
+
+
+# --- FeatureCollectionPBuffer encoding -------------------------------------
+
+def _pbf_value(value):
+    if value is None:
+        return b""
+    if isinstance(value, bool):
+        return varint_field(9, int(value))
+    if isinstance(value, str):
+        return bytes_field(1, value.encode("utf-8"))
+    if isinstance(value, float):
+        return double_field(3, value)
+    if value < 0:
+        return varint_field(8, zigzag_encode(value))
+    return varint_field(5 if value < 2 ** 32 else 7, value)
+
+
+def _pbf_message(query_result):
+    return bytes_field(1, b"3.0") + bytes_field(2, query_result)
+
+
+def pbf_count(count):
+    return _pbf_message(bytes_field(2, varint_field(1, count)))
+
+
+def pbf_ids(ids):
+    packed = pack_varints(ids)
+    return _pbf_message(bytes_field(3, bytes_field(1, b"OBJECTID") + bytes_field(3, packed)))
+
+
+def pbf_features(fields, attributes, rings, exceeded, scale=1e-9):
+    """Quantized, delta-encoded feature result with an upper-left origin at (-180, 90)"""
+    result = bytes_field(1, b"OBJECTID")
+    if exceeded:
+        result += varint_field(9, 1)
+    transform = varint_field(1, 0) + bytes_field(2, double_field(1, scale) + double_field(2, scale))
+    transform += bytes_field(3, double_field(1, -180.0) + double_field(2, 90.0))
+    result += bytes_field(12, transform)
+    for name in fields:
+        result += bytes_field(13, bytes_field(1, name.encode("utf-8")))
+
+    for i, attrs in enumerate(attributes):
+        feature = b"".join(bytes_field(1, _pbf_value(attrs.get(name))) for name in fields)
+        if rings is not None:
+            lengths = b"".join(encode_varint(len(ring)) for ring in rings[i])
+            coords = bytearray()
+            px = py = 0
+            for ring in rings[i]:
+                for x, y in ring:
+                    qx = round((x + 180.0) / scale)
+                    qy = round((90.0 - y) / scale)
+                    coords += encode_varint(zigzag_encode(qx - px)) + encode_varint(zigzag_encode(qy - py))
+                    px, py = qx, qy
+            feature += bytes_field(2, varint_field(1, 3) + bytes_field(2, lengths) + bytes_field(3, bytes(coords)))
+        result += bytes_field(15, feature)
+    return _pbf_message(bytes_field(1, result))
+
+
+# --- HTTP side --------------------------------------------------------------
+
+class TokenBucket:
+    """`rate` requests/sec with bursts up to `burst`; rate <= 0 means unlimited"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store, port=0, latency=0.0, jitter=0.0, rate_limit=0.0, burst=None, host="127.0.0.1"):
+        super().__init__((host, port), StandInHandler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def root_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    @property
+    def proxy_url(self):
+        return self.root_url.rstrip("/") + PROXY_PATH
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats.clear()
+
+    def start(self):
+        """Serve from a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name="mapserver-standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.handle_request(self.rfile.read(length))
+
+    def send_body(self, body, content_type="application/json; charset=utf-8"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def handle_request(self, form):
+        server = self.server
+        path, _, target = self.path.partition("?")
+        if path != PROXY_PATH:
+            self.send_body(b"<html><body>UMAPS stand-in</body></html>", "text/html")
+            return
+
+        # <layer URL>[/query]?<params>; the form body carries POSTed params
+        layer_url, _, query = target.partition("?")
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        params.update(parse_qsl(form.decode("utf-8"), keep_blank_values=True))
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + (random.expovariate(1 / server.jitter) if server.jitter else 0))
+
+        if not server.bucket.take():
+            server.count("throttled")
+            self.send_json(THROTTLED)
+            return
+
+        if not layer_url.endswith("/query"):
+            server.count("layer")
+            self.send_json({"id": 28, "name": "SubDivisionParcelBoundary", "maxRecordCount": MAX_RECORD_COUNT,
+                            "fields": [{"name": f} for f in FIELDS]})
+            return
+        self.query(params)
+
+    def query(self, params):
+        server = self.server
+        store = server.store
+        pbf = params.get("f") == "pbf"
+
+        if params.get("objectIds"):
+            rows = store.rows_for_ids([int(i) for i in params["objectIds"].split(",") if i.strip()])
+            where = params.get("where")
+            if where and where.strip() != "1=1":
+                matching = store.select(where)
+                if matching is None:
+                    server.count("bad_query")
+                    self.send_json(BAD_QUERY)
+                    return
+                rows = np.intersect1d(rows, matching)
+        else:
+            rows = store.select(params.get("where", "1=1"))
+            if rows is None:
+                server.count("bad_query")
+                self.send_json(BAD_QUERY)
+                return
+
+        if params.get("geometry"):
+            envelope = parse_envelope(params)
+            if envelope is None:
+                server.count("bad_query")
+                self.send_json(BAD_QUERY)
+                return
+            rows = store.intersecting(rows, envelope)
+
+        if params.get("returnExtentOnly") == "true":
+            server.count("extent")
+            extent = store.extent(rows)
+            names = ("xmin", "ymin", "xmax", "ymax")
+            values = extent if extent is not None else ("NaN",) * 4
+            self.send_json({"extent": dict(zip(names, values), spatialReference={"wkid": 4326})})
+            return
+
+        if params.get("returnCountOnly") == "true":
+            server.count("count")
+            if pbf:
+                self.send_body(pbf_count(len(rows)), "application/x-protobuf")
+            else:
+                self.send_json({"count": len(rows)})
+            return
+        if params.get("returnIdsOnly") == "true":
+            server.count("ids")
+            ids = store.object_ids[rows].tolist()
+            if pbf:
+                self.send_body(pbf_ids(ids), "application/x-protobuf")
+            else:
+                self.send_json({"objectIdFieldName": "OBJECTID", "objectIds": ids})
+            return
+
+        limit = min(int(params.get("resultRecordCount") or MAX_RECORD_COUNT), MAX_RECORD_COUNT)
+        exceeded = len(rows) > limit
+        rows = rows[:limit]
+        out_fields = params.get("outFields") or "*"
+        fields = FIELDS if out_fields.strip() == "*" else [f.strip() for f in out_fields.split(",") if f.strip()]
+        attributes = store.attributes(rows, fields)
+        rings = store.rings(rows) if params.get("returnGeometry", "true") != "false" else None
+        server.count("query")
+        server.count("features", len(rows))
+
+        if pbf:
+            self.send_body(pbf_features(fields, attributes, rings, exceeded), "application/x-protobuf")
+            return
+        features = []
+        for i, attrs in enumerate(attributes):
+            feature = {"attributes": attrs}
+            if rings is not None:
+                feature["geometry"] = {"rings": rings[i]}
+            features.append(feature)
+        response = {
+            "objectIdFieldName": "OBJECTID",
+            "geometryType": "esriGeometryPolygon",
+            "fields": [{"name": f} for f in fields],
+            "features": features
+        }
+        if exceeded:
+            response["exceededTransferLimit"] = True
+        self.send_json(response)
+
+
+def parse_envelope(params):
+    """(xmin, ymin, xmax, ymax) of an envelope `geometry` parameter, or None if unsupported"""
+    if params.get("geometryType", "esriGeometryEnvelope") != "esriGeometryEnvelope":
+        return None
+    if params.get("spatialRel", SPATIAL_RELATIONS[0]) not in SPATIAL_RELATIONS:
+        return None
+    text = params["geometry"].strip()
+    try:
+        if text.startswith("{"):
+            geometry = json.loads(text)
+            return tuple(float(geometry[k]) for k in ("xmin", "ymin", "xmax", "ymax"))
+        values = tuple(float(v) for v in text.split(","))
+    except (ValueError, KeyError, TypeError):
+        return None
+    return values if len(values) == 4 else None
+
+
+def parse_cities(specs):
+    """["00100002:50000", ...] -> [("00100002", 50000), ...]"""
+    cities = []
+    for spec in specs or ():
+        city, _, count = spec.partition(":")
+        cities.append((city, int(count or 100000)))
+    return cities
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the UMAPS parcel MapServer")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--parcels", type=int, default=RIYADH_PARCELS, help="Synthetic Riyadh parcels")
+    parser.add_argument("--city", action="append", default=[], metavar="CITY_ID:COUNT",
+                        help="Extra synthetic city, e.g. 00100002:200000 (repeatable)")
+    parser.add_argument("--latency", type=float, default=0, help="Injected latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="Mean extra exponential latency (ms)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Requests/sec before answering 403 (0 = off)")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size for --rate-limit")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic parcels")
+    parser.add_argument("--sample", type=str, default="riyadh_parcels_sample.json",
+                        help="Recorded parcels to copy attributes from")
+    args = parser.parse_args()
+
+    print("Generating parcels...")
+    store = ParcelStore(args.parcels, parse_cities(args.city), seed=args.seed, sample=args.sample)
+    server = StandInServer(store, args.port, args.latency / 1000, args.jitter / 1000, args.rate_limit, args.burst,
+                           host=args.host)
+    print(f"Serving {len(store):,} parcels ({', '.join(store.city_ids)}) at {server.proxy_url}")
+    print(f"  export UMAPS_PROXY_URL={server.proxy_url} UMAPS_HOME_URL={server.root_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopped. Requests: {dict(server.stats)}")
+        server.server_close()
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Tiled, merged Overpass queries for the OSM fetchers
+
+Instead of one full-bbox request per tag filter, the filters are merged per
+tag key into a handful of union clauses (["building"~"^(house|villa|...)$"],
+["shop"], ...), and the union runs once per spatial tile:
+
+  (
+    nwr["building"~"^(...)$"](s,w,n,e);
+    nwr["shop"](s,w,n,e);
+  )->.hits;
+  node.hits; out qt;
+  (way.hits; relation.hits;); out tags center qt;
+
+so an element matching several filters is downloaded once, and ways come
+back with their tags and center only (no node lists). Tiles run in parallel
+on a shared AdaptiveLimiter. A tile that hits the Overpass timeout or
+maxsize limit (a "runtime error" remark) splits into its four quadrants;
+429/504 answers back off and retry.
+
+Ways and relations that cross a tile edge are returned by every tile they
+touch, so each tile keeps only the elements whose center lies in it
+(half-open on the max edges; centers outside the root bbox count for the
+nearest tile).
+
+Responses are parsed as they stream in (ElementStream) and handed on in
+small batches through a bounded queue, so the first elements reach the
+caller while the download is still running and memory stays flat however
+large a tile is. If a tile has to be queried again after part of it was
+handed on (a split after a late runtime error, or a dropped connection),
+those elements are skipped the second time.
+
+Refreshes ask for an augmented diff instead ([adiff:"<last sync>"] with
+`out center meta`): only the elements created, modified or deleted (or
+moved out of the query) since then come back, as XML, parsed while it
+streams (DiffStream).
+
+OVERPASS_URL points the fetchers elsewhere, e.g. at overpass_standin.py.
+"""
+
+import codecs
+import json
+import os
+import queue
+import re
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawl_metrics import SIZE_BUCKETS, get_metrics
+from rate_control import AdaptiveLimiter
+
+OVERPASS_URL = os.environ.get("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+QUERY_TIMEOUT = 180               # [timeout:] per tile, seconds
+MAX_SIZE = 256 * 1024 * 1024      # [maxsize:] per tile, bytes
+MIN_TILE_SPAN = 0.005             # degrees; smaller tiles are not split further
+MAX_RETRIES = 8
+STREAM_CHUNK = 64 * 1024          # bytes read from the socket at a time
+STREAM_BATCH = 1000               # elements handed to the caller at a time
+HEADERS = {"User-Agent": "riyadh-osm-fetch/1.0"}
+
+_FILTER = re.compile(r'^\[\s*"?([\w:]+)"?\s*(?:=\s*"?([^"\]]*)"?)?\s*\]$')
+_ELEMENTS = re.compile(r'"elements"\s*:\s*\[')
+_OSM_BASE = re.compile(r'"timestamp_osm_base"\s*:\s*"([^"]+)"')
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+class OverpassTooLarge(Exception):
+    """The tile's query hit the server's timeout or memory limit"""
+
+
+class OverpassError(Exception):
+    """The server rejected the query or kept failing"""
+
+
+def parse_filter(query_filter):
+    """'[building=house]' -> ('building', 'house'); '[shop]' -> ('shop', None)"""
+    match = _FILTER.match(query_filter.strip())
+    if not match:
+        raise ValueError(f"Unsupported tag filter: {query_filter}")
+    return match.group(1), match.group(2)
+
+
+def merge_filters(query_filters):
+    """
+    Merge tag filters by key: [(key, values)] in first-seen order, where
+    values is a sorted list, or None when any value matches
+    """
+    merged = {}
+    for query_filter in query_filters:
+        key, value = parse_filter(query_filter)
+        if value is None or merged.get(key, ()) is None:
+            merged[key] = None
+        else:
+            merged.setdefault(key, set()).add(value)
+    return [(key, None if values is None else sorted(values)) for key, values in merged.items()]
+
+
+def filter_clause(key, values):
+    if values is None:
+        return f'["{key}"]'
+    if len(values) == 1:
+        return f'["{key}"="{values[0]}"]'
+    return f'["{key}"~"^({"|".join(re.escape(v) for v in values)})$"]'
+
+
+def format_bbox(bbox):
+    """Overpass bbox order: south,west,north,east, exact to OSM's 7 decimals so the query covers the whole tile"""
+    return ",".join(f"{v:.7f}".rstrip("0").rstrip(".") for v in bbox)
+
+
+def union_query(filters, bbox, timeout=QUERY_TIMEOUT, maxsize=MAX_SIZE):
+    """One Overpass QL request for every merged filter inside `bbox` (south, west, north, east)"""
+    area = format_bbox(bbox)
+    clauses = "\n".join(f"  nwr{filter_clause(key, values)}({area});" for key, values in filters)
+    return (f"[out:json][timeout:{timeout}][maxsize:{maxsize}];\n"
+            f"(\n{clauses}\n)->.hits;\n"
+            "node.hits;\nout qt;\n"
+            "(way.hits; relation.hits;);\nout tags center qt;\n")
+
+
+def diff_query(filters, bbox, since, timeout=QUERY_TIMEOUT, maxsize=MAX_SIZE):
+    """Augmented diff of the merged filters inside `bbox` between `since` (an osm_base timestamp) and now"""
+    area = format_bbox(bbox)
+    clauses = "\n".join(f"  nwr{filter_clause(key, values)}({area});" for key, values in filters)
+    return (f'[out:xml][timeout:{timeout}][maxsize:{maxsize}][adiff:"{since}"];\n'
+            f"(\n{clauses}\n);\n"
+            "out center meta;\n")
+
+
+def bbox_tuple(bbox):
+    """RIYADH_BBOX-style dict -> (south, west, north, east)"""
+    return (bbox["south"], bbox["west"], bbox["north"], bbox["east"])
+
+
+def grid_tiles(bbox, grid):
+    """Split (south, west, north, east) into grid x grid tiles, south-west first"""
+    # Inner edges are rounded to OSM's 7 decimals, so owns() and the query text agree on them
+    south, west, north, east = bbox
+    lats = [south] + [round(south + i * (north - south) / grid, 7) for i in range(1, grid)] + [north]
+    lons = [west] + [round(west + i * (east - west) / grid, 7) for i in range(1, grid)] + [east]
+    return [(lats[row], lons[col], lats[row + 1], lons[col + 1]) for row in range(grid) for col in range(grid)]
+
+
+def quadrants(tile):
+    return grid_tiles(tile, 2)
+
+
+def element_center(element):
+    """(lat, lon) of a node, or the center Overpass computed for a way or relation"""
+    if element.get("type") == "node":
+        return element.get("lat"), element.get("lon")
+    center = element.get("center") or {}
+    return center.get("lat"), center.get("lon")
+
+
+def owns(tile, root, lat, lon):
+    """Whether `tile` is the one tile of `root` responsible for the point (lat, lon)"""
+    south, west, north, east = tile
+    lat = min(max(lat, root[0]), root[2])
+    lon = min(max(lon, root[1]), root[3])
+    return ((south <= lat < north or lat == north == root[2])
+            and (west <= lon < east or lon == east == root[3]))
+
+
+class ElementStream:
+    """
+    Incremental parser for an Overpass JSON body. Iterating yields the
+    "elements" one by one while the chunks are still arriving, so neither
+    the body nor the element list is ever held whole. The trailing remark
+    (timeouts and other runtime errors) is in .remark once iteration ends.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.remark = None
+        self.timestamp = None
+        self.bytes = 0
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        scan = json.JSONDecoder().raw_decode
+        buffer = ""
+        pos = 0
+        started = False
+        tail = None
+        for chunk in self.chunks:
+            self.bytes += len(chunk)
+            text = decoder.decode(chunk)
+            if tail is not None:
+                tail.append(text)
+                continue
+            buffer = buffer[pos:] + text
+            pos = 0
+            if not started:
+                match = _ELEMENTS.search(buffer)
+                if not match:
+                    continue
+                base = _OSM_BASE.search(buffer, 0, match.start())
+                self.timestamp = base.group(1) if base else None
+                pos = match.end()
+                started = True
+            while True:
+                pos = _SEPARATOR.match(buffer, pos).end()
+                if pos == len(buffer):
+                    break
+                if buffer[pos] == "]":
+                    tail = [buffer[pos + 1:]]
+                    break
+                try:
+                    element, pos_after = scan(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # the element continues in the next chunk
+                pos = pos_after
+                yield element
+
+        if tail is None:
+            where = "inside the elements array" if started else "before the elements array"
+            raise ValueError(f"Overpass response ended {where}")
+        tail.append(decoder.decode(b"", final=True))
+        rest = "".join(tail).strip().lstrip(",")
+        self.remark = json.loads("{" + rest).get("remark")
+
+
+def _xml_element(node):
+    """An XML node/way/relation from a diff -> the element dict the JSON output would give"""
+    element = {"type": node.tag, "id": int(node.get("id"))}
+    if node.tag == "node" and node.get("lat") is not None:
+        element["lat"] = float(node.get("lat"))
+        element["lon"] = float(node.get("lon"))
+    center = node.find("center")
+    if center is not None:
+        element["center"] = {"lat": float(center.get("lat")), "lon": float(center.get("lon"))}
+    if node.get("version") is not None:
+        element["version"] = int(node.get("version"))
+        element["timestamp"] = node.get("timestamp")
+    if node.get("visible") == "false":
+        element["visible"] = False
+    element["tags"] = {tag.get("k"): tag.get("v") for tag in node.iter("tag")}
+    return element
+
+
+class DiffStream:
+    """
+    Incremental parser for an Overpass augmented diff (XML). Iterating
+    yields (action, element) per <action> as the chunks arrive: "create"
+    and "modify" with the new state, "delete" with the last state the
+    query saw. The database time of the diff is in .timestamp, the remark
+    (if any) in .remark once iteration ends.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.remark = None
+        self.timestamp = None
+        self.bytes = 0
+
+    def __iter__(self):
+        parser = ET.XMLPullParser(events=("start", "end"))
+        path = []         # open tags, root first
+        root = None
+        action = None
+        found = {}        # "old"/"new" -> element of the current action
+        ended = False
+        for chunk in self.chunks:
+            self.bytes += len(chunk)
+            parser.feed(chunk)
+            for event, node in parser.read_events():
+                if event == "start":
+                    root = node if root is None else root
+                    path.append(node.tag)
+                    if node.tag == "action" and len(path) == 2:
+                        action, found = node.get("type"), {}
+                    continue
+                path.pop()
+                if node.tag == "meta":
+                    self.timestamp = node.get("osm_base")
+                elif node.tag == "remark":
+                    self.remark = (node.text or "").strip()
+                elif action and node.tag in ("node", "way", "relation") and path[-1] in ("action", "old", "new"):
+                    # Directly under <action> (a create) or under its <old>/<new>
+                    found["new" if path[-1] == "action" else path[-1]] = _xml_element(node)
+                elif node.tag == "action" and len(path) == 1:
+                    element = found.get("old", found.get("new")) if action == "delete" else found.get("new")
+                    if element is not None:
+                        yield action, element
+                    action = None
+                    root.clear()
+                if not path:
+                    ended = True
+        parser.close()
+        if not ended:
+            raise ValueError("Overpass diff ended before </osm>")
+
+
+class OverpassClient:
+    """
+    Pooled Overpass client shared by the tile workers. Counts requests,
+    bytes and splits for the final report.
+    """
+
+    def __init__(self, url=OVERPASS_URL, workers=2, rate=1.0, max_rate=None, timeout=QUERY_TIMEOUT):
+        self.url = url
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_maxsize=self.workers, pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Tile queries legitimately differ by minutes; only a very slow server counts as congestion
+        self.limiter = AdaptiveLimiter(rate, max_rate=max_rate, max_concurrency=self.workers, latency_floor=60.0)
+        self.requests = 0
+        self.bytes = 0
+        self.splits = 0
+        # Oldest database time (osm_base) among the answers so far, or None once an answer lacked one
+        self.timestamp = None
+        self.untimed = False
+        self.lock = threading.Lock()
+
+    def _count(self, size, timestamp=None):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            # ISO 8601 UTC strings sort chronologically
+            if timestamp and not self.untimed and (self.timestamp is None or timestamp < self.timestamp):
+                self.timestamp = timestamp
+        get_metrics().observe("overpass_response_bytes", size, SIZE_BUCKETS)
+
+    def _untimed(self):
+        """An answer did not report its database time, so no time is safe to diff from"""
+        with self.lock:
+            self.untimed = True
+            self.timestamp = None
+
+    def open(self, ql):
+        """POST one query and return the streaming response once it answers 200; busy answers are retried"""
+        metrics = get_metrics()
+        for attempt in range(MAX_RETRIES):
+            ticket = self.limiter.wait()
+            try:
+                response = self.session.post(self.url, data={"data": ql}, timeout=self.timeout + 60, stream=True)
+            except requests.RequestException as e:
+                self.limiter.backoff(ticket, "failed_request")
+                metrics.inc("overpass_responses_total", status="error")
+                print(f"    Overpass request failed ({e}); retry {attempt + 1}/{MAX_RETRIES}")
+                continue
+
+            metrics.inc("overpass_responses_total", status=response.status_code)
+            if response.status_code == 200:
+                self.limiter.success(ticket)
+                return response
+            self._count(len(response.content))
+            if response.status_code in (429, 503, 504):
+                self.limiter.backoff(ticket, "throttled")
+                print(f"    Overpass busy ({response.status_code}); backing off ({self.limiter.summary()})")
+                continue
+            self.limiter.release(ticket)
+            raise OverpassError(f"HTTP {response.status_code}: {response.text[:200]}")
+        raise OverpassError(f"Giving up after {MAX_RETRIES} attempts")
+
+    def stream(self, ql):
+        """
+        Yield the elements of one query as they arrive. Raises
+        OverpassTooLarge after the last element if the server reported a
+        runtime error (what came before it is then incomplete).
+        """
+        response = self.open(ql)
+        elements = ElementStream(response.iter_content(STREAM_CHUNK))
+        try:
+            yield from elements
+        finally:
+            response.close()
+            self._count(elements.bytes, elements.timestamp)
+        if elements.timestamp is None:
+            self._untimed()
+        if elements.remark and "runtime error" in elements.remark:
+            raise OverpassTooLarge(elements.remark)
+
+    def diff(self, ql):
+        """(action, element) pairs of one augmented diff query, with the same runtime error handling as stream()"""
+        response = self.open(ql)
+        changes = DiffStream(response.iter_content(STREAM_CHUNK))
+        try:
+            yield from changes
+        finally:
+            response.close()
+            self._count(changes.bytes, changes.timestamp)
+        if changes.timestamp is None:
+            self._untimed()
+        if changes.remark and "runtime error" in changes.remark:
+            raise OverpassTooLarge(changes.remark)
+
+    def fetch_diff(self, filters, bbox, since, min_span=MIN_TILE_SPAN):
+        """
+        What changed for the merged `filters` inside `bbox` since `since`:
+        {(type, id): (action, element)}, one entry per element. The whole
+        bbox is asked at once (a day's diff is small); a runtime error splits
+        it into quadrants like fetch_tiles. An element reported by several
+        tiles (a way across an edge) counts as present if any tile still has
+        it. The database time to store as the next `since` is in
+        self.timestamp afterwards (None if an answer did not report one).
+        """
+        changes = {}
+        pending = [bbox]
+        while pending:
+            tile = pending.pop()
+            found = {}
+            try:
+                for action, element in self.diff(diff_query(filters, tile, since, self.timeout)):
+                    found[(element["type"], element["id"])] = (action, element)
+            except OverpassTooLarge as error:
+                if min(tile[2] - tile[0], tile[3] - tile[1]) / 2 < min_span:
+                    raise OverpassError(f"Diff for {format_bbox(tile)} is too large even at the minimum size: {error}")
+                with self.lock:
+                    self.splits += 1
+                get_metrics().inc("overpass_tile_splits_total")
+                pending.extend(quadrants(tile))
+                continue
+            for key, change in found.items():
+                if change[0] != "delete" or changes.get(key, ("delete",))[0] == "delete":
+                    changes[key] = change
+        return changes
+
+    def fetch_tiles(self, filters, bbox, grid=2, min_span=MIN_TILE_SPAN):
+        """
+        Run the merged `filters` over `bbox` tile by tile. Yields (tile,
+        elements, done) while the responses stream in: `elements` is a batch
+        of at most STREAM_BATCH, each element from exactly one tile, and
+        `done` marks a tile's last batch. At most a few batches per worker
+        are buffered, so memory does not grow with the size of the area.
+        Tiles can be answered at different database times; self.timestamp
+        keeps the oldest, the one a later diff must start from so that no
+        edit between the tile answers is missed.
+        """
+        results = queue.Queue(maxsize=4 * self.workers)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def run(tile, skip):
+            # Elements already passed on for this area (before a split or a dropped
+            # connection) are skipped when the query runs again
+            emitted = set()
+            ql = union_query(filters, tile, self.timeout)
+            try:
+                for attempt in range(MAX_RETRIES):
+                    batch = []
+                    try:
+                        for element in self.stream(ql):
+                            lat, lon = element_center(element)
+                            if lat is None or lon is None or not owns(tile, bbox, lat, lon):
+                                continue
+                            key = (element["type"], element["id"])
+                            if key in skip or key in emitted:
+                                continue
+                            batch.append(element)
+                            if len(batch) >= STREAM_BATCH:
+                                if not put(("batch", tile, batch)):
+                                    return
+                                emitted.update((el["type"], el["id"]) for el in batch)
+                                batch = []
+                        put(("batch", tile, batch))
+                        put(("done", tile, None))
+                        return
+                    except OverpassTooLarge as error:
+                        if put(("batch", tile, batch)):
+                            emitted.update((el["type"], el["id"]) for el in batch)
+                        put(("split", tile, (error, skip | emitted)))
+                        return
+                    except (requests.RequestException, ValueError) as error:
+                        if put(("batch", tile, batch)):
+                            emitted.update((el["type"], el["id"]) for el in batch)
+                        print(f"    Tile {format_bbox(tile)} broke off ({error}); retry {attempt + 1}/{MAX_RETRIES}")
+                raise OverpassError(f"Tile {format_bbox(tile)} kept failing")
+            except Exception as error:
+                put(("error", tile, error))
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            active = 0
+            for tile in grid_tiles(bbox, grid):
+                pool.submit(run, tile, frozenset())
+                active += 1
+            while active:
+                kind, tile, payload = results.get()
+                if kind == "batch":
+                    if payload:
+                        yield tile, payload, False
+                elif kind == "done":
+                    active -= 1
+                    yield tile, [], True
+                elif kind == "split":
+                    active -= 1
+                    error, skip = payload
+                    if min(tile[2] - tile[0], tile[3] - tile[1]) / 2 < min_span:
+                        raise OverpassError(f"Tile {format_bbox(tile)} is too large even at the minimum size: {error}")
+                    with self.lock:
+                        self.splits += 1
+                    get_metrics().inc("overpass_tile_splits_total")
+                    for quadrant in quadrants(tile):
+                        pool.submit(run, quadrant, frozenset(skip))
+                        active += 1
+                else:
+                    raise payload
+        finally:
+            stop.set()
+            pool.shutdown(wait=True)
+
+    def summary(self):
+        return (f"{self.requests:,} requests, {self.bytes / 1e6:,.1f} MB, {self.splits:,} tiles split, "
+                f"pacing {self.limiter.summary()}")
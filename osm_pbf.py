@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Offline ingestion of OpenStreetMap .osm.pbf extracts
+
+Reads a local extract (a country or GCC-states file from a mirror) instead
+of asking Overpass, and produces the same Overpass-style elements the
+fetchers already handle: {"type", "id", "lat"/"lon" or "center", "tags"}.
+Only elements matching the merged tag filters (osm_overpass.merge_filters)
+inside the bbox are kept; ways and relations get the center of their
+bounding box, as Overpass's `out center` reports it.
+
+The file is a sequence of zlib blobs, each an independent PrimitiveBlock,
+so blocks are decoded in parallel on a process pool (the parent only reads
+the blob index). Up to three passes run, each over just the blocks it
+needs:
+
+  1. every block: tagged nodes that match (emitted straight away) and the
+     coordinates of every node within AREA_MARGIN of the bbox
+  2. way blocks: ways that match and reference one of those area nodes,
+     and relations that match
+  3. way blocks, only if relations matched: node refs of their member ways
+     that reference an area node
+
+So what the parent holds scales with the area around the bbox, not with
+the extract. Dense node tags are matched with NumPy over the whole block;
+a way or relation is only decoded past its keys when one of them is a
+filter key, and a way's tags are only built once it is known to reach the
+area. Node refs outside the area (a way reaching far beyond the bbox) are
+left out of the center.
+"""
+
+import lzma
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pbf_wire import iter_fields, packed_sint64, packed_varints, read_string, read_varint, signed64, zigzag_decode
+
+SUPPORTED_FEATURES = {"OsmSchema-V0.6", "DenseNodes"}
+AREA_MARGIN = 0.05     # degrees around the bbox whose nodes are kept for way centers
+ELEMENT_BATCH = 10000  # elements per yielded batch
+
+_state = {}
+
+
+class OsmPbfError(ValueError):
+    """The file is not an .osm.pbf extract this reader can handle"""
+
+
+# --- File layout ------------------------------------------------------------
+
+def _blob_header(f):
+    """(blob type, header length, blob size) of the next blob, or None at the end of the file"""
+    prefix = f.read(4)
+    if not prefix:
+        return None
+    if len(prefix) < 4:
+        raise OsmPbfError("Truncated blob header length")
+    (header_size,) = struct.unpack(">I", prefix)
+    blob_type, size = None, None
+    for field, _, value in iter_fields(f.read(header_size)):
+        if field == 1:
+            blob_type = read_string(value)
+        elif field == 3:
+            size = value
+    if size is None:
+        raise OsmPbfError("Blob header without a size")
+    return blob_type, 4 + header_size, size
+
+
+def blob_index(path):
+    """[(offset, size)] of every OSMData blob; checks the OSMHeader's required features"""
+    blobs = []
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            header = _blob_header(f)
+            if header is None:
+                break
+            blob_type, header_size, size = header
+            offset += header_size
+            if blob_type == "OSMHeader":
+                check_header(read_blob(f.read(size)))
+            elif blob_type == "OSMData":
+                blobs.append((offset, size))
+                f.seek(size, os.SEEK_CUR)
+            else:
+                f.seek(size, os.SEEK_CUR)
+            offset += size
+    return blobs
+
+
+def replication_timestamp(path):
+    """
+    Database time the extract reflects (the header's replication timestamp,
+    as mirrors like Geofabrik write it) in Overpass form, or None
+    """
+    with open(path, "rb") as f:
+        header = _blob_header(f)
+        if header is None or header[0] != "OSMHeader":
+            return None
+        for field, _, value in iter_fields(read_blob(f.read(header[2]))):
+            if field == 32:
+                return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(value))
+    return None
+
+
+def check_header(block):
+    required = [read_string(value) for field, _, value in iter_fields(block) if field == 4]
+    unsupported = set(required) - SUPPORTED_FEATURES
+    if unsupported:
+        raise OsmPbfError(f"Unsupported required features: {', '.join(sorted(unsupported))}")
+
+
+def read_blob(data):
+    """Uncompressed payload of one Blob message"""
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            return bytes(value)
+        if field == 3:
+            return zlib.decompress(value)
+        if field == 4:
+            return lzma.decompress(value)
+        if field in (6, 7):
+            raise OsmPbfError("lz4/zstd blobs are not supported; recompress the extract with zlib")
+    raise OsmPbfError("Empty blob")
+
+
+def read_block(offset, size):
+    """(string table, granularity, lat offset, lon offset, group messages) of the PrimitiveBlock at offset"""
+    data = read_blob(os.pread(_state["fd"], size, offset))
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            strings = [read_string(s) for _, _, s in iter_fields(value)]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = signed64(value)
+        elif field == 20:
+            lon_offset = signed64(value)
+    return strings, granularity, lat_offset, lon_offset, groups
+
+
+def _varints(buf):
+    """Short packed varint lists (keys, vals) without NumPy's per-call overhead"""
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+# --- Tag matching -----------------------------------------------------------
+
+class BlockFilter:
+    """The merged filters resolved against one block's string table"""
+
+    def __init__(self, filters, strings):
+        index = {s: i for i, s in enumerate(strings)}
+        self.keys = {}      # key sid -> allowed value sids, or None for any value
+        for key, values in filters:
+            sid = index.get(key)
+            if sid is not None:
+                self.keys[sid] = None if values is None else {index[v] for v in values if v in index}
+        self.key_array = np.fromiter(self.keys, dtype=np.int64, count=len(self.keys))
+        self.strings = strings
+
+    def matches(self, keys, vals):
+        for k, v in zip(keys, vals):
+            if k in self.keys:
+                allowed = self.keys[k]
+                if allowed is None or v in allowed:
+                    return True
+        return False
+
+    def tags(self, keys, vals):
+        strings = self.strings
+        return {strings[k]: strings[v] for k, v in zip(keys, vals)}
+
+
+def in_bbox(lat, lon, bbox, margin=0.0):
+    south, west, north, east = bbox
+    return (lat >= south - margin) & (lat <= north + margin) & (lon >= west - margin) & (lon <= east + margin)
+
+
+# --- Worker side ------------------------------------------------------------
+
+def _init_worker(path, filters, bbox, extra):
+    _state["fd"] = os.open(path, os.O_RDONLY)
+    _state["filters"] = filters
+    _state["bbox"] = bbox
+    _state.update(extra)
+
+
+def _dense_nodes(group, granularity, lat_offset, lon_offset):
+    """(ids, lat, lon, keys_vals) of a DenseNodes message"""
+    ids = lat = lon = None
+    keys_vals = np.zeros(0, dtype=np.int64)
+    for field, _, value in iter_fields(group):
+        if field == 1:
+            ids = np.cumsum(packed_sint64(value))
+        elif field == 8:
+            lat = (lat_offset + granularity * np.cumsum(packed_sint64(value))) / 1e9
+        elif field == 9:
+            lon = (lon_offset + granularity * np.cumsum(packed_sint64(value))) / 1e9
+        elif field == 10:
+            keys_vals = packed_varints(value).astype(np.int64)
+    return ids, lat, lon, keys_vals
+
+
+def _plain_nodes(messages, granularity, lat_offset, lon_offset):
+    """The same columns for (rare) non-dense Node messages"""
+    ids, lats, lons, keys_vals = [], [], [], []
+    for message in messages:
+        keys = vals = ()
+        for field, _, value in iter_fields(message):
+            if field == 1:
+                ids.append(zigzag_decode(value))
+            elif field == 2:
+                keys = _varints(value)
+            elif field == 3:
+                vals = _varints(value)
+            elif field == 8:
+                lats.append((lat_offset + granularity * zigzag_decode(value)) / 1e9)
+            elif field == 9:
+                lons.append((lon_offset + granularity * zigzag_decode(value)) / 1e9)
+        for k, v in zip(keys, vals):
+            keys_vals += [k, v]
+        keys_vals.append(0)
+    return (np.array(ids, dtype=np.int64), np.array(lats), np.array(lons), np.array(keys_vals, dtype=np.int64))
+
+
+def _node_groups(strings_groups):
+    """Yield the node columns of every node group in a block"""
+    strings, granularity, lat_offset, lon_offset, groups = strings_groups
+    for group in groups:
+        plain = []
+        for field, _, value in iter_fields(group):
+            if field == 2:
+                yield _dense_nodes(value, granularity, lat_offset, lon_offset)
+            elif field == 1:
+                plain.append(value)
+        if plain:
+            yield _plain_nodes(plain, granularity, lat_offset, lon_offset)
+
+
+def _matching_nodes(block_filter, ids, lat, lon, keys_vals, bbox):
+    """Overpass-style dicts for the tagged nodes that match, found without a per-node loop"""
+    if not len(keys_vals) or not len(block_filter.key_array) or len(keys_vals) == len(ids):
+        return []
+    ends = np.flatnonzero(keys_vals == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Keys sit at even offsets inside each node's run of pairs
+    offset = np.arange(len(keys_vals)) - np.repeat(starts, ends - starts + 1)
+    candidates = np.flatnonzero((offset % 2 == 0) & np.isin(keys_vals, block_filter.key_array))
+    if not len(candidates):
+        return []
+    rows = np.unique(np.searchsorted(ends, candidates))
+    rows = rows[in_bbox(lat[rows], lon[rows], bbox)]
+
+    elements = []
+    for row in rows:
+        pairs = keys_vals[starts[row]:ends[row]]
+        keys, vals = pairs[0::2].tolist(), pairs[1::2].tolist()
+        if block_filter.matches(keys, vals):
+            elements.append({"type": "node", "id": int(ids[row]), "lat": round(float(lat[row]), 7),
+                             "lon": round(float(lon[row]), 7), "tags": block_filter.tags(keys, vals)})
+    return elements
+
+
+def _delta_runs(buffers):
+    """Decode many packed sint64 delta runs (way refs) in one go -> (values, run lengths)"""
+    data = b"".join(buffers)
+    sizes = np.array([len(b) for b in buffers], dtype=np.int64)
+    terminators = np.concatenate(([0], np.cumsum(np.frombuffer(data, dtype=np.uint8) < 0x80)))
+    counts = np.diff(terminators[np.cumsum(sizes)], prepend=0)
+    values = np.cumsum(packed_sint64(data))
+    before = np.concatenate(([0], values))[np.cumsum(counts) - counts]
+    return values - np.repeat(before, counts), counts
+
+
+def _touches_area(refs, counts):
+    """Per run of refs: whether any of them is an area node"""
+    area = _state["area"]
+    touches = np.zeros(len(counts), dtype=bool)
+    nonempty = counts > 0
+    if not len(area) or not nonempty.any():
+        return touches
+    slot = np.minimum(np.searchsorted(area, refs), len(area) - 1)
+    hits = (area[slot] == refs).astype(np.int64)
+    touches[nonempty] = np.add.reduceat(hits, (np.cumsum(counts) - counts)[nonempty]) > 0
+    return touches
+
+
+def _scan_nodes(blob):
+    """Pass 1 over one block"""
+    block = read_block(*blob)
+    block_filter = BlockFilter(_state["filters"], block[0])
+    bbox = _state["bbox"]
+    result = {"nodes": [], "area": [], "has_ways": False}
+
+    for ids, lat, lon, keys_vals in _node_groups(block):
+        if len(ids):
+            result["nodes"] += _matching_nodes(block_filter, ids, lat, lon, keys_vals, bbox)
+            near = in_bbox(lat, lon, bbox, AREA_MARGIN)
+            if near.any():
+                result["area"].append((ids[near], lat[near], lon[near]))
+    for group in block[4]:
+        for field, _, _ in iter_fields(group):
+            if field in (3, 4):
+                result["has_ways"] = True
+                break
+    return result
+
+
+def _scan_ways(blob):
+    """Pass 2 over one way block"""
+    strings, _, _, _, groups = read_block(*blob)
+    block_filter = BlockFilter(_state["filters"], strings)
+    result = {"way_ids": [], "way_tags": [], "relations": []}
+
+    ways = []
+    for group in groups:
+        for field, _, message in iter_fields(group):
+            if field == 3:
+                way = _tagged_member(message, block_filter, 8)
+                if way is not None:
+                    ways.append(way)
+            elif field == 4:
+                relation = _tagged_member(message, block_filter, 9, with_types=True)
+                if relation is not None:
+                    relation_id, keys, vals, (memids, types) = relation
+                    result["relations"].append((relation_id, block_filter.tags(keys, vals),
+                                                np.cumsum(packed_sint64(memids)),
+                                                packed_varints(types).astype(np.int8)))
+
+    refs, counts = _delta_runs([refs for _, _, _, refs in ways])
+    keep = _touches_area(refs, counts)
+    for (way_id, keys, vals, _), kept in zip(ways, keep.tolist()):
+        if kept:
+            result["way_ids"].append(way_id)
+            result["way_tags"].append(block_filter.tags(keys, vals))
+    result["way_refs"], result["way_counts"] = refs[np.repeat(keep, counts)], counts[keep]
+    return result
+
+
+def _tagged_member(message, block_filter, refs_field, with_types=False):
+    """(id, keys, vals, raw refs) of a Way/Relation message whose tags match, else None"""
+    element_id = 0
+    keys = vals = ()
+    refs = types = b""
+    for field, _, value in iter_fields(message):
+        if field == 1:
+            element_id = signed64(value)
+        elif field == 2:
+            keys = _varints(value)
+            if not any(k in block_filter.keys for k in keys):
+                return None
+        elif field == 3:
+            vals = _varints(value)
+        elif field == refs_field:
+            refs = value
+        elif field == 10 and with_types:
+            types = value
+    if not keys or not block_filter.matches(keys, vals):
+        return None
+    return element_id, keys, vals, (refs, types) if with_types else refs
+
+
+def _member_way_refs(blob):
+    """Pass 3 over one way block: (ids, refs, ref counts) of the relation member ways that reach the area"""
+    wanted = _state["member_ways"]
+    ids, refs = [], []
+    for group in read_block(*blob)[4]:
+        for field, _, message in iter_fields(group):
+            if field != 3:
+                continue
+            way_id = None
+            for way_field, _, value in iter_fields(message):
+                if way_field == 1:
+                    way_id = signed64(value)
+                    if way_id not in wanted:
+                        break
+                elif way_field == 8:
+                    ids.append(way_id)
+                    refs.append(value)
+    refs, counts = _delta_runs(refs)
+    keep = _touches_area(refs, counts)
+    return [i for i, kept in zip(ids, keep.tolist()) if kept], refs[np.repeat(keep, counts)], counts[keep]
+
+
+# --- Parent side ------------------------------------------------------------
+
+def _run_pass(path, filters, bbox, processes, fn, blobs, extra=None):
+    """Map fn over blobs on a fresh pool (state is handed over once per process)"""
+    if not blobs:
+        return
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(path, filters, bbox, extra or {})) as pool:
+        yield from pool.map(fn, blobs, chunksize=max(1, min(16, len(blobs) // (4 * processes))))
+
+
+def _extents(refs, counts, node_ids, node_lat, node_lon):
+    """Per run of refs: (south, west, north, east) over the refs with known coordinates (NaN if none)"""
+    extents = np.full((len(counts), 4), np.nan)
+    nonempty = counts > 0
+    if not len(node_ids) or not nonempty.any():
+        return extents
+    slot = np.minimum(np.searchsorted(node_ids, refs), len(node_ids) - 1)
+    found = node_ids[slot] == refs
+    lat = np.where(found, node_lat[slot], np.nan)
+    lon = np.where(found, node_lon[slot], np.nan)
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    extents[nonempty, 0] = np.fmin.reduceat(lat, starts)
+    extents[nonempty, 1] = np.fmin.reduceat(lon, starts)
+    extents[nonempty, 2] = np.fmax.reduceat(lat, starts)
+    extents[nonempty, 3] = np.fmax.reduceat(lon, starts)
+    return extents
+
+
+def _centered(element_type, element_id, tags, extent, bbox):
+    south, west, north, east = extent
+    if np.isnan(south) or north < bbox[0] or south > bbox[2] or east < bbox[1] or west > bbox[3]:
+        return None
+    return {"type": element_type, "id": int(element_id),
+            "center": {"lat": round((south + north) / 2, 7), "lon": round((west + east) / 2, 7)}, "tags": tags}
+
+
+def _concat(arrays, dtype=np.int64):
+    return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+
+def read_elements(path, filters, bbox, processes=None):
+    """
+    Matching elements of the extract inside bbox (south, west, north, east).
+    Yields (stage, elements, done) like OverpassClient.fetch_tiles: tagged
+    nodes while the first pass runs, then ways, then relations.
+    """
+    processes = processes or os.cpu_count() or 1
+    blobs = blob_index(path)
+    way_blocks = []
+    node_ids, node_lat, node_lon = [], [], []
+    for blob, result in zip(blobs, _run_pass(path, filters, bbox, processes, _scan_nodes, blobs)):
+        if result["has_ways"]:
+            way_blocks.append(blob)
+        for ids, lat, lon in result["area"]:
+            node_ids.append(ids)
+            node_lat.append(lat)
+            node_lon.append(lon)
+        if result["nodes"]:
+            yield "nodes", result["nodes"], False
+    yield "nodes", [], True
+    node_ids, node_lat, node_lon = _concat(node_ids), _concat(node_lat, float), _concat(node_lon, float)
+    order = np.argsort(node_ids, kind="stable")
+    node_ids, node_lat, node_lon = node_ids[order], node_lat[order], node_lon[order]
+    area = {"area": node_ids}
+
+    way_ids, way_tags, way_refs, way_counts = [], [], [], []
+    relations = []
+    for result in _run_pass(path, filters, bbox, processes, _scan_ways, way_blocks, area):
+        way_ids += result["way_ids"]
+        way_tags += result["way_tags"]
+        way_refs.append(result["way_refs"])
+        way_counts.append(result["way_counts"])
+        relations += result["relations"]
+    way_refs, way_counts = _concat(way_refs), _concat(way_counts)
+
+    # Member ways that did not match themselves still shape their relation
+    member_ids, member_refs, member_counts = [], [], []
+    if relations:
+        wanted = {int(m) for _, _, memids, types in relations for m in memids[types == 1]} - set(way_ids)
+        for ids, refs, counts in _run_pass(path, filters, bbox, processes, _member_way_refs, way_blocks,
+                                           dict(area, member_ways=wanted)):
+            member_ids += ids
+            member_refs.append(refs)
+            member_counts.append(counts)
+    member_refs, member_counts = _concat(member_refs), _concat(member_counts)
+    relation_nodes = [memids[types == 0] for _, _, memids, types in relations]
+
+    way_extents = _extents(way_refs, way_counts, node_ids, node_lat, node_lon)
+    batch = []
+    for way_id, tags, extent in zip(way_ids, way_tags, way_extents):
+        element = _centered("way", way_id, tags, extent, bbox)
+        if element is not None:
+            batch.append(element)
+            if len(batch) >= ELEMENT_BATCH:
+                yield "ways", batch, False
+                batch = []
+    yield "ways", batch, True
+
+    extent_of = dict(zip(way_ids, way_extents))
+    extent_of.update(zip(member_ids, _extents(member_refs, member_counts, node_ids, node_lat, node_lon)))
+    batch = []
+    for (relation_id, tags, memids, types), nodes in zip(relations, relation_nodes):
+        boxes = [extent_of[m] for m in memids[types == 1].tolist() if m in extent_of]
+        boxes = np.array(boxes + [_extents(nodes, np.array([len(nodes)]), node_ids, node_lat, node_lon)[0]])
+        if np.isnan(boxes).all():
+            continue
+        extent = (np.nanmin(boxes[:, 0]), np.nanmin(boxes[:, 1]), np.nanmax(boxes[:, 2]), np.nanmax(boxes[:, 3]))
+        element = _centered("relation", relation_id, tags, extent, bbox)
+        if element is not None:
+            batch.append(element)
+    yield "relations", batch, True
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Persisted OSM element store for incremental refreshes
+
+The store keeps the matching OSM elements keyed by (type, id), along
+with the Overpass database time (osm_base) they reflect. The first run
+fills it from a full fetch. Later runs apply only the augmented diff
+since that time (OverpassClient.fetch_diff).
+
+Like crawl_journal, a store directory holds two append-only NDJSON files:
+  elements.ndjson - {"put": element} or {"delete": [type, id]} per line
+  sync.ndjson     - one line per completed sync, written only after its
+                    element lines are on disk: the osm_base it reached,
+                    the data file size at that point and what changed
+
+On open, the element lines are replayed up to the last ledger offset, and
+anything past it is cut off. A full sync starts both files over and
+appends the elements batch by batch as they are fetched; its ledger line
+is written last.
+"""
+
+import json
+import os
+import time
+
+
+class OsmStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_path = os.path.join(directory, "elements.ndjson")
+        self.ledger_path = os.path.join(directory, "sync.ndjson")
+        os.makedirs(directory, exist_ok=True)
+
+        self.elements = {}  # (type, id) -> Overpass-style element
+        self.syncs = []     # ledger entries since the last full sync
+        self.filled = 0     # elements put since begin_full()
+
+        offset = self._load_ledger()
+        self._truncate(self.data_path, offset)
+        self._replay(offset)
+
+        self.data_file = open(self.data_path, "ab")
+        self.ledger_file = open(self.ledger_path, "ab")
+
+    def _load_ledger(self):
+        """Read completed syncs and return the data size they account for"""
+        if not os.path.exists(self.ledger_path):
+            return 0
+
+        valid_bytes = 0
+        with open(self.ledger_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a crash
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                self.syncs.append(entry)
+
+        self._truncate(self.ledger_path, valid_bytes)
+        return self.syncs[-1]["offset"] if self.syncs else 0
+
+    def _replay(self, size):
+        if not size:
+            return
+        with open(self.data_path, "rb") as f:
+            data = f.read(size)
+        for line in data.decode("utf-8").splitlines():
+            record = json.loads(line)
+            if "put" in record:
+                element = record["put"]
+                self.elements[(element["type"], element["id"])] = element
+            else:
+                self.elements.pop(tuple(record["delete"]), None)
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    @property
+    def last_sync(self):
+        """osm_base timestamp the stored elements reflect, or None if the store was never filled"""
+        return self.syncs[-1]["timestamp"] if self.syncs else None
+
+    def _record(self, lines, entry):
+        self.data_file.write("".join(lines).encode("utf-8"))
+        self._sync(self.data_file)
+        entry["offset"] = self.data_file.tell()
+        entry["synced_at"] = time.time()
+        self.ledger_file.write((json.dumps(entry) + "\n").encode("utf-8"))
+        self._sync(self.ledger_file)
+        self.syncs.append(entry)
+
+    def begin_full(self):
+        """
+        Start replacing the store with a full fetch: put_batch() appends the
+        elements as they arrive and commit() records the sync. The elements
+        are not held in memory; reopen the store to apply diffs to it.
+        """
+        # An empty ledger reads as "never synced", so a crash before commit only costs a full fetch
+        for f in (self.ledger_file, self.data_file):
+            f.truncate(0)
+            self._sync(f)
+        self.syncs = []
+        self.elements = None
+        self.filled = 0
+
+    def put_batch(self, elements):
+        """Append one batch of a full fetch (an element seen twice keeps its later copy on replay)"""
+        lines = "".join(json.dumps({"put": e}, ensure_ascii=False) + "\n" for e in elements)
+        self.data_file.write(lines.encode("utf-8"))
+        self.filled += len(elements)
+
+    def commit(self, timestamp, size=0):
+        """Durably record the full fetch begun with begin_full() as reflecting `timestamp`"""
+        self._record([], {"timestamp": timestamp, "full": True, "created": self.filled,
+                          "modified": 0, "deleted": 0, "bytes": size})
+
+    def apply(self, changes, timestamp, size=0):
+        """
+        Durably apply {(type, id): (action, element)} from fetch_diff and
+        move the store to `timestamp`. Returns (created, modified, deleted)
+        as seen by the store.
+        """
+        if self.elements is None:
+            raise RuntimeError("The store was just filled without keeping its elements; reopen it to apply a diff")
+        lines = []
+        created = modified = deleted = 0
+        for key, (action, element) in changes.items():
+            if action == "delete":
+                if key in self.elements:
+                    lines.append(json.dumps({"delete": list(key)}) + "\n")
+                    deleted += 1
+            else:
+                if key in self.elements:
+                    modified += 1
+                else:
+                    created += 1
+                lines.append(json.dumps({"put": element}, ensure_ascii=False) + "\n")
+        self._record(lines, {"timestamp": timestamp, "created": created, "modified": modified,
+                             "deleted": deleted, "bytes": size})
+
+        for key, (action, element) in changes.items():
+            if action == "delete":
+                self.elements.pop(key, None)
+            else:
+                self.elements[key] = element
+        return created, modified, deleted
+
+    def close(self):
+        self.data_file.close()
+        self.ledger_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
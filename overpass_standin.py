@@ -0,0 +1,877 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Overpass API interpreter
+
+Serves synthetic OSM elements for greater Riyadh with the subset of
+Overpass QL the OSM fetchers send, so requests, bytes and tile splitting can
+be measured without loading the public instance:
+
+  settings     [out:json][timeout:N][maxsize:N];
+               [out:xml][adiff:"since"]; (augmented diff, `out ... meta`)
+  queries      node|way|relation|rel|nwr, optionally .set, with tag filters
+               ["k"], ["k"="v"], ["k"~"regex"] (quotes optional) and a
+               (south,west,north,east) bbox
+  unions       ( ...; ...; ) with ->.name on any statement
+  output       out [body|tags|meta] [center] [qt];
+
+Anything else is answered with a 400 and an error page, as Overpass does
+for syntax errors. A query statement that has to look at more than
+--max-elements elements in its bbox returns an empty result with the
+"runtime error: Query timed out" remark; an output larger than the
+request's [maxsize:] (estimated) gets the out-of-memory remark. Requests
+beyond --rate-limit get 429 Too Many Requests. Bodies are rendered while
+they are sent, with chunked transfer encoding, optionally paced to
+--bandwidth so streaming clients can be told apart from buffering ones.
+
+Elements are generated deterministically from a seed: mostly building=yes
+ways around the city center, typed buildings, shops and amenities as nodes,
+plus streets and parks that do not match the fetchers' filters (parks are
+large enough to cross tile edges).
+
+The data can change over time: --edits-per-day edits (tag changes, moves,
+deletions, new elements) are applied every --day-seconds, each advancing
+the database time (timestamp_osm_base) by a day and keeping the previous
+state, so [adiff:] queries can report what changed since a given time as
+Overpass does: create/modify/delete actions with the old and new element.
+
+The same elements can be written out as an .osm.pbf extract (--write-pbf)
+for the offline reader in osm_pbf: way and relation nodes are laid out so
+that the center of their bounding box is the center the stand-in reports.
+
+Usage:
+    python3 overpass_standin.py --port 8766 --elements 400000 --max-elements 150000
+    python3 overpass_standin.py --edits-per-day 2000 --day-seconds 60
+    OVERPASS_URL=http://127.0.0.1:8766/api/interpreter python3 fetch_osm_riyadh.py
+    python3 overpass_standin.py --elements 400000 --write-pbf riyadh-standin.osm.pbf
+"""
+
+import calendar
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from xml.sax.saxutils import quoteattr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import numpy as np
+
+from mapserver_standin import TokenBucket
+from pbf_wire import bytes_field, pack_deltas, pack_varints, varint_field, zigzag_encode
+
+INTERPRETER_PATH = "/api/interpreter"
+RIYADH_AREA = (24.4, 46.4, 25.1, 47.1)   # south, west, north, east
+CITY_CENTER = (24.71, 46.68)
+TYPE_NAMES = ("node", "way", "relation")
+DEFAULT_MAXSIZE = 512 * 1024 * 1024
+ELEMENT_BYTES = 150      # rough output size per element, for the [maxsize:] check
+CHUNK_SIZE = 64 * 1024
+START_TIME = "2024-01-01T00:00:00Z"   # database time of a freshly generated store
+DAY = 86400
+
+# (weight, element type, tag choices, half-size in degrees); tag choices are (weight, tags)
+ELEMENT_KINDS = [
+    (62, "way", [(1, {"building": "yes"})], 0.0002),
+    (12, "way", [(5, {"building": "house"}), (3, {"building": "residential"}), (3, {"building": "apartments"}),
+                 (2, {"building": "villa"}), (1, {"building": "commercial"}), (1, {"building": "retail"}),
+                 (1, {"building": "office"}), (1, {"building": "industrial"}), (1, {"building": "warehouse"}),
+                 (1, {"building": "mosque", "amenity": "place_of_worship", "religion": "muslim"}),
+                 (1, {"building": "school", "amenity": "school"}), (1, {"building": "hotel", "tourism": "hotel"})],
+     0.0003),
+    (8, "node", [(4, {"shop": "supermarket"}), (3, {"shop": "clothes"}), (2, {"shop": "mobile_phone"}),
+                 (2, {"shop": "car_repair"}), (3, {"shop": "convenience"}), (2, {"shop": "bakery"})], 0.0),
+    (6, "node", [(4, {"amenity": "restaurant"}), (3, {"amenity": "cafe"}), (3, {"amenity": "fast_food"}),
+                 (2, {"amenity": "pharmacy"}), (1, {"amenity": "bank"}), (1, {"amenity": "clinic"}),
+                 (1, {"amenity": "fuel"}), (1, {"amenity": "parking"}),
+                 (1, {"amenity": "place_of_worship", "religion": "muslim"})], 0.0),
+    (9, "way", [(5, {"highway": "residential"}), (2, {"highway": "service"}), (1, {"highway": "primary"})], 0.004),
+    (2, "node", [(3, {"highway": "street_lamp"}), (1, {"barrier": "gate"})], 0.0),
+    (1, "way", [(3, {"leisure": "park"}), (1, {"leisure": "stadium"}), (1, {"landuse": "grass"})], 0.004),
+]
+NAMES = ["الرياض", "النخيل", "العليا", "Al Olaya", "King Fahd", "السلام", "الملز", "Riyadh Gallery"]
+
+
+class ElementStore:
+    """Synthetic OSM elements; per-element tags plus numpy arrays for the spatial side"""
+
+    def __init__(self, elements=400000, seed=7, area=RIYADH_AREA):
+        rng = np.random.default_rng(seed)
+        south, west, north, east = area
+        weights = np.array([kind[0] for kind in ELEMENT_KINDS], dtype=float)
+        kinds = rng.choice(len(ELEMENT_KINDS), size=elements, p=weights / weights.sum())
+
+        # Dense core around the center, thinning out towards the edge of the box
+        lat = rng.normal(CITY_CENTER[0], 0.12, elements)
+        lon = rng.normal(CITY_CENTER[1], 0.12, elements)
+        spread = rng.random(elements) < 0.15
+        lat[spread] = rng.uniform(south, north, spread.sum())
+        lon[spread] = rng.uniform(west, east, spread.sum())
+        self.lat = np.round(np.clip(lat, south, north), 7)
+        self.lon = np.round(np.clip(lon, west, east), 7)
+
+        self.type = np.zeros(elements, dtype=np.int8)
+        self.half = np.zeros(elements)
+        self.tags = [None] * elements
+        self.refs = np.zeros(elements, dtype=np.int16)
+        next_id = [1000, 5000000, 90000]
+        self.id = np.zeros(elements, dtype=np.int64)
+        for k, (_, type_name, choices, half) in enumerate(ELEMENT_KINDS):
+            rows = np.flatnonzero(kinds == k)
+            type_code = TYPE_NAMES.index(type_name)
+            self.type[rows] = type_code
+            self.half[rows] = half * rng.uniform(0.5, 1.5, len(rows)) if half else 0.0
+            if type_name != "node":
+                self.refs[rows] = rng.integers(5, 14, len(rows))
+            tag_weights = np.array([w for w, _ in choices], dtype=float)
+            picks = rng.choice(len(choices), size=len(rows), p=tag_weights / tag_weights.sum())
+            named = rng.random(len(rows)) < (0.8 if type_name == "node" else 0.1)
+            for row, pick, has_name in zip(rows, picks, named):
+                tags = dict(choices[pick][1])
+                if has_name:
+                    tags["name"] = NAMES[row % len(NAMES)]
+                self.tags[row] = tags
+        # A handful of building relations (multipolygons) so the relation path is exercised
+        relations = rng.choice(np.flatnonzero(kinds == 0), size=max(1, elements // 2000), replace=False)
+        self.type[relations] = 2
+        for row in relations:
+            self.tags[row] = dict(self.tags[row], type="multipolygon")
+        for type_code in range(3):
+            rows = np.flatnonzero(self.type == type_code)
+            self.id[rows] = next_id[type_code] + np.arange(len(rows)) * 3
+
+        self.osm_base = parse_time(START_TIME)
+        self.version = np.ones(elements, dtype=np.int32)
+        self.changed = np.full(elements, self.osm_base, dtype=np.int64)
+        self.visible = np.ones(elements, dtype=bool)
+        self.history = []   # (time, row, state before the edit, or None for a created row), oldest first
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.tags)
+
+    def in_bbox(self, rows, bbox):
+        """Rows whose extent intersects (south, west, north, east)"""
+        south, west, north, east = bbox
+        lat = self.lat[rows]
+        lon = self.lon[rows]
+        half = self.half[rows]
+        keep = (lat + half >= south) & (lat - half <= north) & (lon + half >= west) & (lon - half <= east)
+        return rows[keep]
+
+    def copy(self):
+        """A store that can be edited while requests still read this one"""
+        other = object.__new__(ElementStore)
+        other.__dict__.update(self.__dict__)
+        for name in ("lat", "lon", "version", "changed", "visible"):
+            setattr(other, name, getattr(self, name).copy())
+        other.tags = list(self.tags)
+        other.history = list(self.history)
+        return other
+
+    def _state(self, row):
+        return (self.lat[row], self.lon[row], self.tags[row], self.version[row], self.changed[row], self.visible[row])
+
+    def mutate(self, edits, at=None, seed=None):
+        """
+        Apply `edits` random edits spread over the time up to `at` (default:
+        a day after the current database time), which becomes the new
+        database time. Returns the number of each kind of edit.
+        """
+        at = at if at is not None else self.osm_base + DAY
+        rng = np.random.default_rng(seed if seed is not None else (self.seed, self.osm_base))
+        times = np.sort(rng.integers(self.osm_base + 1, at + 1, edits))
+        kinds = rng.choice(["tags", "move", "delete", "create"], size=edits, p=[0.5, 0.2, 0.15, 0.15])
+        live = np.flatnonzero(self.visible)
+        rows = rng.choice(live, size=edits, replace=edits > len(live))
+        counts = Counter(kinds.tolist())
+
+        created = []
+        for when, kind, row in zip(times.tolist(), kinds.tolist(), rows.tolist()):
+            if kind == "create":
+                created.append((when, row))
+                continue
+            if not self.visible[row]:
+                counts[kind] -= 1
+                continue
+            self.history.append((when, row, self._state(row)))
+            if kind == "tags":
+                tags = dict(self.tags[row])
+                if tags.get("building") == "yes":
+                    tags["building"] = "house"
+                elif "name" in tags:
+                    del tags["name"]
+                else:
+                    tags["name"] = NAMES[int(rng.integers(len(NAMES)))]
+                self.tags[row] = tags
+            elif kind == "move":
+                self.lat[row] = round(self.lat[row] + rng.normal(0, 0.0005), 7)
+                self.lon[row] = round(self.lon[row] + rng.normal(0, 0.0005), 7)
+            else:
+                self.visible[row] = False
+            self.version[row] += 1
+            self.changed[row] = when
+
+        # New elements copy a neighbour's kind and tags, a little way off
+        if created:
+            times, sources = (np.array(column) for column in zip(*created))
+            first = len(self)
+            new_ids = np.zeros(len(sources), dtype=np.int64)
+            for type_code in range(3):
+                of_type = self.type[sources] == type_code
+                new_ids[of_type] = self.id[self.type == type_code].max() + 3 * (1 + np.arange(of_type.sum()))
+            self.lat = np.append(self.lat, np.round(self.lat[sources] + rng.normal(0, 0.002, len(sources)), 7))
+            self.lon = np.append(self.lon, np.round(self.lon[sources] + rng.normal(0, 0.002, len(sources)), 7))
+            self.type = np.append(self.type, self.type[sources])
+            self.half = np.append(self.half, self.half[sources])
+            self.refs = np.append(self.refs, self.refs[sources])
+            self.id = np.append(self.id, new_ids)
+            self.version = np.append(self.version, np.ones(len(sources), dtype=np.int32))
+            self.changed = np.append(self.changed, times)
+            self.visible = np.append(self.visible, np.ones(len(sources), dtype=bool))
+            self.tags += [dict(self.tags[row]) for row in sources.tolist()]
+            self.history += [(int(when), first + i, None) for i, when in enumerate(times.tolist())]
+            self.history.sort(key=lambda entry: entry[0])
+        self.osm_base = at
+        return dict(counts)
+
+    def changed_since(self, since):
+        """Rows edited after `since`, in row order"""
+        return np.unique(np.array([row for when, row, _ in self.history if when > since], dtype=np.int64))
+
+    def snapshot(self, rows, at=None):
+        """
+        A store of just `rows` (in that order) as they were at time `at`
+        (default: now). Rows created later are there but not visible.
+        """
+        view = object.__new__(ElementStore)
+        view.__dict__.update({name: getattr(self, name)[rows] for name in
+                              ("lat", "lon", "type", "half", "refs", "id", "version", "changed", "visible")})
+        view.tags = [self.tags[row] for row in rows.tolist()]
+        view.osm_base = self.osm_base if at is None else at
+        view.history = []
+        if at is not None:
+            position = {row: i for i, row in enumerate(rows.tolist())}
+            earliest = {}
+            for when, row, state in self.history:
+                if when > at and row in position and row not in earliest:
+                    earliest[row] = state
+            for row, state in earliest.items():
+                i = position[row]
+                if state is None:
+                    view.visible[i] = False
+                else:
+                    (view.lat[i], view.lon[i], view.tags[i], view.version[i], view.changed[i],
+                     view.visible[i]) = state
+        return view
+
+    def render(self, row, verbosity="body", center=False):
+        """One element in Overpass JSON"""
+        type_code = int(self.type[row])
+        element = {"type": TYPE_NAMES[type_code], "id": int(self.id[row])}
+        if verbosity == "meta":
+            element["version"] = int(self.version[row])
+            element["timestamp"] = format_time(self.changed[row])
+        if type_code == 0:
+            if verbosity != "tags":
+                element["lat"] = float(self.lat[row])
+                element["lon"] = float(self.lon[row])
+        else:
+            if center:
+                element["center"] = {"lat": float(self.lat[row]), "lon": float(self.lon[row])}
+            if verbosity != "tags":
+                first = int(self.id[row]) * 16
+                refs = list(range(first, first + int(self.refs[row])))
+                if type_code == 1:
+                    element["nodes"] = refs
+                else:
+                    element["members"] = [{"type": "way", "ref": ref, "role": "outer"} for ref in refs[:2]]
+        element["tags"] = self.tags[row]
+        return element
+
+    def render_xml(self, row, center=False):
+        """One element as `out meta` XML (no node lists), or a deleted stub when the row is not visible"""
+        type_name = TYPE_NAMES[int(self.type[row])]
+        attributes = f'id="{int(self.id[row])}"'
+        if not self.visible[row]:
+            return (f'    <{type_name} {attributes} visible="false" version="{int(self.version[row])}" '
+                    f'timestamp="{format_time(self.changed[row])}"/>\n')
+        if type_name == "node":
+            attributes += f' lat="{float(self.lat[row])}" lon="{float(self.lon[row])}"'
+        attributes += f' version="{int(self.version[row])}" timestamp="{format_time(self.changed[row])}"'
+        lines = [f"    <{type_name} {attributes}>\n"]
+        if center and type_name != "node":
+            lines.append(f'      <center lat="{float(self.lat[row])}" lon="{float(self.lon[row])}"/>\n')
+        lines += [f"      <tag k={quoteattr(k)} v={quoteattr(v)}/>\n" for k, v in self.tags[row].items()]
+        lines.append(f"    </{type_name}>\n")
+        return "".join(lines)
+
+
+def parse_time(text):
+    """Overpass timestamp ("2024-01-01T00:00:00Z") -> epoch seconds"""
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%SZ"))
+    except ValueError:
+        raise QueryError(f"bad date {text!r}")
+
+
+def format_time(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(int(seconds)))
+
+
+# --- Overpass QL subset ---------------------------------------------------------
+
+class QueryError(Exception):
+    """Syntax the stand-in (and usually Overpass) does not accept"""
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+_SETTINGS = re.compile(r"^\s*((?:\[[^\]]*\]\s*)+);")
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<open>\() | (?P<close>\)) | (?P<semi>;) | ->\s*\.(?P<set>\w+) |
+    (?P<out>out\b[^;]*) |
+    (?P<query>(?:node|way|relation|rel|nwr)(?:\.\w+)?(?:\[[^\]]*\])*(?:\([^)]*\))?)
+)""", re.X)
+_QUERY = re.compile(r"^(node|way|relation|rel|nwr)(?:\.(\w+))?((?:\[[^\]]*\])*)(?:\(([^)]*)\))?$")
+_TAG_FILTER = re.compile(r'^\[\s*"?([^"=~!\]]+?)"?\s*(?:(=|~)\s*"?(.*?)"?)?\s*\]$')
+
+
+def parse_settings(ql):
+    """Leading [key:value] settings -> (settings dict, rest of the query)"""
+    match = _SETTINGS.match(ql)
+    if not match:
+        return {}, ql
+    settings = {}
+    for item in re.findall(r"\[([^\]]*)\]", match.group(1)):
+        key, _, value = item.partition(":")
+        settings[key.strip()] = value.strip().strip('"')
+    return settings, ql[match.end():]
+
+
+def tokenize(body):
+    tokens = []
+    pos = 0
+    while pos < len(body):
+        if not body[pos:].strip():
+            break
+        match = _TOKEN.match(body, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f"parse error near: {body[pos:pos + 40]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def parse_tag_filters(text):
+    filters = []
+    for item in re.findall(r"\[[^\]]*\]", text):
+        match = _TAG_FILTER.match(item)
+        if not match:
+            raise QueryError(f"unsupported filter {item}")
+        key, op, value = match.groups()
+        if op == "~":
+            filters.append((key, re.compile(value)))
+        else:
+            filters.append((key, value))
+    return filters
+
+
+class QueryRun:
+    """Evaluates one parsed request against an ElementStore"""
+
+    def __init__(self, store, max_elements=None):
+        self.store = store
+        self.max_elements = max_elements
+        self.sets = {"_": np.zeros(0, dtype=np.int64)}
+        self.outputs = []
+
+    def execute(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        while self.pos < len(tokens):
+            self.statement()
+
+    def next(self, kind=None):
+        if self.pos >= len(self.tokens):
+            raise QueryError("unexpected end of query")
+        token = self.tokens[self.pos]
+        if kind and token[0] != kind:
+            raise QueryError(f"expected {kind}, found {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def statement(self):
+        kind, text = self.next()
+        if kind == "out":
+            self.next("semi")
+            words = text.split()[1:]
+            self.outputs.append((self.sets["_"], words))
+            return None
+        if kind == "open":
+            parts = []
+            while self.peek() != "close":
+                result = self.statement()
+                if result is not None:
+                    parts.append(result)
+            self.next("close")
+            result = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+        elif kind == "query":
+            result = self.query(text)
+        else:
+            raise QueryError(f"unexpected {text!r}")
+        target = "_"
+        if self.peek() == "set":
+            target = self.next()[1]
+        self.next("semi")
+        self.sets[target] = result
+        self.sets["_"] = result
+        return result
+
+    def query(self, text):
+        match = _QUERY.match(text)
+        if not match:
+            raise QueryError(f"unsupported statement {text!r}")
+        type_name, input_set, filter_text, bbox_text = match.groups()
+        store = self.store
+        if input_set:
+            if input_set not in self.sets:
+                raise QueryError(f"unknown set .{input_set}")
+            rows = self.sets[input_set]
+        else:
+            rows = np.arange(len(store))
+        if type_name != "nwr":
+            rows = rows[store.type[rows] == TYPE_NAMES.index("relation" if type_name == "rel" else type_name)]
+        if bbox_text:
+            try:
+                bbox = tuple(float(v) for v in bbox_text.split(","))
+            except ValueError:
+                raise QueryError(f"bad bbox ({bbox_text})")
+            if len(bbox) != 4:
+                raise QueryError(f"bad bbox ({bbox_text})")
+            rows = store.in_bbox(rows, bbox)
+        if not input_set and self.max_elements and len(rows) > self.max_elements:
+            raise QueryTimeout()
+        if not input_set:
+            rows = rows[store.visible[rows]]
+
+        filters = parse_tag_filters(filter_text)
+        if not filters:
+            return rows
+        keep = []
+        for row in rows:
+            tags = store.tags[row]
+            for key, value in filters:
+                found = tags.get(key)
+                if found is None:
+                    break
+                if value is None or (found == value if isinstance(value, str) else value.search(found)):
+                    continue
+                break
+            else:
+                keep.append(row)
+        return np.array(keep, dtype=np.int64)
+
+    def elements(self):
+        """Rendered output of every out statement, in Overpass order (type, then id)"""
+        store = self.store
+        for rows, words in self.outputs:
+            verbosity = "tags" if "tags" in words else "meta" if "meta" in words else "body"
+            center = "center" in words
+            order = np.lexsort((store.id[rows], store.type[rows]))
+            for row in rows[order]:
+                yield store.render(int(row), verbosity, center)
+
+
+def run_query(store, ql, max_elements=None):
+    """
+    (remark, body chunks, content type) for one request; raises QueryError
+    on bad syntax. The query is evaluated up front, the body is rendered
+    while it is sent.
+    """
+    settings, body = parse_settings(ql)
+    if "diff" in settings:
+        raise QueryError("only augmented diffs ([adiff:]) are supported")
+    if "adiff" in settings:
+        return run_diff(store, settings, body)
+    if settings.get("out", "json") != "json":
+        raise QueryError("only [out:json] is supported")
+    run = QueryRun(store, max_elements)
+    remark = None
+    try:
+        run.execute(tokenize(body))
+    except QueryTimeout:
+        run.outputs = []
+        remark = f'runtime error: Query timed out in "query" at line 3 after {settings.get("timeout", "180")} seconds.'
+    maxsize = int(settings.get("maxsize", DEFAULT_MAXSIZE))
+    if sum(len(rows) for rows, _ in run.outputs) * ELEMENT_BYTES > maxsize:
+        run.outputs = []
+        remark = f"runtime error: Query run out of memory using about {maxsize // 1024 ** 2} MB of RAM."
+    return remark, response_chunks(run.elements(), remark, timestamp=store.osm_base), "application/json"
+
+
+def run_diff(store, settings, body):
+    """
+    Augmented diff between the [adiff:] date and now: the query runs on the
+    rows edited since then, once as they were and once as they are now.
+    Only the (few) edited rows are looked at, so there is no time budget.
+    """
+    if settings.get("out") != "xml":
+        raise QueryError("[adiff:] needs [out:xml]")
+    dates = [value.strip().strip('"') for value in settings["adiff"].split(",")]
+    if len(dates) > 1:
+        raise QueryError("only [adiff:\"since\"] (up to now) is supported")
+    since = parse_time(dates[0])
+    rows = store.changed_since(since)
+    old, new = store.snapshot(rows, since), store.snapshot(rows)
+    tokens = tokenize(body)
+    matched = []
+    for view in (old, new):
+        run = QueryRun(view)
+        run.execute(tokens)
+        if not run.outputs:
+            return None, xml_chunks([], store.osm_base), "application/osm3s+xml"
+        matched.append(np.isin(np.arange(len(rows)), np.concatenate([out for out, _ in run.outputs])))
+        center = "center" in run.outputs[-1][1]
+
+    actions = []
+    for i in np.flatnonzero(matched[0] | matched[1]).tolist():
+        if not matched[0][i] and not old.visible[i]:
+            actions.append(("create", None, new.render_xml(i, center)))
+        elif matched[1][i]:
+            actions.append(("modify", old.render_xml(i, center), new.render_xml(i, center)))
+        else:
+            actions.append(("delete", old.render_xml(i, center), new.render_xml(i, center)))
+    remark = None
+    maxsize = int(settings.get("maxsize", DEFAULT_MAXSIZE))
+    if 2 * len(actions) * ELEMENT_BYTES > maxsize:
+        actions = []
+        remark = f"runtime error: Query run out of memory using about {maxsize // 1024 ** 2} MB of RAM."
+    return remark, xml_chunks(actions, store.osm_base, remark), "application/osm3s+xml"
+
+
+def xml_chunks(actions, osm_base, remark=None, size=CHUNK_SIZE):
+    """Overpass-style augmented diff XML in chunks of about `size` bytes"""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="Overpass API stand-in">\n'
+             "<note>Synthetic data</note>\n"
+             f'<meta osm_base="{format_time(osm_base)}"/>\n\n']
+    length = len(parts[0])
+    for action, old, new in actions:
+        if old is None:
+            text = f'<action type="{action}">\n{new}</action>\n'
+        else:
+            text = f'<action type="{action}">\n  <old>\n{old}  </old>\n  <new>\n{new}  </new>\n</action>\n'
+        parts.append(text)
+        length += len(text)
+        if length >= size:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            length = 0
+    if remark:
+        parts.append(f"<remark> {remark} </remark>\n")
+    parts.append("\n</osm>\n")
+    yield "".join(parts).encode("utf-8")
+
+
+def response_chunks(elements, remark=None, size=CHUNK_SIZE, timestamp=None):
+    """Overpass-style JSON body in chunks of about `size` bytes"""
+    head = ('{\n  "version": 0.6,\n  "generator": "Overpass API stand-in",\n'
+            f'  "osm3s": {{"timestamp_osm_base": "{format_time(time.time() if timestamp is None else timestamp)}", '
+            '"copyright": "Synthetic data"},\n  "elements": [\n')
+    parts = [head]
+    length = len(head)
+    separator = ""
+    for element in elements:
+        text = separator + json.dumps(element, ensure_ascii=False)
+        separator = ",\n"
+        parts.append(text)
+        length += len(text)
+        if length >= size:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            length = 0
+    parts.append("\n  ]" + (f',\n  "remark": {json.dumps(remark)}' if remark else "") + "\n}\n")
+    yield "".join(parts).encode("utf-8")
+
+
+# --- .osm.pbf extract -------------------------------------------------------
+
+PBF_BLOCK_SIZE = 8000    # elements per PrimitiveBlock, as osmium writes them
+
+
+class StringTable:
+    def __init__(self):
+        self.index = {"": 0}
+
+    def __call__(self, text):
+        return self.index.setdefault(text, len(self.index))
+
+    def encode(self):
+        return b"".join(bytes_field(1, s.encode("utf-8")) for s in self.index)
+
+    def tags(self, tags):
+        """The packed keys (2) and vals (3) fields of a Way or Relation"""
+        return (bytes_field(2, pack_varints([self(k) for k in tags]))
+                + bytes_field(3, pack_varints([self(v) for v in tags.values()])))
+
+
+def osm_blob(blob_type, payload):
+    """One zlib blob of an .osm.pbf file, with its length-prefixed BlobHeader"""
+    blob = varint_field(2, len(payload)) + bytes_field(3, zlib.compress(payload))
+    header = bytes_field(1, blob_type.encode("utf-8")) + varint_field(3, len(blob))
+    return struct.pack(">I", len(header)) + header + blob
+
+
+def primitive_block(strings, group):
+    """An OSMData blob holding one PrimitiveBlock with a single group"""
+    return osm_blob("OSMData", bytes_field(1, strings.encode()) + bytes_field(2, group))
+
+
+def _corners(lat, lon, half, count, first):
+    """Node ids and coordinates for a closed ring whose bounding box is lat/lon +- half"""
+    angle = 2 * np.pi * np.arange(count) / count
+    node_lat = lat + np.concatenate(([-half, -half, half, half], 0.5 * half * np.cos(angle[4:])))[:count]
+    node_lon = lon + np.concatenate(([-half, half, half, -half], 0.5 * half * np.sin(angle[4:])))[:count]
+    return np.arange(first, first + count, dtype=np.int64), node_lat, node_lon
+
+
+def write_osm_pbf(store, path, block_size=PBF_BLOCK_SIZE):
+    """Write the store as a sorted .osm.pbf extract (DenseNodes, zlib blobs); returns the element counts"""
+    nodes = np.flatnonzero((store.type == 0) & store.visible)
+    node_ids, node_lat, node_lon = [store.id[nodes]], [store.lat[nodes]], [store.lon[nodes]]
+    node_tags = [store.tags[row] for row in nodes]
+    ways = []         # (id, tags, refs)
+    relations = []    # (id, tags, member way ids)
+    for row in np.flatnonzero((store.type != 0) & store.visible):
+        element_id = int(store.id[row])
+        lat, lon, half = float(store.lat[row]), float(store.lon[row]), float(store.half[row])
+        first = element_id * 16
+        if store.type[row] == 1:
+            rings = [(element_id, store.tags[row], first, int(store.refs[row]))]
+        else:
+            # Two untagged outer ways with the relation's own extent
+            rings = [(first + j, None, (first + j) * 16, 5) for j in range(2)]
+            relations.append((element_id, store.tags[row], [first, first + 1]))
+        for way_id, tags, first_node, count in rings:
+            ids, lats, lons = _corners(lat, lon, half, count, first_node)
+            ways.append((way_id, tags, ids))
+            node_ids.append(ids)
+            node_lat.append(lats)
+            node_lon.append(lons)
+            node_tags += [None] * count
+
+    node_ids = np.concatenate(node_ids)
+    order = np.argsort(node_ids)
+    node_ids = node_ids[order]
+    node_lat = np.round(np.concatenate(node_lat)[order] * 1e7).astype(np.int64)
+    node_lon = np.round(np.concatenate(node_lon)[order] * 1e7).astype(np.int64)
+    node_tags = [node_tags[i] for i in order]
+    ways.sort(key=lambda way: way[0])
+    relations.sort(key=lambda relation: relation[0])
+
+    south, west, north, east = RIYADH_AREA
+    box = b"".join(varint_field(number, zigzag_encode(int(value * 1e9)))
+                   for number, value in ((1, west), (2, east), (3, north), (4, south)))
+    header = (bytes_field(1, box) + bytes_field(4, b"OsmSchema-V0.6") + bytes_field(4, b"DenseNodes")
+              + bytes_field(16, b"overpass_standin") + varint_field(32, int(store.osm_base)))
+    with open(path, "wb") as f:
+        f.write(osm_blob("OSMHeader", header))
+        for start in range(0, len(node_ids), block_size):
+            end = start + block_size
+            strings = StringTable()
+            keys_vals = []
+            for tags in node_tags[start:end]:
+                for key, value in (tags or {}).items():
+                    keys_vals += [strings(key), strings(value)]
+                keys_vals.append(0)
+            dense = (bytes_field(1, pack_deltas(node_ids[start:end]))
+                     + bytes_field(8, pack_deltas(node_lat[start:end]))
+                     + bytes_field(9, pack_deltas(node_lon[start:end]))
+                     + bytes_field(10, pack_varints(keys_vals)))
+            f.write(primitive_block(strings, bytes_field(2, dense)))
+        for start in range(0, len(ways), block_size):
+            strings = StringTable()
+            group = []
+            for way_id, tags, refs in ways[start:start + block_size]:
+                way = varint_field(1, way_id) + strings.tags(tags or {}) + bytes_field(8, pack_deltas(refs))
+                group.append(bytes_field(3, way))
+            f.write(primitive_block(strings, b"".join(group)))
+        for start in range(0, len(relations), block_size):
+            strings = StringTable()
+            group = []
+            for relation_id, tags, members in relations[start:start + block_size]:
+                relation = (varint_field(1, relation_id) + strings.tags(tags)
+                            + bytes_field(8, pack_varints([strings("outer")] * len(members)))
+                            + bytes_field(9, pack_deltas(members)) + bytes_field(10, pack_varints([1] * len(members))))
+                group.append(bytes_field(4, relation))
+            f.write(primitive_block(strings, b"".join(group)))
+    return {"nodes": len(node_ids), "ways": len(ways), "relations": len(relations)}
+
+
+# --- HTTP side --------------------------------------------------------------
+
+class OverpassStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store, port=0, latency=0.0, rate_limit=0.0, burst=None, max_elements=None, bandwidth=0.0,
+                 host="127.0.0.1"):
+        super().__init__((host, port), OverpassHandler)
+        self.store = store
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.max_elements = max_elements
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.thread = None
+        self.editing = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}{INTERPRETER_PATH}"
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats.clear()
+
+    def advance(self, edits, at=None, seed=None):
+        """Edit a copy of the store and swap it in; requests already running keep reading the old one"""
+        store = self.store.copy()
+        counts = store.mutate(edits, at, seed)
+        self.store = store
+        return counts
+
+    def start_edits(self, edits, interval):
+        """Advance the data by a day of `edits` edits every `interval` seconds"""
+        def run():
+            while not self.editing.wait(interval):
+                counts = self.advance(edits)
+                print(f"  {format_time(self.store.osm_base)}: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+
+        self.editing = threading.Event()
+        threading.Thread(target=run, name="overpass-standin-edits", daemon=True).start()
+
+    def start(self):
+        """Serve from a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name="overpass-standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.editing:
+            self.editing.set()
+        self.shutdown()
+        self.server_close()
+
+
+class OverpassHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request(self.path.partition("?")[2].encode("utf-8"))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.handle_request(self.rfile.read(length))
+
+    def send_body(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count("bytes", len(body))
+
+    def send_chunked(self, chunks, content_type="application/json"):
+        """Stream the body with chunked transfer encoding, paced to the server's bandwidth"""
+        server = self.server
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if server.bandwidth:
+                time.sleep(len(chunk) / server.bandwidth)
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            server.count("bytes", len(chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def handle_request(self, form):
+        server = self.server
+        if self.path.partition("?")[0] != INTERPRETER_PATH:
+            self.send_body(404, b"<html><body>Not found</body></html>", "text/html")
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        server.count("requests")
+        if not server.bucket.take():
+            server.count("throttled")
+            self.send_body(429, b"<html><body>Too Many Requests</body></html>", "text/html")
+            return
+
+        ql = dict(parse_qsl(form.decode("utf-8"), keep_blank_values=True)).get("data", "")
+        try:
+            remark, chunks, content_type = run_query(server.store, ql, server.max_elements)
+        except QueryError as e:
+            server.count("errors")
+            self.send_body(400, f"<html><body><p><strong>Error</strong>: {e}</p></body></html>".encode("utf-8"),
+                           "text/html")
+            return
+        if remark:
+            server.count("runtime_errors")
+        self.send_chunked(chunks, content_type)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Overpass API")
+    parser.add_argument("--port", type=int, default=8766, help="Port to listen on")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--elements", type=int, default=400000, help="Synthetic OSM elements")
+    parser.add_argument("--max-elements", type=int, default=0,
+                        help="Elements a query statement may scan before it times out (0 = no limit)")
+    parser.add_argument("--latency", type=float, default=0, help="Injected latency per request (ms)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Send bodies at this many MB/s (0 = unthrottled)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Requests/sec before answering 429 (0 = off)")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size for --rate-limit")
+    parser.add_argument("--seed", type=int, default=7, help="Seed for the synthetic elements")
+    parser.add_argument("--write-pbf", type=str, default=None, help="Write the elements to this .osm.pbf and exit")
+    parser.add_argument("--edits-per-day", type=int, default=0,
+                        help="Edits applied per simulated day, for [adiff:] refreshes (0 = static data)")
+    parser.add_argument("--day-seconds", type=float, default=60, help="Wall-clock seconds per simulated day")
+    args = parser.parse_args()
+
+    print("Generating elements...")
+    store = ElementStore(args.elements, seed=args.seed)
+    if args.write_pbf:
+        counts = write_osm_pbf(store, args.write_pbf)
+        print(f"Wrote {args.write_pbf}: " + ", ".join(f"{n:,} {kind}" for kind, n in counts.items()))
+        raise SystemExit(0)
+    server = OverpassStandIn(store, args.port, args.latency / 1000, args.rate_limit, args.burst,
+                             max_elements=args.max_elements or None, bandwidth=args.bandwidth * 1e6, host=args.host)
+    print(f"Serving {len(store):,} elements at {server.url} (data as of {format_time(store.osm_base)})")
+    if args.edits_per_day:
+        server.start_edits(args.edits_per_day, args.day_seconds)
+        print(f"  {args.edits_per_day:,} edits per day, one day every {args.day_seconds:g}s")
+    print(f"  export OVERPASS_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopped. Requests: {dict(server.stats)}")
+        server.server_close()
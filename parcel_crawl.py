@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Parcel crawl library for the UMAPS Balady parcel layer
+
+Shared by scrape_all_riyadh.py and usable for any set of cities:
+  - range fetching by OBJECTID window or exact manifest batch
+  - rate_control.AdaptiveLimiter, an AIMD request budget shared by every
+    worker thread that speeds up while the server is healthy and backs off
+    on 403s, failures and rising latency
+  - crawl_many(), which runs several planners (one per city) on one thread
+    pool. Fresh ranges go to the city with the fewest requests so far, so
+    every city gets an equal share of the budget and a city that finishes
+    hands its share to the others. Each city's ranges still come back in OID
+    order for its journal.
+  - crawl_cities(), a resumable multi-city crawl with one journal and one set
+    of exports per CITY_ID
+
+Usage:
+    python3 parcel_crawl.py 00100001 <city id> ... --workers 4 --rate 2
+"""
+
+import bisect
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from crawl_journal import CrawlJournal
+from crawl_metrics import get_metrics
+from landuse_rules import APARTMENT, apartment_labels, landuse_name, reclassify_records
+from parcel_manifest import ManifestPlanner, city_where, fetch_features_by_ids, fetch_object_ids
+from parcel_sinks import CsvSink, GeoJsonSink, JsonSink, MultiSink
+from parcel_summary import SummarySink
+from parcel_table import ParcelTable
+from rate_control import AdaptiveLimiter
+from umaps_client import get_client
+
+BATCH_SIZE = 2000
+OUT_FIELDS = "OBJECTID,PARCEL_ID,PARCELNAME,MAINLANDUSE,SUBTYPE,DETAILSLANDUSE,RESIDENTIALUNITS,COMMERCIALUNITS,NOOFFLOORS,MEASUREDAREA,DISTRICT_ID,STREETNAME"
+JOURNAL_ROOT = "parcel_journals"
+
+# Output record layout: key -> table column, or a callable deriving it per batch
+FEATURE_LAYOUT = {
+    "object_id": "object_id",
+    "parcel_id": "parcel_id",
+    "parcel_name": "parcel_name",
+    "mainlanduse": "mainlanduse_code",
+    "mainlanduse_name": lambda t: t.columns["mainlanduse_code"].map_values(landuse_name),
+    "subtype": "subtype_code",
+    "is_apartment": "is_apartment",
+    "type": lambda t: apartment_labels(t.apartment),
+    "residential_units": "residential_units",
+    "commercial_units": "commercial_units",
+    "floors": "floors",
+    "area_sqm": "area_sqm",
+    "district_id": "district_id",
+    "street_name": "street_name",
+    "latitude": "latitude",
+    "longitude": "longitude"
+}
+
+
+def process_features(features):
+    """Decode a response batch into columns, then into output records"""
+    metrics = get_metrics()
+    with metrics.stage("process"):
+        classify = metrics.timed("crawl_stage_seconds", APARTMENT, stage="classify")
+        return ParcelTable.from_features(features, classify).records(FEATURE_LAYOUT)
+
+
+def process_feature(f):
+    return process_features([f])[0]
+
+
+def fetch_batch(city_id, min_oid, max_oid, geometry=True, record_count=BATCH_SIZE):
+    """
+    Fetch one city's parcels in ObjectID range.
+    Returns (features, truncated) or None on error; truncated means the server
+    hit its transfer limit and the range has to be split. A full page
+    (record_count features) also counts as truncated, so a range known to
+    hold exactly BATCH_SIZE parcels should ask for one more.
+    """
+    params = {
+        "where": f"{city_where(city_id)} AND OBJECTID >= {min_oid} AND OBJECTID < {max_oid}",
+        "outFields": OUT_FIELDS,
+        "returnGeometry": "true" if geometry else "false",
+        "resultRecordCount": str(record_count),
+        "f": "pjson"
+    }
+
+    try:
+        data = get_client().query_features(params)
+        if data is None or "error" in data:
+            return None
+        features = data.get("features", [])
+        truncated = data.get("exceededTransferLimit", False) or len(features) >= record_count
+        return features, truncated
+    except Exception as e:
+        print(f"Error: {e}")
+        get_metrics().inc("umaps_errors_total", endpoint="query", error=type(e).__name__)
+        return None
+
+
+def fetch_batch_ids(ids):
+    """Fetch an exact manifest batch by OBJECTID; same return shape as fetch_batch"""
+    try:
+        data = fetch_features_by_ids(ids, OUT_FIELDS)
+        if data is None:
+            return None
+        features = data.get("features", [])
+        return features, data.get("exceededTransferLimit", False)
+    except Exception as e:
+        print(f"Error: {e}")
+        get_metrics().inc("umaps_errors_total", endpoint="query", error=type(e).__name__)
+        return None
+
+
+class RangePlanner:
+    """
+    Hands out OID ranges sized so each query comes back close to full.
+
+    Truncated ranges are bisected and fetched again; after every complete
+    range the width is re-estimated from the observed density, so sparse
+    stretches widen and dense ones shrink. Ranges already in the journal are
+    skipped. `fetch_range(min_oid, max_oid)` runs the actual query.
+    """
+
+    def __init__(self, min_oid, max_oid, width, fetch_range, completed=(), target=BATCH_SIZE * 3 // 4,
+                 max_width=1_000_000):
+        self.max_oid = max_oid
+        self.width = width
+        self.fetch_range = fetch_range
+        self.target = target
+        self.max_width = max_width
+        self.cursor = min_oid
+        self.completed = sorted(completed)
+        self.completed_starts = [r[0] for r in self.completed]
+        self.requests = 0
+        self.splits = 0
+
+    def next_start(self, oid):
+        """First planned OID at or after oid, skipping journaled ranges"""
+        i = bisect.bisect_right(self.completed_starts, oid) - 1
+        while 0 <= i < len(self.completed) and self.completed[i][0] <= oid < self.completed[i][1]:
+            oid = self.completed[i][1]
+            i += 1
+        return oid
+
+    def next_range(self):
+        """Next unexplored range, or None once the whole window is planned"""
+        start = self.next_start(self.cursor)
+        if start >= self.max_oid:
+            self.cursor = start
+            return None
+
+        end = min(start + self.width, self.max_oid)
+        i = bisect.bisect_right(self.completed_starts, start)
+        if i < len(self.completed):
+            end = min(end, self.completed[i][0])
+
+        self.cursor = end
+        return (start, end)
+
+    def fetch(self, oid_range):
+        return self.fetch_range(*oid_range)
+
+    def split(self, oid_range):
+        """Bisect a truncated range; the next fresh ranges shrink to match"""
+        lo, hi = oid_range
+        mid = (lo + hi) // 2
+        self.splits += 1
+        self.width = max(1, min(self.width, mid - lo))
+        return [(lo, mid), (mid, hi)]
+
+    def record(self, oid_range, count):
+        """Re-estimate the range width from a complete range's density"""
+        span = oid_range[1] - oid_range[0]
+        if count == 0:
+            estimate = self.width * 2
+        else:
+            estimate = span * self.target // count
+        # Average with the current width so one odd range doesn't swing it
+        self.width = max(1, min(self.max_width, (self.width + estimate) // 2))
+
+
+def fetch_until_ok(request, limiter, where):
+    """
+    Run one request under the shared adaptive budget, retrying until it
+    succeeds. Every failure (403 or error) makes the limiter back off, so the
+    retries slow down together with every other worker.
+    """
+    metrics = get_metrics()
+    while True:
+        with metrics.stage("wait"):
+            ticket = limiter.wait()
+        try:
+            with metrics.stage("fetch"):
+                result = request()
+        except BaseException:
+            limiter.release(ticket)
+            raise
+        if get_client().served_from_cache():
+            limiter.refund(ticket)
+        elif result is None:
+            limiter.backoff(ticket, "failed_request")
+        else:
+            limiter.success(ticket)
+        if result is not None:
+            return result
+        print(f"  Request failed {where}; backing off ({limiter.summary()})")
+        metrics.inc("crawl_retries_total", reason="failed_request")
+
+
+def fetch_range(planner, oid_range, limiter):
+    """Fetch one planned range, waiting out rate limits until it succeeds"""
+    return fetch_until_ok(lambda: planner.fetch(oid_range), limiter, f"at OID {oid_range[0]:,}")
+
+
+class _Lane:
+    """Scheduling state of one planner inside crawl_many"""
+
+    def __init__(self, planner):
+        self.planner = planner
+        self.in_flight = 0
+        self.ready = {}
+        self.frontier = planner.next_start(planner.cursor)
+        self.exhausted = False
+
+
+def crawl_many(planners, workers=1, limiter=None):
+    """
+    Fetch the ranges of several planners on one pool of `workers` threads and
+    yield (planner index, range, features), each planner's ranges in OID
+    order. Truncated ranges are split and re-queued before they are ever
+    yielded. Fresh ranges are handed out fair-share: the planner with the
+    fewest requests so far goes next. At most 2 * workers requests are in
+    flight, and each planner holds at most that many in flight or buffered;
+    the limiter decides how many of them are actually on the wire.
+    """
+    if limiter is None:
+        limiter = AdaptiveLimiter(1.0, max_concurrency=workers)
+    window = max(1, workers) * 2
+    lanes = [_Lane(p) for p in planners]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {}
+
+        def submit(index, oid_range):
+            lane = lanes[index]
+            lane.planner.requests += 1
+            lane.in_flight += 1
+            pending[pool.submit(fetch_range, lane.planner, oid_range, limiter)] = (index, oid_range)
+
+        while True:
+            while len(pending) < window:
+                open_lanes = [i for i, lane in enumerate(lanes)
+                              if not lane.exhausted and lane.in_flight + len(lane.ready) < window]
+                if not open_lanes:
+                    break
+                index = min(open_lanes, key=lambda i: lanes[i].planner.requests)
+                oid_range = lanes[index].planner.next_range()
+                if oid_range is None:
+                    lanes[index].exhausted = True
+                    continue
+                submit(index, oid_range)
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, oid_range = pending.pop(future)
+                lane = lanes[index]
+                lane.in_flight -= 1
+                features, truncated = future.result()
+                # A planner returns no halves for a range it cannot narrow further
+                halves = lane.planner.split(oid_range) if truncated and oid_range[1] - oid_range[0] > 1 else None
+                if halves:
+                    get_metrics().inc("crawl_range_splits_total")
+                    for half in halves:
+                        submit(index, half)
+                else:
+                    lane.planner.record(oid_range, len(features))
+                    lane.ready[oid_range[0]] = (oid_range, features)
+
+            # Release complete ranges strictly in OID order per planner
+            for index, lane in enumerate(lanes):
+                while lane.frontier in lane.ready:
+                    oid_range, features = lane.ready.pop(lane.frontier)
+                    yield index, oid_range, features
+                    lane.frontier = lane.planner.next_start(oid_range[1])
+
+
+def crawl_ranges(planner, workers=1, limiter=None):
+    """crawl_many for a single planner: yields (range, features) in OID order"""
+    for _, oid_range, features in crawl_many([planner], workers, limiter):
+        yield oid_range, features
+
+
+def open_sinks(prefix):
+    """CSV, JSON and GeoJSON exports, written while the crawl runs"""
+    return MultiSink([
+        CsvSink(f"{prefix}.csv"),
+        JsonSink(f"{prefix}.json"),
+        GeoJsonSink(f"{prefix}_geo.json"),
+        SummarySink(f"{prefix}_summary.json")
+    ])
+
+
+def replay_journal(journal, sink, rules=None):
+    """
+    Feed parcels from a resumed journal into fresh sinks, one batch at a time.
+    With `rules` (a landuse_rules.RuleSet) the stored records are reclassified
+    on the way out. Returns the number of apartments written.
+    """
+    apartments = 0
+    batch = []
+    for p in journal.iter_parcels():
+        batch.append(p)
+        if len(batch) >= BATCH_SIZE:
+            apartments += _write_replayed(sink, batch, rules)
+            batch = []
+    if batch:
+        apartments += _write_replayed(sink, batch, rules)
+    return apartments
+
+
+def _write_replayed(sink, batch, rules):
+    if rules is None:
+        apartments = sum(1 for p in batch if p["is_apartment"])
+    else:
+        apartments = reclassify_records(batch, rules)
+    sink.write_batch(batch)
+    return apartments
+
+
+def count_batch(parcels, city):
+    """Throughput counters for one written batch"""
+    metrics = get_metrics()
+    metrics.inc("crawl_batches_total", city=city)
+    metrics.inc("crawl_records_total", len(parcels), city=city)
+
+
+def crawl_metadata(journal, city, apartments=None):
+    """Export metadata; `apartments` overrides the journal's count after a reclassification"""
+    total = journal.count
+    if apartments is None:
+        apartments = journal.apartments
+    return {
+        "source": "UMAPS Balady",
+        "city": city,
+        "scraped_at": datetime.now().isoformat(),
+        "total": total,
+        "apartments": apartments,
+        "non_apartments": total - apartments
+    }
+
+
+class CityCrawl:
+    """One city in a multi-city crawl: its manifest planner, journal and exports"""
+
+    def __init__(self, city_id, journal_dir, output_prefix, restart=False):
+        self.city_id = city_id
+        self.output_prefix = output_prefix
+        if restart and os.path.isdir(journal_dir):
+            shutil.rmtree(journal_dir)
+        self.journal = CrawlJournal(journal_dir)
+        self.resumed = self.journal.count
+        self.planner = None
+        self.object_ids = None
+        self.sink = None
+        self.batches = 0
+
+    def plan(self, limiter):
+        """Discover the city's OBJECTID manifest and plan what is not journaled yet"""
+        where = city_where(self.city_id)
+        self.object_ids = fetch_until_ok(lambda: fetch_object_ids(where), limiter, f"fetching the {self.city_id} manifest")
+        self.planner = ManifestPlanner(self.object_ids, fetch_batch_ids, completed=self.journal.completed(),
+                                       batch_size=BATCH_SIZE)
+        print(f"  {self.city_id}: {len(self.object_ids):,} OBJECTIDs, {self.resumed:,} already on disk, "
+              f"{-(-len(self.planner.ids) // BATCH_SIZE):,} batches to fetch")
+
+        self.sink = open_sinks(self.output_prefix)
+        if self.resumed:
+            replay_journal(self.journal, self.sink)
+
+    def write(self, oid_range, features):
+        parcels = process_features(features)
+        with get_metrics().stage("write"):
+            self.journal.record_batch(oid_range, parcels)
+            self.sink.write_batch(parcels)
+        count_batch(parcels, self.city_id)
+        self.batches += 1
+
+    def close(self):
+        self.sink.close(crawl_metadata(self.journal, self.city_id))
+        self.journal.close()
+
+
+def crawl_cities(city_ids, workers=1, rate=1.0, journal_root=JOURNAL_ROOT, output_dir=".", restart=False,
+                 max_rate=None):
+    """
+    Crawl several cities through one shared worker pool and adaptive request
+    budget, starting at `rate` req/s and never above `max_rate`.
+    Each city resumes from <journal_root>/<city_id> and exports to
+    <output_dir>/parcels_<city_id>.{csv,json,_geo.json}. Configure the shared
+    client (pool size, format, cache) before calling.
+    """
+    print("=" * 60)
+    print(f"PARCEL CRAWL - {len(city_ids)} cities")
+    print("=" * 60)
+
+    limiter = AdaptiveLimiter(rate, max_rate=max_rate, max_concurrency=workers)
+    get_client().warm_up()
+    os.makedirs(output_dir, exist_ok=True)
+
+    crawls = [
+        CityCrawl(city_id, os.path.join(journal_root, city_id),
+                  os.path.join(output_dir, f"parcels_{city_id}"), restart=restart)
+        for city_id in city_ids
+    ]
+    print("Fetching OBJECTID manifests...")
+    for crawl in crawls:
+        crawl.plan(limiter)
+
+    print(f"Workers: {workers} | Starting rate: {rate:g} req/s (adaptive)")
+    print("-" * 60)
+    start_time = time.time()
+    planners = [crawl.planner for crawl in crawls]
+    for index, oid_range, features in crawl_many(planners, workers, limiter):
+        crawl = crawls[index]
+        crawl.write(oid_range, features)
+        done = crawl.journal.count / max(len(crawl.object_ids), 1) * 100
+        print(f"[{crawl.city_id}] Batch {crawl.batches}: OID {oid_range[0]:,}-{oid_range[1]:,} "
+              f"({len(features):,}) | {crawl.journal.count:,} parcels ({done:.1f}%)")
+
+    print("=" * 60)
+    print(f"COMPLETED in {(time.time() - start_time)/60:.1f} minutes")
+    print(f"Final pacing: {limiter.summary()}")
+    for crawl in crawls:
+        total = crawl.journal.count
+        status = "complete" if total == len(crawl.object_ids) else "INCOMPLETE"
+        print(f"{crawl.city_id}: {total:,} of {len(crawl.object_ids):,} parcels ({status}), "
+              f"{crawl.planner.requests:,} requests, {crawl.journal.apartments:,} apartments")
+        crawl.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from crawl_metrics import start_metrics
+    from response_cache import ResponseCache
+    from umaps_client import FEATURE_FORMATS, configure_client
+
+    parser = argparse.ArgumentParser(description="Crawl parcels for several cities from UMAPS Balady")
+    parser.add_argument("city_ids", nargs="+", help="CITY_ID values to crawl, e.g. 00100001 for Riyadh")
+    parser.add_argument("--workers", type=int, default=1, help="Size of the worker pool shared by all cities")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Starting request rate shared by all cities (requests/sec, adapts; 0 = unpaced until throttled)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Ceiling for the adaptive request rate (0 = none)")
+    parser.add_argument("--journal-root", type=str, default=JOURNAL_ROOT, help="One journal per city is kept under here")
+    parser.add_argument("--output-dir", type=str, default=".", help="Directory for the per-city exports")
+    parser.add_argument("--restart", action="store_true", help="Discard existing journals and crawl from scratch")
+    parser.add_argument("--format", choices=FEATURE_FORMATS, default="pjson",
+                        help="Response format for feature queries (pbf is smaller and faster to decode; falls back to pjson)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Directory for the on-disk response cache; re-runs replay cached batches")
+    parser.add_argument("--cache-ttl", type=float, default=24, help="Hours before a cached response expires")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Size bound of the response cache")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write crawl metrics snapshots here (.prom for Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between metrics snapshots")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 ** 2)
+    configure_client(pool_size=max(args.workers, 1), feature_format=args.format, cache=cache)
+    metrics = start_metrics(args.metrics, args.metrics_interval)
+    try:
+        crawl_cities(args.city_ids, workers=args.workers, rate=args.rate, journal_root=args.journal_root,
+                     output_dir=args.output_dir, restart=args.restart, max_rate=args.max_rate)
+    finally:
+        if metrics is not None:
+            metrics.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Vectorized polygon kernel for MapServer parcel responses
+
+Takes every ring of a whole response at once and returns per-feature
+area-weighted centroids, planar area and bounding boxes as NumPy arrays.
+Holes are handled through ring orientation (ESRI outer rings are clockwise,
+holes counter-clockwise), and the closing vertex contributes nothing.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+from esri_pbf import FeatureBatch
+
+
+def flatten_rings(features):
+    """
+    Concatenate all ring vertices of a batch.
+    Returns (coords (N, 2) float64, ring_feature (R,) int, ring_starts (R,) int)
+    where ring r spans coords[ring_starts[r]:ring_starts[r + 1]].
+    """
+    if isinstance(features, FeatureBatch):
+        return features.flat_rings()  # decoded flat already
+
+    parts = []
+    ring_feature = []
+    ring_lengths = []
+    for i, feature in enumerate(features):
+        geometry = feature.get("geometry") or {}
+        for ring in geometry.get("rings") or ():
+            if ring:
+                parts.append(ring)
+                ring_feature.append(i)
+                ring_lengths.append(len(ring))
+
+    if not parts:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    ring_lengths = np.asarray(ring_lengths, dtype=np.int64)
+    n_vertices = int(ring_lengths.sum())
+
+    # Plain [x, y] vertices flatten in one C-level pass; z/m values need slicing
+    flat = np.fromiter(chain.from_iterable(chain.from_iterable(parts)), dtype=np.float64)
+    if len(flat) == 2 * n_vertices:
+        coords = flat.reshape(-1, 2)
+    else:
+        coords = np.array([c[:2] for ring in parts for c in ring], dtype=np.float64)
+    ring_starts = np.concatenate(([0], np.cumsum(ring_lengths)[:-1]))
+    return coords, np.asarray(ring_feature, dtype=np.int64), ring_starts
+
+
+def ring_stats(coords, ring_feature, ring_starts, n_features):
+    """
+    Core kernel on flattened rings (see flatten_rings). Returns a dict of
+    float64 arrays of length n_features: longitude, latitude, area, xmin,
+    ymin, xmax, ymax. Features without geometry get NaN.
+    """
+    out = {key: np.full(n_features, np.nan) for key in
+           ("longitude", "latitude", "area", "xmin", "ymin", "xmax", "ymax")}
+    if len(coords) == 0:
+        return out
+
+    n_vertices = len(coords)
+    ring_lengths = np.diff(np.append(ring_starts, n_vertices))
+    vertex_ring = np.repeat(np.arange(len(ring_starts)), ring_lengths)
+    vertex_feature = ring_feature[vertex_ring]
+
+    # Work relative to each feature's first vertex: parcels are tiny compared
+    # to their absolute coordinates and the cross products would cancel out
+    first_vertex = np.full(n_features, -1, dtype=np.int64)
+    features_with_rings, first_ring = np.unique(ring_feature, return_index=True)
+    first_vertex[features_with_rings] = ring_starts[first_ring]
+    origin = coords[first_vertex[vertex_feature]]
+    local = coords - origin
+
+    # Each vertex pairs with the next one in its ring, wrapping to the ring start
+    nxt = np.arange(1, n_vertices + 1)
+    ring_ends = ring_starts + ring_lengths - 1
+    nxt[ring_ends] = ring_starts
+
+    x0, y0 = local[:, 0], local[:, 1]
+    x1, y1 = local[nxt, 0], local[nxt, 1]
+    cross = x0 * y1 - x1 * y0
+
+    signed_area = 0.5 * np.bincount(vertex_feature, weights=cross, minlength=n_features)
+    cx_num = np.bincount(vertex_feature, weights=(x0 + x1) * cross, minlength=n_features) / 6.0
+    cy_num = np.bincount(vertex_feature, weights=(y0 + y1) * cross, minlength=n_features) / 6.0
+
+    has_geometry = first_vertex >= 0
+    feature_origin = coords[first_vertex[has_geometry]]
+    area = signed_area[has_geometry]
+
+    # Degenerate (zero-area) shapes fall back to the plain vertex mean
+    vertex_count = np.bincount(vertex_feature, minlength=n_features)[has_geometry]
+    mean_x = np.bincount(vertex_feature, weights=x0, minlength=n_features)[has_geometry] / vertex_count
+    mean_y = np.bincount(vertex_feature, weights=y0, minlength=n_features)[has_geometry] / vertex_count
+
+    degenerate = np.abs(area) < 1e-18
+    safe_area = np.where(degenerate, 1.0, area)
+    cx = np.where(degenerate, mean_x, cx_num[has_geometry] / safe_area)
+    cy = np.where(degenerate, mean_y, cy_num[has_geometry] / safe_area)
+
+    out["longitude"][has_geometry] = feature_origin[:, 0] + cx
+    out["latitude"][has_geometry] = feature_origin[:, 1] + cy
+    out["area"][has_geometry] = np.abs(area)
+
+    # Bounding boxes: vertices are already grouped by feature, so reduce per group
+    group_starts = first_vertex[has_geometry]
+    out["xmin"][has_geometry] = np.minimum.reduceat(coords[:, 0], group_starts)
+    out["ymin"][has_geometry] = np.minimum.reduceat(coords[:, 1], group_starts)
+    out["xmax"][has_geometry] = np.maximum.reduceat(coords[:, 0], group_starts)
+    out["ymax"][has_geometry] = np.maximum.reduceat(coords[:, 1], group_starts)
+    return out
+
+
+def batch_ring_stats(features):
+    """Centroid, area and bbox arrays for a list of MapServer features"""
+    coords, ring_feature, ring_starts = flatten_rings(features)
+    return ring_stats(coords, ring_feature, ring_starts, len(features))
+
+
+def centroids(features):
+    """(longitude, latitude) per feature as Python floats, None where missing"""
+    stats = batch_ring_stats(features)
+    lons = [None if np.isnan(v) else v for v in stats["longitude"].tolist()]
+    lats = [None if np.isnan(v) else v for v in stats["latitude"].tolist()]
+    return lons, lats
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+OBJECTID manifest planning for the parcel scrapers
+
+Instead of sweeping an OID window full of gaps, fetch the complete list of
+OBJECTIDs for a city with returnIdsOnly, cut it into exact batches and fetch
+each batch with objectIds=. Every request is full, none is empty, batches are
+independent (so they parallelize) and the result can be checked against the
+manifest for completeness.
+"""
+
+import bisect
+
+from esri_pbf import attribute_values
+from umaps_client import get_client
+
+DEFAULT_BATCH_SIZE = 2000
+
+
+def city_where(city_id):
+    return f"CITY_ID = '{city_id}'"
+
+
+def _get(params):
+    return get_client().get_json(params)
+
+
+def _post(params):
+    return get_client().post_json(params)
+
+
+def _post_features(params):
+    return get_client().query_features(params, post=True)
+
+
+def _ok(data):
+    return data is not None and "error" not in data
+
+
+def fetch_count(where, get=_get):
+    """returnCountOnly for a where clause, or None on error"""
+    data = get({"where": where, "returnCountOnly": "true", "f": "pjson"})
+    if not _ok(data):
+        return None
+    return data.get("count", 0)
+
+
+def fetch_object_ids(where, get=_get):
+    """
+    Sorted list of every OBJECTID matching `where`, or None on error.
+    Pages on OBJECTID in case the server caps returnIdsOnly responses.
+    `get` takes a params dict and returns decoded JSON (or None), so callers
+    can plug in their own retry policy.
+    """
+    ids = []
+    last = -1
+    while True:
+        data = get({
+            "where": f"({where}) AND OBJECTID > {last}",
+            "returnIdsOnly": "true",
+            "f": "pjson"
+        })
+        if not _ok(data):
+            return None
+
+        batch = sorted(data.get("objectIds") or [])
+        if not batch:
+            return ids
+        ids.extend(batch)
+        last = batch[-1]
+
+
+def chunk_ids(ids, batch_size=DEFAULT_BATCH_SIZE):
+    """Split a sorted manifest into consecutive batches"""
+    return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+
+def fetch_features_by_ids(ids, out_fields, post=_post_features, return_geometry=True):
+    """
+    Fetch exactly the given OBJECTIDs. The id list is POSTed because 2000 ids
+    do not fit in a proxy GET URL. Returns the decoded response or None.
+    The default `post` uses the shared client's feature format (pjson/pbf)
+    and overrides the "f" given here.
+    """
+    data = post({
+        "objectIds": ",".join(str(i) for i in ids),
+        "outFields": out_fields,
+        "returnGeometry": "true" if return_geometry else "false",
+        "f": "pjson"
+    })
+    return data if _ok(data) else None
+
+
+class ManifestPlanner:
+    """
+    Planner over a fixed OBJECTID manifest, interchangeable with the
+    range planner in scrape_all_riyadh. Ranges handed out are
+    (first_id, last_id + 1) of one batch, so they journal like OID ranges.
+    """
+
+    def __init__(self, object_ids, fetch_ids, completed=(), batch_size=DEFAULT_BATCH_SIZE):
+        self.fetch_ids = fetch_ids
+        self.batch_size = batch_size
+        self.total = len(object_ids)
+        self.ids = self._drop_completed(sorted(object_ids), completed)
+        self.index = 0
+        self.cursor = self.ids[0] if self.ids else 0
+        self.requests = 0
+        self.splits = 0
+        self.missing = []
+
+    @staticmethod
+    def _drop_completed(ids, completed):
+        if not completed:
+            return ids
+        ranges = sorted(completed)
+        starts = [r[0] for r in ranges]
+        kept = []
+        for i in ids:
+            j = bisect.bisect_right(starts, i) - 1
+            if j < 0 or i >= ranges[j][1]:
+                kept.append(i)
+        return kept
+
+    def _ids_in(self, oid_range):
+        lo = bisect.bisect_left(self.ids, oid_range[0])
+        hi = bisect.bisect_left(self.ids, oid_range[1])
+        return self.ids[lo:hi]
+
+    def next_start(self, oid):
+        """First planned id at or after oid"""
+        i = bisect.bisect_left(self.ids, oid)
+        return self.ids[i] if i < len(self.ids) else float("inf")
+
+    def next_range(self):
+        if self.index >= len(self.ids):
+            return None
+        batch = self.ids[self.index:self.index + self.batch_size]
+        self.index += len(batch)
+        return (batch[0], batch[-1] + 1)
+
+    def fetch(self, oid_range):
+        ids = self._ids_in(oid_range)
+        result = self.fetch_ids(ids)
+        if result is None:
+            return None
+        features, truncated = result
+        if not truncated and len(features) < len(ids):
+            # Deleted since the manifest was taken
+            got = set(attribute_values(features, "OBJECTID"))
+            self.missing.extend(i for i in ids if i not in got)
+        return features, truncated
+
+    def split(self, oid_range):
+        """Halve a truncated batch by id count; a single id cannot be narrowed, so it is kept as fetched"""
+        ids = self._ids_in(oid_range)
+        if len(ids) <= 1:
+            return []
+        mid = ids[len(ids) // 2]
+        self.splits += 1
+        return [(oid_range[0], mid), (mid, oid_range[1])]
+
+    def record(self, oid_range, count):
+        pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Delta refresh of a journaled parcel crawl
+
+Instead of re-crawling every parcel, the journal's ranges are turned into
+blocks that tile the OID axis and each block is checked with cheap signals:
+
+  counts     returnCountOnly per block, bisected from the whole city down,
+             so unchanged stretches cost one request for many blocks
+  edit date  if the layer has editor tracking, returnIdsOnly for everything
+             edited since the block was fetched
+  attributes optional: attribute-only queries (no geometry) compared with the
+             stored records, for edits that keep counts and have no edit date
+
+Only the blocks flagged by a signal are re-fetched; the journal then
+replaces their old ranges in place (see CrawlJournal.record_batch).
+"""
+
+import bisect
+from datetime import datetime, timezone
+
+# OBJECTID is a 32-bit field, so this closes the last (open-ended) block
+MAX_OBJECTID = 2 ** 31 - 1
+
+# Derived from geometry, which attribute-only checks do not fetch
+GEOMETRY_KEYS = ("latitude", "longitude")
+
+
+def refresh_blocks(entries):
+    """
+    Live ledger entries -> sorted blocks (start, end, entry). Each block runs
+    from its entry's start to the next entry's start, the first from 0 and
+    the last to MAX_OBJECTID, so a parcel added anywhere lands in one block.
+    """
+    entries = sorted(entries, key=lambda e: e["start"])
+    blocks = []
+    for i, entry in enumerate(entries):
+        start = entry["start"] if i else 0
+        end = entries[i + 1]["start"] if i + 1 < len(entries) else MAX_OBJECTID
+        blocks.append((start, end, entry))
+    return blocks
+
+
+def count_changes(blocks, count_range):
+    """
+    Indexes of blocks whose server count differs from the journal.
+    `count_range(start, end)` returns the live count (None counts as changed).
+    Spans whose total matches are accepted whole; others are bisected.
+    """
+    changed = []
+    stack = [(0, len(blocks))]
+    while stack:
+        lo, hi = stack.pop()
+        if lo >= hi:
+            continue
+        expected = sum(block[2]["count"] for block in blocks[lo:hi])
+        if count_range(blocks[lo][0], blocks[hi - 1][1]) == expected:
+            continue
+        if hi - lo == 1:
+            changed.append(lo)
+        else:
+            mid = (lo + hi) // 2
+            stack.extend([(mid, hi), (lo, mid)])
+    return sorted(changed)
+
+
+def edit_date_field(layer_info):
+    """Editor-tracking date field of a layer, or None if the layer has none"""
+    return ((layer_info or {}).get("editFieldsInfo") or {}).get("editDateField")
+
+
+def edited_since_where(where, field, since):
+    """where clause for features edited after unix time `since`"""
+    stamp = datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return f"({where}) AND {field} > timestamp '{stamp}'"
+
+
+def blocks_containing(blocks, object_ids):
+    """Indexes of the blocks holding any of object_ids"""
+    starts = [block[0] for block in blocks]
+    return sorted({bisect.bisect_right(starts, oid) - 1 for oid in object_ids} - {-1})
+
+
+def records_differ(stored, fresh, ignore=GEOMETRY_KEYS):
+    """Compare two record lists by object_id, ignoring geometry-derived keys"""
+    def keyed(records):
+        return {r["object_id"]: {k: v for k, v in r.items() if k not in ignore} for r in records}
+    return keyed(stored) != keyed(fresh)
+
+
+class RefreshPlanner:
+    """
+    Planner over a fixed list of blocks to re-fetch, interchangeable with the
+    planners in scrape_all_riyadh. Blocks are fetched as OID range queries so
+    parcels added since the crawl come along; truncated blocks are bisected.
+    A block may hold exactly BATCH_SIZE parcels (a full manifest batch), so
+    `fetch_range` should not treat a full page as truncated: ask for one
+    record more, or go by exceededTransferLimit alone.
+    """
+
+    def __init__(self, blocks, fetch_range):
+        self.blocks = sorted((start, end) for start, end, _ in blocks)
+        self.starts = [start for start, _ in self.blocks]
+        self.fetch_range = fetch_range
+        self.index = 0
+        self.cursor = self.starts[0] if self.blocks else 0
+        self.requests = 0
+        self.splits = 0
+
+    def next_start(self, oid):
+        """oid itself if it lies inside a planned block, else the next block start"""
+        i = bisect.bisect_right(self.starts, oid) - 1
+        if i >= 0 and oid < self.blocks[i][1]:
+            return oid
+        return self.starts[i + 1] if i + 1 < len(self.starts) else float("inf")
+
+    def next_range(self):
+        if self.index >= len(self.blocks):
+            return None
+        block = self.blocks[self.index]
+        self.index += 1
+        return block
+
+    def fetch(self, oid_range):
+        return self.fetch_range(*oid_range)
+
+    def split(self, oid_range):
+        lo, hi = oid_range
+        mid = (lo + hi) // 2
+        self.splits += 1
+        return [(lo, mid), (mid, hi)]
+
+    def record(self, oid_range, count):
+        pass
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Compact binary store for full parcel polygons
+
+Coordinates are quantized to integers (1e-7 degree, about 1 cm) and each
+vertex is stored as the zigzag varint delta from the previous one, so a
+typical parcel ring costs a couple of bytes per vertex instead of ~40 bytes
+of JSON. The closing vertex of each ring is implied, not stored.
+
+<prefix>.geom  header, then one record per parcel:
+               varint OBJECTID, varint ring count, varint vertex count per
+               ring, then zigzag varint (dx, dy) pairs across all rings.
+               The first vertex of a record is relative to the file origin.
+<prefix>.gidx  NumPy array of (OBJECTID, byte offset), sorted by OBJECTID,
+               written on close and rebuilt by scanning if it is missing.
+
+Records are only ever appended; a parcel written again supersedes its older
+record. compact() rewrites the file with just the newest record of the
+parcels still wanted, e.g. after a refresh replaced or dropped some.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from parcel_geometry import flatten_rings
+from pbf_wire import encode_varints, read_varint, zigzag_decode, zigzag_encode
+
+MAGIC = b"PSHAPE1\0"
+HEADER = struct.Struct("<8sddd")  # magic, scale, origin x, origin y
+DEFAULT_SCALE = 1e7
+
+
+class ShapeWriter:
+    """Append parcel polygons batch by batch; safe to reopen after a crash"""
+
+    def __init__(self, prefix, scale=DEFAULT_SCALE, origin=(0.0, 0.0)):
+        self.data_path = f"{prefix}.geom"
+        self.index_path = f"{prefix}.gidx"
+        self.offsets = {}
+
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) >= HEADER.size:
+            reader = ShapeReader(prefix, build_index=False)
+            self.scale, self.origin = reader.scale, reader.origin
+            self.offsets, valid_size = reader.scan()
+            reader.close()
+            self.file = open(self.data_path, "r+b")
+            self.file.truncate(valid_size)
+            self.file.seek(valid_size)
+        else:
+            self.scale = scale
+            self.origin = origin
+            self.file = open(self.data_path, "wb")
+            self.file.write(HEADER.pack(MAGIC, scale, origin[0], origin[1]))
+
+    def write_batch(self, features):
+        """Encode every polygon in a MapServer response in one vectorized pass"""
+        coords, ring_feature, ring_starts = flatten_rings(features)
+        if not len(ring_starts):
+            return
+
+        n_vertices = len(coords)
+        ring_lengths = np.diff(np.append(ring_starts, n_vertices))
+        quantized = np.rint((coords - self.origin) * self.scale).astype(np.int64)
+
+        # Drop the closing vertex of rings that repeat their first vertex
+        ring_ends = ring_starts + ring_lengths - 1
+        closed = (ring_lengths > 1) & np.all(quantized[ring_ends] == quantized[ring_starts], axis=1)
+        keep = np.ones(n_vertices, dtype=bool)
+        keep[ring_ends[closed]] = False
+        ring_lengths = ring_lengths - closed
+        vertex_ring = np.repeat(np.arange(len(ring_starts)), np.diff(np.append(ring_starts, n_vertices)))
+        quantized = quantized[keep]
+        vertex_feature = ring_feature[vertex_ring[keep]]
+
+        # Deltas run across all rings of a feature and restart at each feature
+        deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+        feature_first = np.r_[True, vertex_feature[1:] != vertex_feature[:-1]]
+        deltas[feature_first] = quantized[feature_first]
+        coord_values = zigzag_encode(deltas.ravel().astype(np.int64)).astype(np.uint64)
+
+        # Per-feature headers: OBJECTID, ring count, ring lengths
+        features_with_rings, first_ring, rings_per_feature = np.unique(
+            ring_feature, return_index=True, return_counts=True)
+        object_ids = [(features[i].get("attributes") or {}).get("OBJECTID") for i in features_with_rings.tolist()]
+
+        headers = []
+        header_lengths = []
+        for oid, start, count in zip(object_ids, first_ring.tolist(), rings_per_feature.tolist()):
+            header = [oid or 0, count] + ring_lengths[start:start + count].tolist()
+            headers.extend(header)
+            header_lengths.append(len(header))
+        header_lengths = np.asarray(header_lengths, dtype=np.int64)
+        coord_counts = 2 * np.bincount(vertex_feature, minlength=len(features))[features_with_rings]
+
+        # Interleave headers and coordinates into one value stream
+        record_values = header_lengths + coord_counts
+        record_starts = np.concatenate(([0], np.cumsum(record_values)[:-1]))
+        stream = np.empty(int(record_values.sum()), dtype=np.uint64)
+        header_pos = np.repeat(record_starts, header_lengths) + _ranges(header_lengths)
+        coord_pos = np.repeat(record_starts + header_lengths, coord_counts) + _ranges(coord_counts)
+        stream[header_pos] = np.asarray(headers, dtype=np.uint64)
+        stream[coord_pos] = coord_values
+
+        encoded, lengths = encode_varints(stream)
+        byte_ends = np.cumsum(lengths)
+        record_offsets = np.concatenate(([0], byte_ends[record_starts[1:] - 1])) if len(record_starts) > 1 else np.array([0])
+
+        base = self.file.tell()
+        self.file.write(encoded)
+        for oid, offset in zip(object_ids, record_offsets.tolist()):
+            self.offsets[oid] = base + offset
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        write_index(self.index_path, self.offsets)
+        print(f"Saved {len(self.offsets):,} parcel shapes to {self.data_path} ({os.path.getsize(self.data_path)/1e6:.1f} MB)")
+
+
+def _ranges(counts):
+    """Concatenated arange(n) for each n in counts"""
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(total) - starts
+
+
+def write_index(path, offsets):
+    index = np.array(sorted(offsets.items()), dtype=np.int64).reshape(-1, 2)
+    with open(path, "wb") as f:
+        np.save(f, index)
+
+
+def compact(prefix, object_ids):
+    """
+    Rewrite <prefix>.geom with only the newest record of each OBJECTID in
+    object_ids; returns (parcels kept, parcels dropped)
+    """
+    reader = ShapeReader(prefix, build_index=False)
+    offsets, _ = reader.scan()
+    kept = {}
+    temp_path = f"{reader.data_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(reader.data[:HEADER.size])
+        for oid, pos in sorted(offsets.items()):
+            if oid in object_ids:
+                kept[oid] = f.tell()
+                f.write(reader.data[pos:reader.record_end(pos)])
+        f.flush()
+        os.fsync(f.fileno())
+    reader.close()
+
+    # Without an index the reader rescans, so a crash in between never pairs a stale index with the new file
+    if os.path.exists(reader.index_path):
+        os.remove(reader.index_path)
+    os.replace(temp_path, reader.data_path)
+    write_index(reader.index_path, kept)
+    return len(kept), len(offsets) - len(kept)
+
+
+class ShapeReader:
+    """Random access to stored polygons by OBJECTID"""
+
+    def __init__(self, prefix, build_index=True):
+        self.data_path = f"{prefix}.geom"
+        self.index_path = f"{prefix}.gidx"
+        with open(self.data_path, "rb") as f:
+            self.data = f.read()
+        magic, self.scale, ox, oy = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.data_path} is not a parcel shape file")
+        self.origin = (ox, oy)
+        self.terminators = None
+
+        self.index = None
+        if build_index:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, "rb") as f:
+                    self.index = np.load(f)
+            else:
+                offsets, _ = self.scan()
+                self.index = np.array(sorted(offsets.items()), dtype=np.int64).reshape(-1, 2)
+
+    def _read_record(self, pos):
+        """Decode one record at pos -> (OBJECTID, rings, next position)"""
+        buf = self.data
+        oid, pos = read_varint(buf, pos)
+        ring_count, pos = read_varint(buf, pos)
+        lengths = []
+        for _ in range(ring_count):
+            n, pos = read_varint(buf, pos)
+            lengths.append(n)
+
+        x = y = 0
+        rings = []
+        for n in lengths:
+            ring = []
+            for _ in range(n):
+                dx, pos = read_varint(buf, pos)
+                dy, pos = read_varint(buf, pos)
+                x += zigzag_decode(dx)
+                y += zigzag_decode(dy)
+                ring.append([x / self.scale + self.origin[0], y / self.scale + self.origin[1]])
+            if ring:
+                ring.append(list(ring[0]))
+            rings.append(ring)
+        return oid, rings, pos
+
+    def record_end(self, pos):
+        """Position just past the record at pos; the coordinates are skipped by counting varint ends, not decoded"""
+        buf = self.data
+        _, pos = read_varint(buf, pos)
+        ring_count, pos = read_varint(buf, pos)
+        vertices = 0
+        for _ in range(ring_count):
+            n, pos = read_varint(buf, pos)
+            vertices += n
+        if not vertices:
+            return pos
+        if self.terminators is None:
+            self.terminators = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) < 0x80)
+        last = int(np.searchsorted(self.terminators, pos)) + 2 * vertices - 1
+        return int(self.terminators[last]) + 1
+
+    def scan(self):
+        """Walk every record -> ({OBJECTID: offset}, size of the valid prefix)"""
+        offsets = {}
+        pos = HEADER.size
+        while pos < len(self.data):
+            try:
+                oid = read_varint(self.data, pos)[0]
+                end = self.record_end(pos)
+            except IndexError:
+                break  # torn record at the end of a crashed run
+            offsets[oid] = pos
+            pos = end
+        return offsets, pos
+
+    def get(self, object_id):
+        """Rings of one parcel as [[x, y], ...] lists, or None if not stored"""
+        i = np.searchsorted(self.index[:, 0], object_id)
+        if i >= len(self.index) or self.index[i, 0] != object_id:
+            return None
+        return self._read_record(int(self.index[i, 1]))[1]
+
+    def __iter__(self):
+        """(OBJECTID, rings) for every stored parcel, in OBJECTID order"""
+        for oid, offset in self.index.tolist():
+            yield oid, self._read_record(offset)[1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.data = b""
+        self.terminators = None
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Streaming output sinks for parcel exports
+
+Each sink accepts parcels batch by batch while the crawl runs and only keeps
+running totals in memory, so exports no longer need the whole city as a list.
+Call close(metadata) once at the end to finish the file.
+"""
+
+import csv
+import json
+
+
+class ParcelSink:
+    """Base class: counts what passes through and owns one output file"""
+
+    def __init__(self, filename, encoding="utf-8", newline=None):
+        self.filename = filename
+        self.file = open(filename, "w", encoding=encoding, newline=newline)
+        self.count = 0
+        self.apartments = 0
+
+    def write_batch(self, parcels):
+        for p in parcels:
+            self.write(p)
+            self.count += 1
+            if p["is_apartment"]:
+                self.apartments += 1
+
+    def write(self, parcel):
+        raise NotImplementedError
+
+    def close(self, metadata=None):
+        self.file.close()
+        print(f"Saved {self.count:,} parcels to {self.filename}")
+
+
+class CsvSink(ParcelSink):
+    """CSV with a header taken from the first parcel unless fieldnames are given"""
+
+    def __init__(self, filename, fieldnames=None):
+        super().__init__(filename, encoding="utf-8-sig", newline="")
+        self.fieldnames = fieldnames
+        self.writer = None
+
+    def write(self, parcel):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames or list(parcel.keys()))
+            self.writer.writeheader()
+        self.writer.writerow(parcel)
+
+
+class NdjsonSink(ParcelSink):
+    """One JSON object per line"""
+
+    def write(self, parcel):
+        self.file.write(json.dumps(parcel, ensure_ascii=False))
+        self.file.write("\n")
+
+
+class JsonSink(ParcelSink):
+    """
+    {"parcels": [...], "metadata": {...}} written incrementally.
+    Metadata goes last because the totals are only known once the crawl ends.
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.file.write('{"parcels": [')
+
+    def write(self, parcel):
+        if self.count:
+            self.file.write(",\n")
+        self.file.write(json.dumps(parcel, ensure_ascii=False))
+
+    def close(self, metadata=None):
+        metadata = dict(metadata or {})
+        metadata.setdefault("total_parcels", self.count)
+        metadata.setdefault("apartments", self.apartments)
+        metadata.setdefault("non_apartments", self.count - self.apartments)
+        self.file.write('],\n"metadata": ')
+        self.file.write(json.dumps(metadata, ensure_ascii=False))
+        self.file.write("}\n")
+        super().close()
+
+
+class GeoJsonSink(ParcelSink):
+    """
+    Point FeatureCollection. `properties` maps output name -> parcel key;
+    by default every parcel field except the coordinates is kept.
+    """
+
+    def __init__(self, filename, properties=None):
+        super().__init__(filename)
+        self.properties = properties
+        self.written = 0
+        self.file.write('{"type": "FeatureCollection", "features": [')
+
+    def write(self, parcel):
+        if not (parcel["latitude"] and parcel["longitude"]):
+            return
+
+        if self.properties is None:
+            props = {k: v for k, v in parcel.items() if k not in ("latitude", "longitude")}
+        else:
+            props = {name: parcel[key] for name, key in self.properties.items()}
+
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [parcel["longitude"], parcel["latitude"]]},
+            "properties": props
+        }
+        if self.written:
+            self.file.write(",\n")
+        self.file.write(json.dumps(feature, ensure_ascii=False))
+        self.written += 1
+
+    def close(self, metadata=None):
+        self.file.write("]}\n")
+        self.file.close()
+        print(f"Saved {self.written:,} parcels to {self.filename}")
+
+
+class MultiSink:
+    """Fan one stream of batches out to several sinks"""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    @property
+    def summary(self):
+        """The running ParcelSummary of the first summarizing sink, if any"""
+        for sink in self.sinks:
+            if hasattr(sink, "summary"):
+                return sink.summary
+        return None
+
+    def write_batch(self, parcels):
+        for sink in self.sinks:
+            sink.write_batch(parcels)
+
+    def close(self, metadata=None):
+        for sink in self.sinks:
+            sink.close(metadata)
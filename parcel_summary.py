@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Single-pass summary statistics for parcel crawls
+
+ParcelSummary is updated once per written batch and never looks at a parcel
+twice. It keeps:
+  - totals: parcels, apartments, measured area (all and apartments)
+  - per main land use and per district: parcels, apartments, area
+  - per subtype: parcels
+  - apartments per residential-unit band
+
+Labels (land-use and subtype names) are looked up per distinct code only
+when a snapshot is taken. SummarySink feeds it from the same batch stream
+as the other exports and rewrites <prefix>_summary.json every `interval`
+seconds, so a live view of the crawl is always on disk. The final snapshot
+is written on close. Records in either export layout are accepted
+(mainlanduse_code or mainlanduse, see landuse_rules.RECORD_ALIASES).
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from landuse_rules import RECORD_ALIASES, landuse_name, subtype_name
+
+UNIT_BANDS = ["2-5 units", "6-10 units", "11-20 units", "20+ units"]
+# Upper bounds (inclusive) of all but the last band
+UNIT_BAND_EDGES = [5, 10, 20]
+
+
+def _record_key(record, name):
+    return name if name in record else RECORD_ALIASES.get(name, name)
+
+
+class ParcelSummary:
+    """Running aggregates over every parcel written so far"""
+
+    def __init__(self):
+        self.total = 0
+        self.apartments = 0
+        self.area = 0.0
+        self.apartment_area = 0.0
+        self.by_landuse = {}   # code -> [parcels, apartments, area]
+        self.by_district = {}  # district_id -> [parcels, apartments, area]
+        self.by_subtype = {}   # code -> parcels
+        self.unit_bands = [0] * len(UNIT_BANDS)
+        self.started = time.time()
+
+    def update(self, records):
+        """Fold one batch of output records into the aggregates"""
+        if not records:
+            return
+        landuse_key = _record_key(records[0], "mainlanduse_code")
+        subtype_key = _record_key(records[0], "subtype_code")
+        by_landuse = self.by_landuse
+        by_district = self.by_district
+        by_subtype = self.by_subtype
+        apartments = 0
+        total_area = 0.0
+
+        for r in records:
+            apartment = 1 if r["is_apartment"] else 0
+            area = r.get("area_sqm") or 0.0
+            apartments += apartment
+            total_area += area
+
+            stats = by_landuse.get(r.get(landuse_key))
+            if stats is None:
+                stats = by_landuse[r.get(landuse_key)] = [0, 0, 0.0]
+            stats[0] += 1
+            stats[1] += apartment
+            stats[2] += area
+
+            stats = by_district.get(r.get("district_id"))
+            if stats is None:
+                stats = by_district[r.get("district_id")] = [0, 0, 0.0]
+            stats[0] += 1
+            stats[1] += apartment
+            stats[2] += area
+
+            subtype = r.get(subtype_key)
+            by_subtype[subtype] = by_subtype.get(subtype, 0) + 1
+
+            if apartment:
+                self.apartment_area += area
+                units = r.get("residential_units")
+                if units:
+                    self.unit_bands[bisect.bisect_left(UNIT_BAND_EDGES, units)] += 1
+
+        self.total += len(records)
+        self.apartments += apartments
+        self.area += total_area
+
+    def totals(self):
+        return {
+            "total_parcels": self.total,
+            "apartments": self.apartments,
+            "non_apartments": self.total - self.apartments
+        }
+
+    def snapshot(self):
+        """JSON-friendly view of everything aggregated so far"""
+        def grouped(groups, key, label=None):
+            rows = []
+            for value, (parcels, apartments, area) in sorted(groups.items(), key=lambda item: -item[1][0]):
+                row = {key: value}
+                if label is not None:
+                    row["name"] = label(value)
+                row.update(parcels=parcels, apartments=apartments, area_sqm=round(area, 2))
+                rows.append(row)
+            return rows
+
+        return dict(self.totals(), **{
+            "updated_at": datetime.now().isoformat(),
+            "elapsed_seconds": round(time.time() - self.started, 1),
+            "area_sqm": round(self.area, 2),
+            "apartment_area_sqm": round(self.apartment_area, 2),
+            "by_landuse": grouped(self.by_landuse, "code", landuse_name),
+            "by_subtype": [
+                {"code": code, "name": subtype_name(code), "parcels": n}
+                for code, n in sorted(self.by_subtype.items(), key=lambda item: -item[1])
+            ],
+            "by_district": grouped(self.by_district, "district_id"),
+            "apartment_unit_bands": dict(zip(UNIT_BANDS, self.unit_bands))
+        })
+
+    def write(self, path, metadata=None):
+        """Atomically replace `path` with a snapshot"""
+        data = self.snapshot()
+        if metadata:
+            data["metadata"] = metadata
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def print_summary(summary, top_subtypes=15):
+    """Console report of a ParcelSummary"""
+    print("\n" + "=" * 60)
+    print("SUMMARY STATISTICS")
+    print("=" * 60)
+
+    total = summary.total
+    if not total:
+        print("No parcels")
+        return
+
+    landuse = {}
+    for code, (parcels, _, _) in summary.by_landuse.items():
+        name = landuse_name(code)
+        landuse[name] = landuse.get(name, 0) + parcels
+    print("\nBy Main Land Use:")
+    for name, count in sorted(landuse.items(), key=lambda x: -x[1]):
+        print(f"  {name}: {count:,} ({count / total * 100:.1f}%)")
+
+    subtypes = {}
+    for code, count in summary.by_subtype.items():
+        name = subtype_name(code)
+        subtypes[name] = subtypes.get(name, 0) + count
+    print(f"\nTop {top_subtypes} Subtypes:")
+    for i, (name, count) in enumerate(sorted(subtypes.items(), key=lambda x: -x[1])[:top_subtypes]):
+        print(f"  {i+1}. {name}: {count:,} ({count / total * 100:.1f}%)")
+
+    apartments = summary.apartments
+    print("\nApartment Classification:")
+    print(f"  Apartments: {apartments:,} ({apartments / total * 100:.1f}%)")
+    print(f"  Non-Apartments: {total - apartments:,} ({(total - apartments) / total * 100:.1f}%)")
+
+    if any(summary.unit_bands):
+        print("\nApartments by Unit Count:")
+        for band, count in zip(UNIT_BANDS, summary.unit_bands):
+            if count:
+                print(f"  {band}: {count:,}")
+
+    print(f"\nDistricts: {len(summary.by_district):,} | Measured area: {summary.area / 1e6:,.1f} km²")
+
+
+class SummarySink:
+    """
+    Parcel sink that only aggregates: feeds a ParcelSummary and keeps
+    `filename` up to date with a live snapshot every `interval` seconds.
+    """
+
+    def __init__(self, filename, summary=None, interval=30.0):
+        self.filename = filename
+        self.summary = summary if summary is not None else ParcelSummary()
+        self.interval = interval
+        self.last_write = time.monotonic()
+
+    def write_batch(self, parcels):
+        self.summary.update(parcels)
+        if time.monotonic() - self.last_write >= self.interval:
+            self.flush()
+
+    def flush(self, metadata=None):
+        self.summary.write(self.filename, metadata)
+        self.last_write = time.monotonic()
+
+    def close(self, metadata=None):
+        self.flush(metadata)
+        print(f"Saved summary of {self.summary.total:,} parcels to {self.filename}")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Columnar in-memory parcel table
+
+A ParcelTable keeps one typed NumPy array per field instead of one dict per
+parcel:
+  - numeric fields are float64 with NaN for null (OBJECTIDs fit exactly)
+  - free-text fields (parcel id, names) are object arrays
+  - repetitive codes (land use, subtype, district, flags) are
+    dictionary-encoded: int32 codes plus a small list of distinct values
+  - the apartment classification is a boolean mask, computed for the
+    whole batch by a landuse_rules.RuleSet
+
+Labels such as the land-use name are never stored per row; they are looked
+up once per distinct code and expanded on export.
+"""
+
+import numpy as np
+
+from esri_pbf import FeatureBatch
+from parcel_geometry import batch_ring_stats
+
+# column -> (MapServer field, kind)
+COLUMNS = {
+    "object_id": ("OBJECTID", "int"),
+    "parcel_id": ("PARCEL_ID", "str"),
+    "parcel_name": ("PARCELNAME", "str"),
+    "mainlanduse_code": ("MAINLANDUSE", "category"),
+    "subtype_code": ("SUBTYPE", "category"),
+    "detailslanduse": ("DETAILSLANDUSE", "category"),
+    "residential_units": ("RESIDENTIALUNITS", "int"),
+    "commercial_units": ("COMMERCIALUNITS", "int"),
+    "floors": ("NOOFFLOORS", "int"),
+    "area_sqm": ("MEASUREDAREA", "float"),
+    "district_id": ("DISTRICT_ID", "category"),
+    "street_name": ("STREETNAME", "str"),
+    "postal_code": ("POSTALCODE", "category"),
+    "is_built": ("ISBUILT", "category"),
+    "is_licensed": ("ISLICENSED", "category"),
+    "building_status": ("BUILDINGSTATUS", "category"),
+}
+
+
+class CategoryColumn:
+    """Dictionary-encoded column: int32 codes into a list of distinct values"""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    @classmethod
+    def encode(cls, items):
+        index = {}
+        codes = np.fromiter((index.setdefault(v, len(index)) for v in items), dtype=np.int32, count=len(items))
+        return cls(codes, list(index))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self):
+        values = self.values
+        return [values[c] for c in self.codes.tolist()]
+
+    def map_values(self, fn):
+        """Apply fn once per distinct value and expand to one result per row"""
+        mapped = [fn(v) for v in self.values]
+        return [mapped[c] for c in self.codes.tolist()]
+
+    def lookup(self, mapping, default=None):
+        """Array of mapping[value] per row, resolved once per distinct value"""
+        table = np.array([mapping.get(v, default) for v in self.values] or [default])
+        return table[self.codes]
+
+    def counts(self):
+        """{value: rows} without touching individual rows"""
+        counts = np.bincount(self.codes, minlength=len(self.values))
+        return {v: int(n) for v, n in zip(self.values, counts) if n}
+
+    def take(self, index):
+        return CategoryColumn(self.codes[index], self.values)
+
+    @staticmethod
+    def concat(columns):
+        """Merge dictionaries and remap each part's codes onto the merged one"""
+        index = {}
+        parts = []
+        for col in columns:
+            remap = np.array([index.setdefault(v, len(index)) for v in col.values] or [0], dtype=np.int32)
+            parts.append(remap[col.codes])
+        codes = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+        return CategoryColumn(codes, list(index))
+
+
+def _numeric(items):
+    return np.array([np.nan if v is None else v for v in items], dtype=np.float64)
+
+
+def _to_python(values, kind):
+    """Column array -> list of JSON-friendly Python values"""
+    if kind == "int":
+        return [None if v != v else int(v) for v in values.tolist()]
+    if kind == "float":
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+class ParcelTable:
+    def __init__(self, columns, apartment, latitude, longitude):
+        self.columns = columns
+        self.apartment = apartment
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @classmethod
+    def from_features(cls, features, classify):
+        """
+        Decode one MapServer response into columns. `classify(columns)`
+        returns the apartment mask for the whole batch (see landuse_rules);
+        fields missing from outFields come out null.
+        """
+        if isinstance(features, FeatureBatch):
+            # PBF responses arrive column by column already
+            column = features.column
+        else:
+            attrs = [f.get("attributes") or {} for f in features]
+            column = lambda field: [a.get(field) for a in attrs]
+
+        columns = {}
+        for name, (field, kind) in COLUMNS.items():
+            raw = column(field)
+            if kind == "category":
+                columns[name] = CategoryColumn.encode(raw)
+            elif kind == "str":
+                columns[name] = np.array(raw, dtype=object)
+            else:
+                columns[name] = _numeric(raw)
+
+        apartment = np.asarray(classify(columns), dtype=bool)
+        stats = batch_ring_stats(features)
+        return cls(columns, apartment, stats["latitude"], stats["longitude"])
+
+    @classmethod
+    def empty(cls):
+        return cls.from_features([], lambda columns: np.zeros(0, dtype=bool))
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        columns = {}
+        for name, (_, kind) in COLUMNS.items():
+            parts = [t.columns[name] for t in tables]
+            if kind == "category":
+                columns[name] = CategoryColumn.concat(parts)
+            else:
+                columns[name] = np.concatenate(parts)
+        return cls(
+            columns,
+            np.concatenate([t.apartment for t in tables]),
+            np.concatenate([t.latitude for t in tables]),
+            np.concatenate([t.longitude for t in tables])
+        )
+
+    def __len__(self):
+        return len(self.apartment)
+
+    def reclassify(self, classify):
+        """Same parcels with the apartment mask recomputed, e.g. after a rule change"""
+        return ParcelTable(self.columns, np.asarray(classify(self.columns), dtype=bool), self.latitude,
+                           self.longitude)
+
+    def rows(self, start, stop=None):
+        """Row range [start, stop) as a table sharing this table's arrays"""
+        index = slice(start, stop)
+        columns = {}
+        for name, col in self.columns.items():
+            columns[name] = col.take(index) if isinstance(col, CategoryColumn) else col[index]
+        return ParcelTable(columns, self.apartment[index], self.latitude[index], self.longitude[index])
+
+    @property
+    def apartment_count(self):
+        return int(self.apartment.sum())
+
+    def column(self, name):
+        """Decoded values of one stored or derived column, as a Python list"""
+        if name == "is_apartment":
+            return self.apartment.tolist()
+        if name == "latitude":
+            return _to_python(self.latitude, "float")
+        if name == "longitude":
+            return _to_python(self.longitude, "float")
+        col = self.columns[name]
+        if isinstance(col, CategoryColumn):
+            return col.decode()
+        return _to_python(col, COLUMNS[name][1])
+
+    def records(self, layout=None):
+        """
+        Materialize row dicts for export. `layout` maps output key -> column
+        name or a callable(table) returning one value per row; by default
+        every stored column plus is_apartment and the centroid.
+        """
+        if layout is None:
+            layout = {name: name for name in list(COLUMNS) + ["is_apartment", "latitude", "longitude"]}
+        keys = list(layout)
+        values = [spec(self) if callable(spec) else self.column(spec) for spec in layout.values()]
+        return [dict(zip(keys, row)) for row in zip(*values)]
+
+    def iter_batches(self, layout=None, batch_size=2000):
+        """records() in slices, so exports never hold every dict at once"""
+        for start in range(0, len(self), batch_size):
+            yield self.rows(start, start + batch_size).records(layout)
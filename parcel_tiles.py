@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Spatial quadtree crawl for the UMAPS Balady parcel layer
+
+Instead of OBJECTID ranges, parcels are fetched by envelope (geometry +
+spatialRel) over a quadtree laid on a fixed bounding box. A tile that comes
+back truncated (BATCH_SIZE or more parcels) splits into its four quadrants
+until every tile fits in one response, so dense districts get small tiles
+and empty desert costs one request per large tile.
+
+Tiles live on a Morton (Z-order) axis: at MAX_DEPTH the box is a
+2^MAX_DEPTH square grid and a tile at depth d is the contiguous key range of
+its 4^(MAX_DEPTH - d) cells. A tile is therefore a (start, end) range just
+like an OID range: TilePlanner runs through parcel_crawl.crawl_many on the
+shared worker pool, and tiles journal and resume like OID ranges. Splitting
+a tile into quadrants cuts its range in four.
+
+An envelope query also returns parcels that only reach into the tile, so
+each tile keeps just the parcels whose centroid lies in it (half-open on
+the max edges, closed on the root's); neighbours pick up the rest and
+nothing is written twice. Centroids outside the root box count at its edge.
+Parcels without geometry never match an envelope and need an OID crawl.
+
+A viewport or a single district crawls on demand: only the tiles covering
+it are queried, clipped to it. A district's viewport comes from one
+returnExtentOnly request.
+
+Usage:
+    python3 parcel_tiles.py --bbox 46.66,24.68,46.70,24.72 --output olaya
+    python3 parcel_tiles.py --district 00100001059 --workers 4
+"""
+
+import bisect
+import json
+import time
+
+import numpy as np
+
+from crawl_metrics import get_metrics
+from esri_pbf import FeatureBatch
+from parcel_crawl import BATCH_SIZE, OUT_FIELDS, count_batch, crawl_ranges, open_sinks, process_features
+from parcel_geometry import flatten_rings, ring_stats
+from parcel_manifest import city_where
+from rate_control import AdaptiveLimiter
+from umaps_client import get_client
+
+RIYADH_CITY_ID = "00100001"
+# lon/lat root of the Riyadh quadtree; fixed so tile keys stay valid across resumes
+RIYADH_BBOX = (46.2, 24.2, 47.4, 25.4)
+MAX_DEPTH = 16    # 65,536 x 65,536 cells, about 2 m across at Riyadh
+START_DEPTH = 3   # 64 tiles to begin with; dense ones split from there
+
+
+def _spread(v):
+    """Insert a zero bit between every bit of v"""
+    result = 0
+    bit = 0
+    while v:
+        result |= (v & 1) << (2 * bit)
+        v >>= 1
+        bit += 1
+    return result
+
+
+def _compact(key):
+    """Inverse of _spread: every other bit of key"""
+    result = 0
+    bit = 0
+    while key:
+        result |= (key & 1) << bit
+        key >>= 2
+        bit += 1
+    return result
+
+
+def morton(ix, iy):
+    return _spread(ix) | (_spread(iy) << 1)
+
+
+def unmorton(key):
+    return _compact(key), _compact(key >> 1)
+
+
+def tile_range(ix, iy, depth, max_depth=MAX_DEPTH):
+    """Morton key range of tile (ix, iy) in the 2^depth grid"""
+    shift = 2 * (max_depth - depth)
+    start = morton(ix, iy) << shift
+    return (start, start + (1 << shift))
+
+
+def tile_depth(tile, max_depth=MAX_DEPTH):
+    return max_depth - ((tile[1] - tile[0]).bit_length() - 1) // 2
+
+
+def tile_bounds(tile, bbox=RIYADH_BBOX, max_depth=MAX_DEPTH):
+    """(xmin, ymin, xmax, ymax) of a tile"""
+    ix, iy = unmorton(tile[0])
+    side = 1 << (max_depth - tile_depth(tile, max_depth))
+    cells = 1 << max_depth
+    x0, y0, x1, y1 = bbox
+    w = (x1 - x0) / cells
+    h = (y1 - y0) / cells
+    # Tiles on the root's max edges end exactly on them, so centroids_in can tell
+    return (x0 + ix * w, y0 + iy * h, x1 if ix + side == cells else x0 + (ix + side) * w,
+            y1 if iy + side == cells else y0 + (iy + side) * h)
+
+
+def tile_label(tile, max_depth=MAX_DEPTH):
+    """Quadkey of a tile: one digit (0-3) per level below the root"""
+    depth = tile_depth(tile, max_depth)
+    key = tile[0] >> 2 * (max_depth - depth)
+    return "".join(str((key >> 2 * (depth - 1 - i)) & 3) for i in range(depth)) or "root"
+
+
+def quadrants(tile):
+    """The four child tiles, in Morton order"""
+    lo, hi = tile
+    step = (hi - lo) // 4
+    return [(lo + i * step, lo + (i + 1) * step) for i in range(4)]
+
+
+def intersect(a, b):
+    """Overlap of two boxes, or None"""
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def viewport_depth(viewport, bbox=RIYADH_BBOX, max_depth=MAX_DEPTH):
+    """Deepest level whose tiles are still at least as large as the viewport (so 1-4 tiles cover it)"""
+    depth = 0
+    w = bbox[2] - bbox[0]
+    h = bbox[3] - bbox[1]
+    while depth < max_depth and w / 2 >= viewport[2] - viewport[0] and h / 2 >= viewport[3] - viewport[1]:
+        w /= 2
+        h /= 2
+        depth += 1
+    return depth
+
+
+def covering_tiles(viewport, bbox=RIYADH_BBOX, depth=START_DEPTH, max_depth=MAX_DEPTH):
+    """Tiles of `depth` overlapping the viewport, in Morton order"""
+    area = intersect(viewport, bbox)
+    if area is None:
+        return []
+    n = 1 << depth
+    w = (bbox[2] - bbox[0]) / n
+    h = (bbox[3] - bbox[1]) / n
+    x0 = min(n - 1, int((area[0] - bbox[0]) // w))
+    x1 = min(n - 1, int(np.ceil((area[2] - bbox[0]) / w)) - 1)
+    y0 = min(n - 1, int((area[1] - bbox[1]) // h))
+    y1 = min(n - 1, int(np.ceil((area[3] - bbox[1]) / h)) - 1)
+    return sorted(tile_range(ix, iy, depth, max_depth) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1))
+
+
+def pending_tiles(tiles, completed):
+    """
+    Cover `tiles` minus the completed (journaled) tiles with as few tiles as
+    possible. Completed tiles are quadtree tiles, so this always decomposes.
+    """
+    completed = sorted(completed)
+    out = []
+
+    def visit(tile, candidates):
+        overlapping = [c for c in candidates if c[0] < tile[1] and tile[0] < c[1]]
+        if not overlapping:
+            out.append(tile)
+        elif any(c[0] <= tile[0] and tile[1] <= c[1] for c in overlapping):
+            return
+        elif tile[1] - tile[0] > 1:
+            for child in quadrants(tile):
+                visit(child, overlapping)
+
+    for tile in tiles:
+        visit(tile, completed)
+    return out
+
+
+def envelope_params(bounds):
+    """Query parameters selecting everything that intersects a lon/lat box"""
+    xmin, ymin, xmax, ymax = bounds
+    return {
+        "geometry": json.dumps({"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax,
+                                "spatialReference": {"wkid": 4326}}),
+        "geometryType": "esriGeometryEnvelope",
+        "spatialRel": "esriSpatialRelIntersects",
+        "inSR": "4326"
+    }
+
+
+def centroids_in(features, box, root=RIYADH_BBOX, area=None):
+    """
+    Features whose area-weighted centroid lies in box. Like
+    osm_overpass.owns, centroids are clamped to the root box first (a parcel
+    without rings counts as its south-west corner) and the test is half-open
+    on the max edges except those of `area` (default the root), so every
+    parcel of the area belongs to exactly one tile.
+    """
+    stats = ring_stats(*flatten_rings(features), len(features))
+    x = np.clip(np.nan_to_num(stats["longitude"], nan=root[0]), root[0], root[2])
+    y = np.clip(np.nan_to_num(stats["latitude"], nan=root[1]), root[1], root[3])
+    area = area or root
+    east = (x < box[2]) | ((box[2] >= area[2]) & (x <= area[2]))
+    north = (y < box[3]) | ((box[3] >= area[3]) & (y <= area[3]))
+    inside = (x >= box[0]) & east & (y >= box[1]) & north
+    rows = np.flatnonzero(inside)
+    if len(rows) == len(features):
+        return features
+    if isinstance(features, FeatureBatch):
+        return features.take(rows)
+    return [features[i] for i in rows.tolist()]
+
+
+def fetch_tile(where, bounds, clip=None, root=RIYADH_BBOX):
+    """
+    Parcels matching `where` whose centroid lies in the tile (and in `clip`)
+    of the quadtree over `root`. Returns (features, truncated) like
+    parcel_crawl.fetch_batch, or None on error. Geometry is always
+    requested: the centroid decides ownership.
+    """
+    box = intersect(bounds, clip) if clip else bounds
+    if box is None:
+        return [], False
+    params = dict(envelope_params(box), **{
+        "where": where,
+        "outFields": OUT_FIELDS,
+        "returnGeometry": "true",
+        "resultRecordCount": str(BATCH_SIZE),
+        "f": "pjson"
+    })
+
+    try:
+        data = get_client().query_features(params)
+        if data is None or "error" in data:
+            return None
+        features = data.get("features", [])
+        truncated = data.get("exceededTransferLimit", False) or len(features) >= BATCH_SIZE
+        # Filtered even when truncated: a tile too small to split keeps what it got
+        return centroids_in(features, box, root, intersect(root, clip) if clip else root), truncated
+    except Exception as e:
+        print(f"Error: {e}")
+        get_metrics().inc("umaps_errors_total", endpoint="query", error=type(e).__name__)
+        return None
+
+
+def fetch_extent(where):
+    """(xmin, ymin, xmax, ymax) of everything matching `where` (returnExtentOnly), or None"""
+    try:
+        data = get_client().get_json({"where": where, "returnExtentOnly": "true", "outSR": "4326", "f": "pjson"})
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+    extent = (data or {}).get("extent") or {}
+    if "error" in (data or {}) or extent.get("xmin") is None or extent.get("xmin") == "NaN":
+        return None
+    return (extent["xmin"], extent["ymin"], extent["xmax"], extent["ymax"])
+
+
+class TilePlanner:
+    """
+    Planner over quadtree tiles, interchangeable with the OID planners: tiles
+    are Morton key ranges, so crawl_many orders, splits and journals them the
+    same way. `fetch_tile(bounds)` runs the envelope query of one tile.
+    """
+
+    def __init__(self, tiles, fetch_tile, bbox=RIYADH_BBOX, completed=(), max_depth=MAX_DEPTH):
+        self.bbox = bbox
+        self.max_depth = max_depth
+        self.tiles = pending_tiles(sorted(tiles), completed)
+        self.starts = [start for start, _ in self.tiles]
+        self.fetch_tile = fetch_tile
+        self.index = 0
+        self.cursor = self.starts[0] if self.tiles else 0
+        self.requests = 0
+        self.splits = 0
+
+    def next_start(self, key):
+        """key itself if it lies inside a planned tile, else the next tile start"""
+        i = bisect.bisect_right(self.starts, key) - 1
+        if i >= 0 and key < self.tiles[i][1]:
+            return key
+        return self.starts[i + 1] if i + 1 < len(self.starts) else float("inf")
+
+    def next_range(self):
+        if self.index >= len(self.tiles):
+            return None
+        tile = self.tiles[self.index]
+        self.index += 1
+        return tile
+
+    def bounds(self, tile):
+        return tile_bounds(tile, self.bbox, self.max_depth)
+
+    def fetch(self, tile):
+        result = self.fetch_tile(self.bounds(tile))
+        if result is not None and result[1] and tile[1] - tile[0] == 1:
+            # crawl_many cannot split a single cell, so its parcels past the page are missed
+            print(f"Warning: tile {tile_label(tile, self.max_depth)} is still truncated at the deepest level; "
+                  f"keeping {len(result[0]):,} parcels")
+            get_metrics().inc("tile_truncated_at_max_depth_total")
+        return result
+
+    def split(self, tile):
+        """A truncated tile becomes its four quadrants"""
+        self.splits += 1
+        return quadrants(tile)
+
+    def record(self, tile, count):
+        pass
+
+
+def city_tiles(depth=START_DEPTH):
+    """Every tile of `depth`: the whole root box"""
+    n = 1 << depth
+    return sorted(tile_range(ix, iy, depth) for ix in range(n) for iy in range(n))
+
+
+def crawl_area(viewport, where, workers=1, limiter=None, bbox=RIYADH_BBOX):
+    """
+    Yield (tile, features) for the parcels of `where` with their centroid in
+    the viewport: only the tiles covering it are queried, clipped to it.
+    """
+    tiles = covering_tiles(viewport, bbox, viewport_depth(viewport, bbox))
+    planner = TilePlanner(tiles, lambda bounds: fetch_tile(where, bounds, clip=viewport, root=bbox), bbox)
+    for tile, features in crawl_ranges(planner, workers, limiter):
+        yield tile, features
+    print(f"Requests: {planner.requests:,} ({planner.splits:,} truncated tiles split)")
+
+
+def parse_bbox(text):
+    """"xmin,ymin,xmax,ymax" -> tuple of floats"""
+    values = [float(v) for v in text.split(",")]
+    if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+        raise ValueError(f"Expected xmin,ymin,xmax,ymax, got {text!r}")
+    return tuple(values)
+
+
+def main(viewport=None, district=None, city_id=RIYADH_CITY_ID, workers=1, rate=1.0, max_rate=None,
+         output="parcels_area"):
+    where = city_where(city_id)
+    if district:
+        where = f"{where} AND DISTRICT_ID = '{district}'"
+        print(f"Fetching the extent of district {district}...")
+        extent = fetch_extent(where)
+        if extent is None:
+            print("Could not fetch the district extent")
+            return
+        viewport = intersect(viewport, extent) if viewport else extent
+        if viewport is None:
+            print("The district lies outside the given viewport")
+            return
+    print(f"Viewport: {', '.join(f'{v:.6f}' for v in viewport)}")
+
+    limiter = AdaptiveLimiter(rate, max_rate=max_rate, max_concurrency=workers)
+    get_client().warm_up()
+    sink = open_sinks(output)
+    start_time = time.time()
+    total = 0
+    for tile, features in crawl_area(viewport, where, workers, limiter):
+        parcels = process_features(features)
+        with get_metrics().stage("write"):
+            sink.write_batch(parcels)
+        count_batch(parcels, city_id)
+        total += len(parcels)
+        print(f"Tile {tile_label(tile)}: {len(parcels):,} parcels (Total: {total:,})")
+
+    print(f"Done in {time.time() - start_time:.1f}s: {total:,} parcels, pacing {limiter.summary()}")
+    sink.close({"source": "UMAPS Balady", "city": city_id, "district": district, "viewport": list(viewport)})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from crawl_metrics import start_metrics
+    from response_cache import ResponseCache
+    from umaps_client import FEATURE_FORMATS, configure_client
+
+    parser = argparse.ArgumentParser(description="Crawl the parcels of one viewport or district by quadtree tiles")
+    parser.add_argument("--bbox", type=str, default=None, help="Viewport as xmin,ymin,xmax,ymax (lon/lat)")
+    parser.add_argument("--district", type=str, default=None, help="DISTRICT_ID to crawl (its extent is the viewport)")
+    parser.add_argument("--city", type=str, default=RIYADH_CITY_ID, help="CITY_ID the parcels belong to")
+    parser.add_argument("--workers", type=int, default=1, help="Tiles fetched concurrently")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Starting request rate (requests/sec, adapts; 0 = unpaced until throttled)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Ceiling for the adaptive request rate (0 = none)")
+    parser.add_argument("--output", type=str, default="parcels_area", help="Output filename prefix")
+    parser.add_argument("--format", choices=FEATURE_FORMATS, default="pjson",
+                        help="Response format for feature queries (pbf is smaller and faster to decode; falls back to pjson)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Directory for the on-disk response cache; re-runs replay cached batches")
+    parser.add_argument("--cache-ttl", type=float, default=24, help="Hours before a cached response expires")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Size bound of the response cache")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write crawl metrics snapshots here (.prom for Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between metrics snapshots")
+    args = parser.parse_args()
+    if not args.bbox and not args.district:
+        parser.error("give --bbox and/or --district")
+
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 ** 2)
+    configure_client(pool_size=max(args.workers, 1), feature_format=args.format, cache=cache)
+    metrics = start_metrics(args.metrics, args.metrics_interval)
+    try:
+        main(viewport=parse_bbox(args.bbox) if args.bbox else None, district=args.district, city_id=args.city,
+             workers=args.workers, rate=args.rate, max_rate=args.max_rate, output=args.output)
+    finally:
+        if metrics is not None:
+            metrics.close()
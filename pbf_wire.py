@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Minimal protobuf wire-format reader and writer
+
+Just enough of the protobuf encoding to walk messages without generated
+classes or the protobuf package: varints, length-delimited fields and
+fixed-width numbers. Packed varint arrays (coordinates, id lists) are
+decoded with NumPy in one pass instead of one Python call per value.
+
+The writing half builds messages field by field for the stand-in servers
+(f=pbf responses, .osm.pbf extracts) and encodes packed varint arrays in
+one vectorized pass, as the shapes file stores its coordinates.
+"""
+
+import struct
+
+import numpy as np
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+_DOUBLE = struct.Struct("<d")
+_FLOAT = struct.Struct("<f")
+
+
+def read_varint(buf, pos):
+    """Decode one varint at pos -> (value, next position)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag_decode(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed64(value):
+    """Reinterpret a decoded uint64 varint as a two's-complement int64"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def iter_fields(buf, pos=0, end=None):
+    """
+    Walk the fields of one message in buf[pos:end].
+    Yields (field number, wire type, value): an int for varints, a
+    memoryview slice for length-delimited fields, raw bytes for fixed32/64.
+    """
+    buf = memoryview(buf)
+    if end is None:
+        end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        if pos > end:
+            raise ValueError("Truncated protobuf message")
+        yield field, wire_type, value
+
+
+def read_double(raw):
+    return _DOUBLE.unpack(raw)[0]
+
+
+def read_float(raw):
+    return _FLOAT.unpack(raw)[0]
+
+
+def read_string(raw):
+    return str(raw, "utf-8")
+
+
+def packed_varints(buf):
+    """Decode a packed repeated varint field into a uint64 array"""
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.uint64)
+    if data[-1] & 0x80:
+        raise ValueError("Truncated packed varint field")
+
+    # A varint ends at every byte without the continuation bit
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    position = np.arange(len(data)) - np.repeat(starts, lengths)
+    payload = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+
+    # 7-bit groups never overlap, so adding them is the same as OR-ing them
+    return np.add.reduceat(payload, starts)
+
+
+def packed_sint64(buf):
+    """Decode a packed repeated sint64 (zigzag) field into an int64 array"""
+    values = packed_varints(buf)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+# --- Writing ----------------------------------------------------------------
+
+def encode_varint(value):
+    """One varint; a negative int is written as its two's-complement uint64"""
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag_encode(value):
+    """Signed int (or int64 array) -> zigzag, as sint64 fields store it"""
+    return (value << 1) ^ (value >> 63)
+
+
+def bytes_field(number, payload):
+    """Length-delimited field: a string, bytes, packed array or nested message"""
+    return encode_varint(number << 3 | LENGTH_DELIMITED) + encode_varint(len(payload)) + payload
+
+
+def varint_field(number, value):
+    return encode_varint(number << 3 | VARINT) + encode_varint(value)
+
+
+def double_field(number, value):
+    return encode_varint(number << 3 | FIXED64) + _DOUBLE.pack(value)
+
+
+def varint_lengths(values):
+    """Bytes each uint64 needs as a varint"""
+    lengths = np.ones(len(values), dtype=np.int64)
+    v = values >> np.uint64(7)
+    while v.any():
+        lengths += v > 0
+        v >>= np.uint64(7)
+    return lengths
+
+
+def encode_varints(values):
+    """Vectorized LEB128 encoding of a uint64 array -> (bytes, length per value)"""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = varint_lengths(values)
+    width = int(lengths.max()) if len(values) else 1
+    shifts = np.arange(width, dtype=np.uint64) * np.uint64(7)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    position = np.arange(width)
+    groups[position < (lengths[:, None] - 1)] |= 0x80
+    return groups[position < lengths[:, None]].tobytes(), lengths
+
+
+def pack_varints(values):
+    """Payload of a packed repeated varint field (inverse of packed_varints)"""
+    return encode_varints(values)[0]
+
+
+def pack_deltas(values):
+    """Packed sint64 deltas, as DenseNodes ids/coordinates and way refs are stored"""
+    deltas = np.diff(np.asarray(values, dtype=np.int64), prepend=0)
+    return pack_varints(zigzag_encode(deltas).astype(np.uint64))
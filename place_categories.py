@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Place categories shared by the OSM fetcher and the building extractor
+
+The taxonomy is data: CATEGORY_RULES lists (category, conditions) in
+priority order, where conditions map an OSM tag key to the values that
+match (ANY for any non-empty value) and all of them must hold. The first
+rule that matches wins. The table opens with the old if/elif chain of
+fetch_osm_riyadh.categorize, in its order and with its values (only its
+shop=* share is split finer). Values it did not know follow it, so they
+never take an element from a category the old chain assigned; they only
+outrank the building=yes fallback. CATEGORY_GROUPS rolls the categories up
+into the coarser legend of the building map.
+
+Taxonomy compiles the rules into lookup tables:
+  - (key, value) -> candidate rules, so one element only tests the rules
+    its own tags can satisfy
+  - (key, value) -> category for single-tag records (the building
+    extractor's [lat, lon, name, key, value] rows), and value -> category
+    for rows that only kept the value
+and categorize() resolves each distinct combination of tag values in a
+batch once, expanding the result back over the batch.
+"""
+
+from itertools import count
+from operator import itemgetter
+
+ANY = None
+DEFAULT_CATEGORY = "Other"
+
+WORSHIP_BUILDINGS = ("church", "temple", "chapel")
+
+CATEGORY_RULES = [
+    # --- The old categorize() chain, in its order and with its values ---
+
+    # Residential
+    ("Residential - Villas", {"building": ("villa",)}),
+    ("Residential - Apartments", {"building": ("apartments",)}),
+    ("Residential", {"building": ("residential", "house", "detached", "terrace")}),
+
+    # Places of worship; religion refines the generic tags
+    ("Mosques", {"building": ("mosque",)}),
+    ("Mosques", {"amenity": ("place_of_worship",), "religion": ("muslim",)}),
+    ("Mosques", {"building": WORSHIP_BUILDINGS, "religion": ("muslim",)}),
+    ("Churches", {"building": ("church",)}),
+    ("Churches", {"amenity": ("place_of_worship",), "religion": ("christian",)}),
+    ("Churches", {"building": WORSHIP_BUILDINGS, "religion": ("christian",)}),
+    ("Places of Worship", {"amenity": ("place_of_worship",)}),
+    ("Places of Worship", {"building": WORSHIP_BUILDINGS}),
+
+    # Commercial
+    ("Commercial Buildings", {"building": ("commercial", "retail", "office", "mall")}),
+
+    # Hotels & tourism
+    ("Hotels", {"building": ("hotel",)}),
+    ("Hotels", {"tourism": ("hotel", "motel", "hostel", "guest_house")}),
+    ("Tourist Attractions", {"tourism": ("attraction", "museum", "viewpoint", "artwork")}),
+
+    # Healthcare
+    ("Healthcare", {"amenity": ("hospital", "clinic", "doctors", "dentist")}),
+    ("Healthcare", {"building": ("hospital",)}),
+    ("Pharmacies", {"amenity": ("pharmacy",)}),
+
+    # Education
+    ("Education", {"amenity": ("school", "university", "college", "kindergarten")}),
+    ("Education", {"building": ("school", "university")}),
+
+    # Government & services
+    ("Government & Services", {"building": ("government", "public", "civic")}),
+    ("Government & Services", {"amenity": ("police", "fire_station", "courthouse", "townhall")}),
+
+    # Restaurants & cafes
+    ("Restaurants & Cafes", {"amenity": ("restaurant", "cafe", "fast_food", "food_court", "bar")}),
+
+    # Shops; the old chain sent every shop here, the finer split only divides that share
+    ("Supermarkets & Grocery", {"shop": ("supermarket", "convenience", "grocery")}),
+    ("Fashion & Clothing", {"shop": ("clothes", "shoes", "fashion", "jewelry", "bag")}),
+    ("Electronics", {"shop": ("electronics", "computer", "mobile_phone", "hifi", "audio_video", "camera",
+                              "electrical")}),
+    ("Automotive Shops", {"shop": ("car", "car_parts", "car_repair", "tyres", "motorcycle", "tractors", "fuel",
+                                   "gas")}),
+    ("Food & Grocery", {"shop": ("bakery", "butcher", "greengrocer", "seafood", "deli", "confectionery",
+                                 "chocolate", "pastry", "pasta", "tea", "coffee", "beverages", "wine", "spices",
+                                 "nuts", "health_food", "food", "farm", "dairy", "herbalist")}),
+    ("Home & Garden", {"shop": ("furniture", "bed", "houseware", "interior_decoration", "kitchen", "lighting",
+                                "tiles", "doors", "window_blind", "window_blind;chemist", "paint", "garden_centre",
+                                "appliance", "hardware", "doityourself", "tools", "tool_hire")}),
+    ("Beauty & Personal Care", {"shop": ("beauty", "hairdresser", "hairdresser_supply", "cosmetics", "perfumery",
+                                         "massage", "chemist", "tobacco")}),
+    ("Healthcare", {"shop": ("optician", "medical_supply")}),
+    ("Services", {"shop": ("dry_cleaning", "laundry", "tailor", "copyshop", "photo", "locksmith", "travel_agency",
+                           "ticket")}),
+    ("Pets & Animals", {"shop": ("pet", "pet_grooming")}),
+    ("Baby & Kids", {"shop": ("baby_goods",)}),
+    ("Sports Equipment", {"shop": ("sports", "outdoor", "weapons", "musical_instrument", "water_sports")}),
+    ("Transportation", {"shop": ("bicycle",)}),
+    ("Banks & Finance", {"shop": ("pawnbroker",)}),
+    ("Business & Office", {"shop": ("trade", "wholesale", "storage_rental")}),
+    ("Shops & Retail", {"shop": ("mall", "department_store", "general", "variety_store", "books", "stationery",
+                                 "toys", "games", "video_games", "gift", "florist", "party", "bookmaker")}),
+    ("Shops & Retail", {"shop": ANY}),
+
+    # Finance
+    ("Banks & Finance", {"amenity": ("bank", "atm", "bureau_de_change")}),
+
+    # Entertainment & leisure
+    ("Parks & Gardens", {"leisure": ("park", "garden", "playground")}),
+    ("Sports & Fitness", {"leisure": ("sports_centre", "stadium", "fitness_centre", "swimming_pool")}),
+    ("Entertainment", {"amenity": ("cinema", "theatre", "nightclub")}),
+
+    # Transportation
+    ("Fuel & Car Services", {"amenity": ("fuel", "charging_station", "car_wash", "car_rental")}),
+    ("Parking", {"amenity": ("parking",)}),
+
+    # Industrial
+    ("Industrial", {"building": ("industrial", "warehouse", "factory")}),
+
+    # --- Values the old chain did not know; they never outrank it, only building=yes ---
+
+    ("Hotels", {"leisure": ("resort",)}),
+    ("Tourist Attractions", {"tourism": ("information",)}),
+    ("Residential", {"tourism": ("apartment", "chalet")}),
+
+    ("Healthcare", {"amenity": ("nursing_home", "veterinary")}),
+    # Listed so bare extractor values resolve; ANY then takes the rest
+    ("Healthcare", {"healthcare": ("hospice", "rehabilitation", "optometrist", "physiotherapist", "alternative",
+                                   "laboratory", "healthcare")}),
+    ("Healthcare", {"healthcare": ANY}),
+    ("Healthcare", {"office": ("therapist",)}),
+
+    ("Education", {"amenity": ("library", "language_school", "driving_school", "science_park")}),
+    ("Education", {"office": ("educational_institution", "research")}),
+
+    ("Government & Services", {"amenity": ("post_office", "post_box", "post_depot", "prison", "checkpoint")}),
+    ("Government & Services", {"office": ("government", "diplomatic", "administrative", "water_utility")}),
+
+    ("Restaurants & Cafes", {"amenity": ("ice_cream", "hookah_lounge", "internet_cafe", "juice", "Juice bar")}),
+
+    ("Shops & Retail", {"amenity": ("marketplace",)}),
+
+    ("Banks & Finance", {"office": ("financial", "insurance")}),
+
+    ("Parks & Gardens", {"leisure": ("dog_park", "nature_reserve")}),
+    ("Parks & Gardens", {"tourism": ("picnic_site",)}),
+    ("Sports & Fitness", {"leisure": ("fitness_station", "sports_hall", "golf_course", "bowling_alley",
+                                      "miniature_golf", "horse_riding", "pitch", "track", "dance")}),
+    ("Entertainment", {"amenity": ("arts_centre",)}),
+    ("Entertainment", {"leisure": ("amusement_arcade", "bandstand")}),
+    ("Entertainment", {"tourism": ("zoo", "theme_park")}),
+
+    ("Fuel & Car Services", {"amenity": ("compressed_air", "vehicle_inspection", "motorcycle_rental")}),
+    ("Parking", {"amenity": ("parking_entrance", "parking_space", "motorcycle_parking", "bicycle_parking")}),
+    ("Transportation", {"amenity": ("taxi", "bus_station", "bus_stop", "bicycle_rental")}),
+
+    ("Community", {"amenity": ("community_centre", "social_centre", "social_facility", "events_venue",
+                               "conference_centre", "exhibition_centre", "childcare", "public_bath")}),
+    ("Community", {"office": ("charity", "ngo", "foundation", "association")}),
+    ("Pets & Animals", {"amenity": ("animal_shelter", "animal_boarding", "animal_breeding")}),
+    ("Business & Office", {"amenity": ("office", "publisher")}),
+    ("Business & Office", {"office": ("company", "coworking", "consulting", "it", "advertising_agency",
+                                      "employment_agency", "estate_agent", "lawyer", "notary", "telecommunication",
+                                      "courier", "logistics", "publisher", "energy_supplier")}),
+    ("Business & Office", {"office": ANY}),
+
+    # Buildings without a more specific tag
+    ("Other Buildings", {"building": ("yes",)}),
+]
+
+# Category -> legend group of the building map (extract_riyadh_buildings)
+CATEGORY_GROUPS = {
+    "Residential - Villas": "Residential - Villas",
+    "Residential - Apartments": "Residential - Apartments",
+    "Residential": "Residential",
+    "Mosques": "Religious",
+    "Churches": "Religious",
+    "Places of Worship": "Religious",
+    "Commercial Buildings": "Business & Office",
+    "Hotels": "Hotels & Tourism",
+    "Tourist Attractions": "Hotels & Tourism",
+    "Healthcare": "Healthcare",
+    "Pharmacies": "Healthcare",
+    "Education": "Education",
+    "Government & Services": "Government & Services",
+    "Restaurants & Cafes": "Restaurants & Cafes",
+    "Supermarkets & Grocery": "Food & Grocery",
+    "Fashion & Clothing": "Shops & Retail",
+    "Electronics": "Electronics & Tech",
+    "Automotive Shops": "Automotive",
+    "Food & Grocery": "Food & Grocery",
+    "Home & Garden": "Home & Garden",
+    "Beauty & Personal Care": "Beauty & Personal Care",
+    "Services": "Services",
+    "Pets & Animals": "Pets & Animals",
+    "Baby & Kids": "Baby & Kids",
+    "Sports Equipment": "Sports Equipment",
+    "Transportation": "Transportation",
+    "Banks & Finance": "Finance & Banking",
+    "Business & Office": "Business & Office",
+    "Shops & Retail": "Shops & Retail",
+    "Parks & Gardens": "Entertainment",
+    "Sports & Fitness": "Sports & Fitness",
+    "Entertainment": "Entertainment",
+    "Fuel & Car Services": "Automotive",
+    "Parking": "Transportation",
+    "Community": "Community",
+    "Industrial": "Business & Office",
+    "Other Buildings": "Other",
+    "Other": "Other",
+}
+
+# A bare value (no key) is read as the first of these keys that lists it
+VALUE_KEYS = ("amenity", "shop", "leisure", "tourism", "office", "healthcare", "building")
+
+
+class Taxonomy:
+    """
+    A compiled CATEGORY_RULES table. category() classifies one tag dict,
+    categorize() a batch of them.
+    """
+
+    def __init__(self, rules, groups=None, default=DEFAULT_CATEGORY):
+        self.default = default
+        self.groups = dict(groups or {})
+        self.rules = []
+        for category, conditions in rules:
+            if not conditions:
+                raise ValueError(f"Rule for {category!r} has no conditions")
+            self.rules.append((category, [(key, ANY if values is ANY else frozenset(values))
+                                          for key, values in conditions.items()]))
+        self.keys = tuple(sorted({key for _, conditions in self.rules for key, _ in conditions}))
+
+        # (key, value) and key (for ANY) -> numbers of the rules that condition on them
+        self.candidates = {}
+        self.any_value = {}
+        for number, (_, conditions) in enumerate(self.rules):
+            for key, values in conditions:
+                if values is ANY:
+                    self.any_value.setdefault(key, []).append(number)
+                else:
+                    for value in values:
+                        self.candidates.setdefault((key, value), []).append(number)
+
+        # Single-tag lookups, resolved through the rules so they agree with category()
+        self.pairs = {pair: self.category({pair[0]: pair[1]}) for pair in self.candidates}
+        self.wildcards = {key: self.category({key: "\0"}) for key in self.any_value}
+        self.values = {}
+        for key in reversed(VALUE_KEYS):
+            self.values.update({value: category for (k, value), category in self.pairs.items() if k == key})
+
+    def category(self, tags):
+        """First matching category for one dict of tags (empty values count as missing)"""
+        numbers = set()
+        for key in self.keys:
+            value = tags.get(key)
+            if value:
+                numbers.update(self.candidates.get((key, value), ()))
+                numbers.update(self.any_value.get(key, ()))
+        for number in sorted(numbers):
+            category, conditions = self.rules[number]
+            for key, values in conditions:
+                value = tags.get(key)
+                if not value or (values is not ANY and value not in values):
+                    break
+            else:
+                return category
+        return self.default
+
+    def categorize(self, records, fields=None):
+        """
+        Category per record. `fields` names the tag keys every record
+        carries (missing tags as ""), which lets the batch be read with one
+        itemgetter; otherwise each rule key is looked up with .get().
+        """
+        if fields is not None:
+            keys = tuple(key for key in self.keys if key in fields)
+            if not keys:
+                return [self.default] * len(records)
+            getter = itemgetter(*keys)
+            rows = map(getter, records) if len(keys) > 1 else ((value,) for value in map(getter, records))
+        else:
+            keys = self.keys
+            rows = (tuple(map(record.get, keys)) for record in records)
+        # Every row maps to the position of the first row with the same values
+        first = {}
+        positions = list(map(first.setdefault, rows, count()))
+        categories = {position: self.category(dict(zip(keys, combo))) for combo, position in first.items()}
+        return list(map(categories.__getitem__, positions))
+
+    def pair_category(self, key, value):
+        """Category of an element whose only tag is key=value"""
+        category = self.pairs.get((key, value))
+        if category is None:
+            category = self.wildcards.get(key, self.default) if value else self.default
+        return category
+
+    def value_category(self, value):
+        """Category of a bare tag value whose key was not kept"""
+        return self.values.get(value, self.default)
+
+    def group(self, category):
+        return self.groups.get(category, category)
+
+
+TAXONOMY = Taxonomy(CATEGORY_RULES, CATEGORY_GROUPS)
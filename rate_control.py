@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Adaptive request pacing for the UMAPS scrapers
+
+AdaptiveLimiter is one AIMD controller shared by every worker. It holds two
+limits, a request rate (slots per second) and a concurrency (requests in
+flight), and adjusts both from what the server answers:
+
+  healthy response     additive increase: the rate grows by `increase` req/s
+                       and the concurrency by one per full window
+  403 / failed request multiplicative decrease: both limits are cut by
+                       `decrease`, and the next slot moves one new interval
+                       out
+  rising latency       the same decrease when the smoothed response time
+                       climbs past `latency_factor` x the best seen (and at
+                       least `latency_floor` seconds above it)
+
+Only requests sent after the last decrease can cause another one, so a
+burst of in-flight failures counts as a single congestion event. The rate
+never leaves [min_rate, max_rate] and the concurrency never leaves
+[1, max_concurrency]. Starting with rate <= 0 means unpaced: requests go out
+as fast as the concurrency allows until the server first pushes back, and
+the rate then starts from the throughput observed up to that point.
+
+Every request is bracketed by wait(), which returns a ticket, and exactly one
+of success(ticket), backoff(ticket, reason), refund(ticket) (answered from
+the cache, costs nothing) or release(ticket) (no signal either way).
+"""
+
+import threading
+import time
+from collections import deque
+
+from crawl_metrics import get_metrics
+
+
+class AdaptiveLimiter:
+    """AIMD request budget: rate and concurrency follow what the server allows"""
+
+    def __init__(self, rate=1.0, max_rate=None, min_rate=0.05, max_concurrency=1, increase=0.05, decrease=0.5,
+                 latency_factor=2.0, latency_floor=0.25):
+        self.rate = rate if rate > 0 else None
+        self.max_rate = max_rate if max_rate and max_rate > 0 else None
+        self.min_rate = min_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = 1.0
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+
+        self.latency = None       # smoothed response time since the last decrease
+        self.best_latency = None  # slowly forgetting minimum
+        self.in_flight = 0
+        self.backoffs = 0
+        self.last_backoff = float("-inf")
+        self.next_slot = time.monotonic()
+        self.completions = deque(maxlen=64)
+        self.cond = threading.Condition()
+        if self.rate is not None:
+            self.rate = self._clamp(self.rate)
+        self._publish()
+
+    def _clamp(self, rate):
+        rate = max(self.min_rate, rate)
+        return min(rate, self.max_rate) if self.max_rate else rate
+
+    def _throughput(self):
+        """Completed requests per second over the recent window, or None"""
+        if len(self.completions) < 2 or self.completions[-1] <= self.completions[0]:
+            return None
+        return (len(self.completions) - 1) / (self.completions[-1] - self.completions[0])
+
+    def _publish(self):
+        metrics = get_metrics()
+        metrics.set("crawl_rate_limit", self.rate or 0.0)
+        metrics.set("crawl_concurrency_limit", int(self.concurrency))
+
+    def wait(self):
+        """Block until a concurrency permit and a rate slot are free; returns the request's ticket"""
+        with self.cond:
+            while self.in_flight >= int(self.concurrency):
+                self.cond.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + (1.0 / self.rate if self.rate else 0.0)
+        if slot > now:
+            time.sleep(slot - now)
+        return time.monotonic()
+
+    def _release(self):
+        self.in_flight -= 1
+        self.cond.notify_all()
+
+    def _decrease(self, reason, now):
+        self.last_backoff = now
+        self.backoffs += 1
+        if self.rate is None:
+            self.rate = self._throughput() or 1.0
+        self.rate = self._clamp(self.rate * self.decrease)
+        self.concurrency = max(1.0, self.concurrency * self.decrease)
+        self.next_slot = max(self.next_slot, now + 1.0 / self.rate)
+        self.latency = None
+        get_metrics().inc("crawl_backoffs_total", reason=reason)
+
+    def _congested(self):
+        return (self.latency > self.best_latency * self.latency_factor
+                and self.latency - self.best_latency > self.latency_floor)
+
+    def success(self, ticket):
+        """A healthy response: feed its latency and raise the limits"""
+        now = time.monotonic()
+        latency = now - ticket
+        with self.cond:
+            self._release()
+            self.completions.append(now)
+            self.latency = latency if self.latency is None else self.latency + 0.2 * (latency - self.latency)
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+            else:
+                self.best_latency += 0.01 * (latency - self.best_latency)
+
+            if ticket >= self.last_backoff and self._congested():
+                self._decrease("latency", now)
+            else:
+                if self.rate is not None:
+                    self.rate = self._clamp(self.rate + self.increase)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._publish()
+
+    def backoff(self, ticket, reason="throttled"):
+        """The server refused or failed the request: cut the limits (once per congestion event)"""
+        now = time.monotonic()
+        with self.cond:
+            self._release()
+            if ticket >= self.last_backoff:
+                self._decrease(reason, now)
+                self._publish()
+
+    def refund(self, ticket):
+        """Give back a slot whose request never reached the network (cache hit)"""
+        with self.cond:
+            self._release()
+            if self.rate:
+                self.next_slot = max(time.monotonic(), self.next_slot - 1.0 / self.rate)
+
+    def release(self, ticket):
+        """Return the permit without any feedback"""
+        with self.cond:
+            self._release()
+
+    def summary(self):
+        rate = f"{self.rate:.2f} req/s" if self.rate else "unpaced"
+        return f"{rate}, concurrency {int(self.concurrency)}, {self.backoffs:,} backoffs"
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Return the process-wide shared limiter, creating it on first use"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter()
+        return _limiter
+
+
+def configure_limiter(**kwargs):
+    """Replace the shared limiter, e.g. with the rate given on the command line"""
+    global _limiter
+    with _limiter_lock:
+        _limiter = AdaptiveLimiter(**kwargs)
+        return _limiter
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk cache for MapServer query responses
+
+Entries are content-addressed: the file name is the SHA-256 of the
+normalized request (method, URL, sorted query and form parameters), so the
+same query always maps to the same file no matter how its parameters were
+ordered. Bodies are stored zlib-compressed behind a small header holding the
+time they were fetched.
+
+  - entries older than `ttl` seconds are misses (and are deleted)
+  - the directory is kept under `max_bytes` by evicting the least recently
+    used entries; a hit touches the file's mtime
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode
+
+MAGIC = b"RCACHE1\0"
+HEADER = struct.Struct("<8sd")  # magic, fetched at (unix time)
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def normalize_request(method, url, body=None):
+    """
+    Canonical text of a request. The proxy URL embeds the MapServer URL in
+    its own query string, so only the part after the last "?" is treated as
+    parameters, and only if it looks like key=value pairs.
+    """
+    base, _, query = url.rpartition("?")
+    if not base or "=" not in query:
+        base, query = url, ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    params = parse_qsl(query, keep_blank_values=True) + parse_qsl(body or "", keep_blank_values=True)
+    return f"{method.upper()} {base}?{urlencode(sorted(params))}"
+
+
+def request_key(method, url, body=None):
+    return hashlib.sha256(normalize_request(method, url, body).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe, size-bounded, TTL-expiring store of response bodies"""
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, level=6):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        """(mtime, path, size) of every stored entry"""
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    yield stat.st_mtime, entry.path, stat.st_size
+
+    def get(self, key):
+        """Stored body for key, or None on a miss or expired entry"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            magic, fetched_at = HEADER.unpack_from(blob)
+            if magic != MAGIC:
+                raise ValueError("not a cache entry")
+            if self.ttl is not None and time.time() - fetched_at > self.ttl:
+                self._remove(path)
+                raise ValueError("expired")
+            content = zlib.decompress(blob[HEADER.size:])
+        except (OSError, ValueError, struct.error, zlib.error):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # most recently used
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return content
+
+    def put(self, key, content):
+        blob = HEADER.pack(MAGIC, time.time()) + zlib.compress(content, self.level)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file and rename, so readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp, path)
+
+        with self.lock:
+            self.size += len(blob) - old_size
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            self.size -= size
+
+    def evict(self):
+        """Drop least recently used entries until the cache is 90% of max_bytes"""
+        target = self.max_bytes * 0.9
+        for _, path, _ in sorted(self._entries()):
+            if self.size <= target:
+                break
+            self._remove(path)
+
+    def clear(self):
+        for _, path, _ in list(self._entries()):
+            self._remove(path)
+
+    def summary(self):
+        return f"{self.hits:,} hits, {self.misses:,} misses, {self.size / 1e6:.1f} MB on disk"
@@ -3,110 +3,50 @@
 Fast Riyadh Parcel Scraper - Gets ALL parcels
 """
 
-import requests
-import json
+import os
+import shutil
 import time
-import csv
-from datetime import datetime
-from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
-BASE_URL = "https://umaps.balady.gov.sa/newProxyUDP/proxy.ashx"
-MAP_SERVER = "https://umapsudp.momrah.gov.sa/server/rest/services/Umaps/Umaps_Identify_Satatistics/MapServer/28/query"
-RIYADH_CITY_ID = "00100001"
-BATCH_SIZE = 2000
-HEADERS = {
-    "Referer": "https://umaps.balady.gov.sa/",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-}
-
-# Land use mappings
-LANDUSE_TYPES = {
-    100000: "سكني (Residential)",
-    200000: "تجاري (Commercial)", 
-    300000: "خدمات عامة (Public Services)",
-    400000: "مرافق عامة (Public Facilities)",
-    500000: "زراعي (Agricultural)",
-    600000: "صناعي (Industrial)",
-    700000: "ترفيهي (Recreational)",
-    800000: "طرق (Roads)",
-    900000: "مياه (Water)",
-    1000000: "سكني متعدد الوحدات (Apartments)",
-    5555: "غير محدد (Undefined)",
-    0: "فارغ (Empty)"
-}
-
-def build_url(params):
-    return f"{BASE_URL}?{MAP_SERVER}?{urlencode(params)}"
+from crawl_journal import CrawlJournal, JournalKindError
+from crawl_metrics import get_metrics, start_metrics
+from landuse_rules import APARTMENT
+from parcel_crawl import (
+    BATCH_SIZE, RangePlanner, count_batch, crawl_metadata, crawl_ranges, fetch_batch_ids,
+    fetch_until_ok, open_sinks, process_features, replay_journal
+)
+from parcel_crawl import fetch_batch as crawl_fetch_batch
+from parcel_manifest import ManifestPlanner, city_where, fetch_count, fetch_object_ids
+from parcel_refresh import (
+    RefreshPlanner, blocks_containing, count_changes, edit_date_field, edited_since_where, records_differ,
+    refresh_blocks
+)
+from parcel_shapes import ShapeWriter, compact
+from parcel_summary import print_summary
+from parcel_tiles import RIYADH_BBOX, TilePlanner, city_tiles, fetch_extent, fetch_tile, intersect, tile_label
+from rate_control import AdaptiveLimiter
+from response_cache import ResponseCache
+from umaps_client import FEATURE_FORMATS, configure_client
 
-def is_apartment(rec):
-    mainlanduse = rec.get("MAINLANDUSE")
-    subtype = rec.get("SUBTYPE")
-    units = rec.get("RESIDENTIALUNITS") or 0
-    floors = rec.get("NOOFFLOORS") or 0
-    
-    if mainlanduse == 1000000:
-        return True
-    if subtype in [102000, 1001000, 1002000, 1006000, 207000]:
-        return True
-    if units > 2:
-        return True
-    if mainlanduse == 100000 and floors >= 3 and units > 1:
-        return True
-    return False
+RIYADH_CITY_ID = "00100001"
+JOURNAL_DIR = "riyadh_parcels_journal"
+# Tile keys are not OIDs, so a tile crawl keeps its own journal
+TILE_JOURNAL_DIR = "riyadh_tiles_journal"
 
-def fetch_batch(min_oid, max_oid):
-    """Fetch parcels in ObjectID range"""
-    params = {
-        "where": f"CITY_ID = '{RIYADH_CITY_ID}' AND OBJECTID >= {min_oid} AND OBJECTID < {max_oid}",
-        "outFields": "OBJECTID,PARCEL_ID,PARCELNAME,MAINLANDUSE,SUBTYPE,DETAILSLANDUSE,RESIDENTIALUNITS,COMMERCIALUNITS,NOOFFLOORS,MEASUREDAREA,DISTRICT_ID,STREETNAME",
-        "returnGeometry": "true",
-        "resultRecordCount": str(BATCH_SIZE),
-        "f": "pjson"
-    }
-    
-    try:
-        response = requests.get(build_url(params), headers=HEADERS, timeout=120)
-        data = response.json()
-        if "error" in data:
-            return None
-        return data.get("features", [])
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+def fetch_batch(min_oid, max_oid, geometry=True, record_count=BATCH_SIZE):
+    """Fetch Riyadh parcels in an ObjectID range; see parcel_crawl.fetch_batch"""
+    return crawl_fetch_batch(RIYADH_CITY_ID, min_oid, max_oid, geometry, record_count)
 
-def process_feature(f):
-    attrs = f.get("attributes", {})
-    geom = f.get("geometry", {})
-    
-    lat, lon = None, None
-    if geom and "rings" in geom and geom["rings"]:
-        coords = geom["rings"][0]
-        if coords:
-            lon = sum(c[0] for c in coords) / len(coords)
-            lat = sum(c[1] for c in coords) / len(coords)
-    
-    apt = is_apartment(attrs)
-    
-    return {
-        "object_id": attrs.get("OBJECTID"),
-        "parcel_id": attrs.get("PARCEL_ID"),
-        "parcel_name": attrs.get("PARCELNAME"),
-        "mainlanduse": attrs.get("MAINLANDUSE"),
-        "mainlanduse_name": LANDUSE_TYPES.get(attrs.get("MAINLANDUSE"), "Unknown"),
-        "subtype": attrs.get("SUBTYPE"),
-        "is_apartment": apt,
-        "type": "شقق (Apartment)" if apt else "غير شقق (Non-Apartment)",
-        "residential_units": attrs.get("RESIDENTIALUNITS"),
-        "commercial_units": attrs.get("COMMERCIALUNITS"),
-        "floors": attrs.get("NOOFFLOORS"),
-        "area_sqm": attrs.get("MEASUREDAREA"),
-        "district_id": attrs.get("DISTRICT_ID"),
-        "street_name": attrs.get("STREETNAME"),
-        "latitude": lat,
-        "longitude": lon
-    }
+def fetch_block(min_oid, max_oid):
+    """
+    Re-fetch one refresh block. Manifest crawls journal blocks of exactly
+    BATCH_SIZE parcels, so one more is asked for: only a block that really
+    grew (or a server transfer limit) comes back truncated
+    """
+    return fetch_batch(min_oid, max_oid, record_count=BATCH_SIZE + 1)
 
-def main():
+def main(workers=1, rate=1.0, journal_dir=JOURNAL_DIR, restart=False, output="riyadh_all_parcels", plan="manifest",
+         keep_geometry=False, feature_format="pjson", cache=None, max_rate=None):
     print("=" * 60)
     print("RIYADH PARCEL SCRAPER - FULL DATASET")
     print("=" * 60)
@@ -114,103 +54,298 @@ def main():
     # ObjectID range for Riyadh
     MIN_OID = 32448872
     MAX_OID = 35134944
-    CHUNK_SIZE = 5000  # Query range size
+    CHUNK_SIZE = 5000  # Initial query range size, adapted as the crawl runs
     
     total_expected = 1239506
-    all_parcels = []
-    apartments = 0
+    
+    if plan == "tiles" and journal_dir == JOURNAL_DIR:
+        journal_dir = TILE_JOURNAL_DIR
+    if restart and os.path.isdir(journal_dir):
+        shutil.rmtree(journal_dir)
+    try:
+        journal = CrawlJournal(journal_dir, keys="tiles" if plan == "tiles" else "oid")
+    except JournalKindError as e:
+        print(f"Cannot resume with --plan {plan}: {e}")
+        return
+    resumed = journal.count
+    done = journal.completed()
+    limiter = AdaptiveLimiter(rate, max_rate=max_rate, max_concurrency=workers)
+    
+    # One keep-alive connection per worker
+    client = configure_client(pool_size=max(workers, 1), feature_format=feature_format, cache=cache)
+    client.warm_up()
+    
+    object_ids = None
+    if plan == "manifest":
+        where = city_where(RIYADH_CITY_ID)
+        print("Fetching OBJECTID manifest...")
+        object_ids = fetch_object_ids(where)
+        server_count = fetch_count(where)
+        if object_ids is None:
+            print("Could not fetch the OBJECTID manifest; retry later or use --plan ranges")
+            journal.close()
+            return
+        total_expected = len(object_ids)
+        print(f"Manifest: {len(object_ids):,} OBJECTIDs (server count: {server_count if server_count is not None else '?'})")
+        planner = ManifestPlanner(object_ids, fetch_batch_ids, completed=done, batch_size=BATCH_SIZE)
+        print(f"Batches: {-(-len(planner.ids) // BATCH_SIZE):,} x {BATCH_SIZE:,} OBJECTIDs")
+    elif plan == "tiles":
+        where = city_where(RIYADH_CITY_ID)
+        extent = fetch_extent(where)
+        if extent is not None and intersect(extent, RIYADH_BBOX) != tuple(extent):
+            print(f"Warning: the city extent {extent} reaches outside the tile root {RIYADH_BBOX}")
+        server_count = fetch_count(where)
+        if server_count is not None:
+            total_expected = server_count
+        planner = TilePlanner(city_tiles(), lambda bounds: fetch_tile(where, bounds), completed=done)
+        print(f"Tiling {RIYADH_BBOX} from {len(planner.tiles):,} tiles")
+    else:
+        planner = RangePlanner(MIN_OID, MAX_OID, CHUNK_SIZE, fetch_batch, completed=done)
+        print(f"Scanning ObjectID range: {MIN_OID:,} to {MAX_OID:,}")
     
     start_time = time.time()
-    current_oid = MIN_OID
     batch_num = 0
     
-    print(f"Scanning ObjectID range: {MIN_OID:,} to {MAX_OID:,}")
     print(f"Expected parcels: ~{total_expected:,}")
+    print(f"Workers: {workers} | Starting rate: {rate:g} req/s (adaptive)")
+    if done:
+        print(f"Resuming from {journal_dir}: {len(done):,} ranges, {resumed:,} parcels already on disk")
     print("-" * 60)
     
-    while current_oid < MAX_OID:
+    sink = open_sinks(output)
+    if resumed:
+        replay_journal(journal, sink)
+    
+    # Full polygons go to a compact side file; reopening it picks up where it stopped
+    shapes = None
+    if keep_geometry:
+        if restart:
+            for ext in (".geom", ".gidx"):
+                if os.path.exists(f"{output}_shapes{ext}"):
+                    os.remove(f"{output}_shapes{ext}")
+        shapes = ShapeWriter(f"{output}_shapes")
+    
+    metrics = get_metrics()
+    for (start_oid, end_oid), features in crawl_ranges(planner, workers, limiter):
         batch_num += 1
-        end_oid = min(current_oid + CHUNK_SIZE, MAX_OID)
-        
-        progress = len(all_parcels) / total_expected * 100
-        elapsed = time.time() - start_time
-        rate = len(all_parcels) / elapsed if elapsed > 0 else 0
-        eta = (total_expected - len(all_parcels)) / rate / 60 if rate > 0 else 0
-        
-        print(f"Batch {batch_num}: OID {current_oid:,}-{end_oid:,} | {len(all_parcels):,} parcels ({progress:.1f}%) | ETA: {eta:.1f}m")
-        
-        features = fetch_batch(current_oid, end_oid)
         
-        if features is None:
-            print("  Rate limited! Waiting 30s...")
-            time.sleep(30)
-            continue
+        parcels = process_features(features)
+        with metrics.stage("write"):
+            if shapes is not None:
+                shapes.write_batch(features)
+                shapes.flush()
+            journal.record_batch((start_oid, end_oid), parcels)
+            sink.write_batch(parcels)
+        count_batch(parcels, RIYADH_CITY_ID)
         
-        for f in features:
-            p = process_feature(f)
-            all_parcels.append(p)
-            if p["is_apartment"]:
-                apartments += 1
-        
-        current_oid = end_oid
-        time.sleep(1)  # Rate limiting
+        progress = journal.count / total_expected * 100
+        elapsed = time.time() - start_time
+        rate_now = (journal.count - resumed) / elapsed if elapsed > 0 else 0
+        eta = (total_expected - journal.count) / rate_now / 60 if rate_now > 0 else 0
         
-        # Save progress every 50k records
-        if len(all_parcels) % 50000 < len(features):
-            save_progress(all_parcels, apartments)
+        span = f"tile {tile_label((start_oid, end_oid))}" if plan == "tiles" else f"OID {start_oid:,}-{end_oid:,}"
+        print(f"Batch {batch_num}: {span} ({len(features):,}) | {journal.count:,} parcels ({progress:.1f}%) | ETA: {eta:.1f}m")
+    
+    total = journal.count
+    apartments = journal.apartments
     
     elapsed_total = time.time() - start_time
     print("=" * 60)
     print(f"COMPLETED in {elapsed_total/60:.1f} minutes")
-    print(f"Total parcels: {len(all_parcels):,}")
-    print(f"Apartments: {apartments:,} ({apartments/len(all_parcels)*100:.1f}%)")
-    print(f"Non-Apartments: {len(all_parcels)-apartments:,}")
+    print(f"Requests: {planner.requests:,} ({planner.splits:,} truncated ranges split)")
+    print(f"Final pacing: {limiter.summary()}")
+    if object_ids is not None:
+        status = "complete" if total == len(object_ids) else "INCOMPLETE"
+        print(f"Manifest check: {total:,} of {len(object_ids):,} OBJECTIDs on disk ({status})")
+        if planner.missing:
+            print(f"  {len(planner.missing):,} OBJECTIDs vanished since the manifest was taken")
+    if cache is not None:
+        print(f"Response cache: {cache.summary()}")
+    print(f"Total parcels: {total:,}")
+    print(f"Apartments: {apartments:,} ({apartments/max(total, 1)*100:.1f}%)")
+    print(f"Non-Apartments: {total-apartments:,}")
     
-    save_final(all_parcels, apartments)
+    sink.close(crawl_metadata(journal, "Riyadh"))
+    print_summary(sink.summary)
+    if shapes is not None:
+        shapes.close()
+    journal.close()
 
-def save_progress(parcels, apt_count):
-    with open("riyadh_parcels_progress.json", "w") as f:
-        json.dump({"count": len(parcels), "apartments": apt_count, "parcels": parcels[-1000:]}, f)
-    print(f"  [Saved progress: {len(parcels):,} parcels]")
+def refresh(journal_dir=JOURNAL_DIR, workers=1, rate=1.0, output="riyadh_all_parcels", keep_geometry=False,
+            feature_format="pjson", check_attributes=False, max_rate=None):
+    """
+    Bring an existing journal up to date: find the OID blocks that changed
+    since they were crawled (see parcel_refresh), re-fetch only those, patch
+    the journal in place and rewrite the exports from it.
+    """
+    print("=" * 60)
+    print("RIYADH PARCEL SCRAPER - DELTA REFRESH")
+    print("=" * 60)
+    
+    if not os.path.exists(os.path.join(journal_dir, "ledger.ndjson")):
+        print(f"No journal in {journal_dir}; run a full crawl first")
+        return
+    try:
+        journal = CrawlJournal(journal_dir)
+    except JournalKindError as e:
+        print(f"Cannot refresh: {e}; --refresh only works on OBJECTID journals")
+        return
+    before = journal.count
+    blocks = refresh_blocks(journal.ranges)
+    if not blocks:
+        print(f"No completed blocks in {journal_dir}; nothing to refresh")
+        journal.close()
+        return
+    limiter = AdaptiveLimiter(rate, max_rate=max_rate, max_concurrency=workers)
+    
+    # No response cache here: the checks must see the live layer
+    client = configure_client(pool_size=max(workers, 1), feature_format=feature_format)
+    client.warm_up()
+    city = city_where(RIYADH_CITY_ID)
+    start_time = time.time()
+    checks = 0
+    
+    def count_range(lo, hi):
+        nonlocal checks
+        checks += 1
+        where = f"{city} AND OBJECTID >= {lo} AND OBJECTID < {hi}"
+        return fetch_until_ok(lambda: fetch_count(where), limiter, "during count check")
+    
+    print(f"Checking {len(blocks):,} blocks ({before:,} parcels on disk)...")
+    changed = set(count_changes(blocks, count_range))
+    print(f"  Counts: {len(changed):,} blocks changed ({checks:,} requests)")
+    
+    field = edit_date_field(client.get_layer_info())
+    fetched = [entry.get("fetched_at") for _, _, entry in blocks]
+    if field and all(fetched):
+        checks += 1
+        where = edited_since_where(city, field, min(fetched))
+        edited = fetch_until_ok(lambda: fetch_object_ids(where), limiter, "during edit-date check")
+        flagged = set(blocks_containing(blocks, edited)) - changed
+        changed |= flagged
+        print(f"  Edit dates ({field}): {len(edited):,} parcels edited, {len(flagged):,} more blocks")
+    elif field:
+        print(f"  Edit dates ({field}): journal predates fetch timestamps, skipped")
+    else:
+        print("  Edit dates: layer has no editor tracking")
+    
+    if check_attributes:
+        unchanged = [i for i in range(len(blocks)) if i not in changed]
+        
+        def attributes_changed(i):
+            lo, hi, entry = blocks[i]
+            # Counts matched, so the block fits in one response even if it looks truncated
+            features, _ = fetch_until_ok(lambda: fetch_batch(lo, hi, geometry=False), limiter, f"at OID {lo:,}")
+            return records_differ(list(journal.iter_range(entry)), process_features(features))
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            flags = list(pool.map(attributes_changed, unchanged))
+        flagged = {i for i, flag in zip(unchanged, flags) if flag}
+        checks += len(unchanged)
+        changed |= flagged
+        print(f"  Attributes: {len(flagged):,} more blocks ({len(unchanged):,} requests)")
+    
+    if not changed:
+        print("Dataset is up to date")
+        journal.close()
+        return
+    
+    shapes = ShapeWriter(f"{output}_shapes") if keep_geometry else None
+    planner = RefreshPlanner([blocks[i] for i in sorted(changed)], fetch_block)
+    print(f"Re-fetching {len(changed):,} of {len(blocks):,} blocks...")
+    for oid_range, features in crawl_ranges(planner, workers, limiter):
+        parcels = process_features(features)
+        with get_metrics().stage("write"):
+            if shapes is not None:
+                shapes.write_batch(features)
+                shapes.flush()
+            journal.record_batch(oid_range, parcels, replaces=True)
+        count_batch(parcels, RIYADH_CITY_ID)
+    
+    print("=" * 60)
+    print(f"REFRESHED in {(time.time() - start_time)/60:.1f} minutes")
+    print(f"Requests: {checks:,} checks + {planner.requests:,} fetches ({planner.splits:,} truncated blocks split)")
+    print(f"Final pacing: {limiter.summary()}")
+    print(f"Parcels: {before:,} -> {journal.count:,}")
+    
+    sink = open_sinks(output)
+    replay_journal(journal, sink)
+    sink.close(crawl_metadata(journal, "Riyadh"))
+    if shapes is not None:
+        # Replaced blocks only appended: drop the polygons of parcels the journal no longer holds
+        shapes.close()
+        kept, dropped = compact(f"{output}_shapes", {p["object_id"] for p in journal.iter_parcels()})
+        print(f"Shapes: {kept:,} parcels kept, {dropped:,} no longer in the journal dropped")
+    journal.close()
 
-def save_final(parcels, apt_count):
-    # CSV
-    with open("riyadh_all_parcels.csv", "w", newline="", encoding="utf-8-sig") as f:
-        if parcels:
-            writer = csv.DictWriter(f, fieldnames=parcels[0].keys())
-            writer.writeheader()
-            writer.writerows(parcels)
-    print(f"Saved: riyadh_all_parcels.csv")
-    
-    # JSON
-    output = {
-        "metadata": {
-            "source": "UMAPS Balady",
-            "city": "Riyadh",
-            "scraped_at": datetime.now().isoformat(),
-            "total": len(parcels),
-            "apartments": apt_count,
-            "non_apartments": len(parcels) - apt_count
-        },
-        "parcels": parcels
-    }
-    with open("riyadh_all_parcels.json", "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False)
-    print(f"Saved: riyadh_all_parcels.json")
-    
-    # GeoJSON
-    features = []
-    for p in parcels:
-        if p["latitude"] and p["longitude"]:
-            features.append({
-                "type": "Feature",
-                "geometry": {"type": "Point", "coordinates": [p["longitude"], p["latitude"]]},
-                "properties": {k: v for k, v in p.items() if k not in ["latitude", "longitude"]}
-            })
-    
-    with open("riyadh_all_parcels_geo.json", "w", encoding="utf-8") as f:
-        json.dump({"type": "FeatureCollection", "features": features}, f, ensure_ascii=False)
-    print(f"Saved: riyadh_all_parcels_geo.json")
+def reclassify(journal_dir=JOURNAL_DIR, output="riyadh_all_parcels"):
+    """Rewrite the exports from the journal under the current land-use rules, without fetching"""
+    if not os.path.exists(os.path.join(journal_dir, "ledger.ndjson")):
+        print(f"No journal in {journal_dir}; run a full crawl first")
+        return
+    try:
+        journal = CrawlJournal(journal_dir, keys=None)
+    except JournalKindError as e:
+        print(f"Cannot reclassify: {e}")
+        return
+    print(f"Reclassifying {journal.count:,} parcels from {journal_dir}...")
+    
+    sink = open_sinks(output)
+    apartments = replay_journal(journal, sink, rules=APARTMENT)
+    print(f"Apartments: {journal.apartments:,} -> {apartments:,}")
+    sink.close(crawl_metadata(journal, "Riyadh", apartments))
+    print_summary(sink.summary)
+    journal.close()
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Scrape all Riyadh parcels from UMAPS Balady")
+    parser.add_argument("--workers", type=int, default=1, help="Number of OID ranges fetched concurrently")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Starting request rate shared by all workers (requests/sec, adapts; 0 = unpaced until throttled)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Ceiling for the adaptive request rate (0 = none)")
+    parser.add_argument("--journal", type=str, default=JOURNAL_DIR, help="Crawl journal directory (resumed if it exists)")
+    parser.add_argument("--restart", action="store_true", help="Discard the existing journal and crawl from scratch")
+    parser.add_argument("--output", type=str, default="riyadh_all_parcels", help="Output filename prefix")
+    parser.add_argument("--plan", choices=["manifest", "ranges", "tiles"], default="manifest",
+                        help="Crawl an exact OBJECTID manifest (returnIdsOnly), sweep the OID window, or tile the "
+                             f"city with a spatial quadtree (journaled in {TILE_JOURNAL_DIR}/)")
+    parser.add_argument("--keep-geometry", action="store_true",
+                        help="Also store full parcel polygons in <output>_shapes.geom (quantized, delta-encoded)")
+    parser.add_argument("--format", choices=FEATURE_FORMATS, default="pjson",
+                        help="Response format for feature queries (pbf is smaller and faster to decode; falls back to pjson)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Update an existing journal: re-fetch only the OID blocks that changed")
+    parser.add_argument("--check-attributes", action="store_true",
+                        help="With --refresh, also compare attributes (no geometry) of blocks whose counts match")
+    parser.add_argument("--reclassify", action="store_true",
+                        help="Rewrite the exports from the journal with the current land-use rules (no requests)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Directory for the on-disk response cache; re-runs replay cached batches")
+    parser.add_argument("--cache-ttl", type=float, default=24, help="Hours before a cached response expires")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Size bound of the response cache")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write crawl metrics snapshots here (.prom for Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between metrics snapshots")
+    args = parser.parse_args()
+    
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 ** 2)
+    
+    metrics = start_metrics(args.metrics, args.metrics_interval)
+    try:
+        if args.reclassify:
+            reclassify(journal_dir=args.journal, output=args.output)
+        elif args.refresh:
+            refresh(journal_dir=args.journal, workers=args.workers, rate=args.rate, output=args.output,
+                    keep_geometry=args.keep_geometry, feature_format=args.format,
+                    check_attributes=args.check_attributes, max_rate=args.max_rate)
+        else:
+            main(workers=args.workers, rate=args.rate, journal_dir=args.journal, restart=args.restart,
+                 output=args.output, plan=args.plan, keep_geometry=args.keep_geometry, feature_format=args.format,
+                 cache=cache, max_rate=args.max_rate)
+    finally:
+        if metrics is not None:
+            metrics.close()
@@ -4,175 +4,116 @@ UMAPS Balady Riyadh Parcel Scraper
 Scrapes all parcels from Riyadh and classifies them as apartment or not
 """
 
-import requests
-import json
 import time
-import csv
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from crawl_metrics import get_metrics, start_metrics
+from esri_json import decode_response
+from esri_pbf import PbfDecodeError, attribute_values
+from landuse_rules import APARTMENT, apartment_labels, landuse_name, subtype_name
+from parcel_manifest import chunk_ids, city_where, fetch_features_by_ids, fetch_object_ids
+from parcel_shapes import ShapeWriter
+from parcel_sinks import CsvSink, GeoJsonSink, JsonSink, MultiSink
+from parcel_summary import ParcelSummary, SummarySink, print_summary
+from parcel_table import ParcelTable
+from rate_control import configure_limiter, get_limiter
+from response_cache import ResponseCache
+from umaps_client import FEATURE_FORMATS, PROXY_QUERY_URL, build_url, configure_client, get_client
+
 # Configuration
-BASE_URL = "https://umaps.balady.gov.sa/newProxyUDP/proxy.ashx"
-MAP_SERVER = "https://umapsudp.momrah.gov.sa/server/rest/services/Umaps/Umaps_Identify_Satatistics/MapServer/28/query"
 RIYADH_CITY_ID = "00100001"
 BATCH_SIZE = 2000  # Max records per request
-HEADERS = {
-    "Referer": "https://umaps.balady.gov.sa/",
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-}
-
-# Land use code mappings (based on analysis)
-LANDUSE_TYPES = {
-    100000: "سكني (Residential)",
-    200000: "تجاري (Commercial)",
-    300000: "خدمات عامة (Public Services)",
-    400000: "مرافق عامة (Public Facilities)",
-    500000: "زراعي (Agricultural)",
-    600000: "صناعي (Industrial)",
-    700000: "ترفيهي (Recreational)",
-    800000: "طرق (Roads)",
-    900000: "مياه (Water)",
-    1000000: "سكني متعدد الوحدات (Multi-Unit Residential/Apartments)",
-    5555: "غير محدد (Undefined)",
-    0: "فارغ (Empty)"
-}
-
-SUBTYPE_TYPES = {
-    101000: "سكني فردي (Single Residential/Villa)",
-    102000: "سكني متعدد (Multi Residential)",
-    103000: "سكني مجمع (Residential Complex)",
-    1001000: "عمارة سكنية (Apartment Building)",
-    1002000: "مجمع سكني (Residential Complex)",
-    1006000: "سكني مختلط (Mixed Residential)",
-    201000: "تجاري عام (General Commercial)",
-    202000: "مركز تجاري (Shopping Center)",
-    203000: "سوق (Market)",
-    204000: "محلات (Shops)",
-    205000: "مكاتب (Offices)",
-    206000: "فندق (Hotel)",
-    207000: "مختلط تجاري سكني (Mixed Commercial/Residential)",
-    208000: "خدمات تجارية (Commercial Services)",
-    301000: "تعليمي (Educational)",
-    302000: "صحي (Healthcare)",
-    303000: "ديني (Religious)",
-    304000: "حكومي (Government)",
-    305000: "أمني (Security)",
-    306000: "حديقة عامة (Public Park)",
-    307000: "مقبرة (Cemetery)",
-    401000: "كهرباء (Electricity)",
-    402000: "مياه (Water)",
-    403000: "صرف صحي (Sewage)",
-    404000: "اتصالات (Telecommunications)",
-    405000: "نقل (Transportation)",
-    501000: "زراعي عام (General Agricultural)",
-    502000: "مزرعة (Farm)",
-    503000: "بستان (Orchard)",
-    504000: "حظيرة (Barn)",
-    506000: "مشتل (Nursery)",
-    507000: "أرض زراعية فارغة (Empty Agricultural Land)",
-    601000: "صناعي عام (General Industrial)",
-    602000: "مصنع (Factory)",
-    603000: "ورشة (Workshop)",
-    604000: "مستودع (Warehouse)",
-    605000: "منطقة صناعية (Industrial Zone)",
-    701000: "ترفيهي عام (General Recreational)",
-    801000: "شارع رئيسي (Main Street)",
-    802000: "شارع فرعي (Side Street)",
-    901000: "مسطح مائي (Water Body)",
-    904000: "قناة مياه (Water Channel)"
-}
-
-
-def is_apartment(record):
-    """
-    Classify if a parcel is an apartment based on multiple criteria
-    """
-    mainlanduse = record.get("MAINLANDUSE")
-    subtype = record.get("SUBTYPE")
-    detailslanduse = record.get("DETAILSLANDUSE")
-    residential_units = record.get("RESIDENTIALUNITS") or 0
-    floors = record.get("NOOFFLOORS") or 0
-    
-    # Direct apartment indicators
-    if mainlanduse == 1000000:  # Multi-unit residential
-        return True
-    
-    if subtype in [102000, 1001000, 1002000, 1006000]:  # Apartment-related subtypes
-        return True
-    
-    if subtype == 207000:  # Mixed commercial/residential (often apartments)
-        return True
-    
-    # Heuristic: Multiple residential units
-    if residential_units > 2:
-        return True
-    
-    # Heuristic: Multiple floors with residential use
-    if mainlanduse == 100000 and floors >= 3 and residential_units > 1:
-        return True
-    
-    return False
+PARCEL_FIELDS = [
+    "OBJECTID", "PARCEL_ID", "PARCELNAME", "MAINLANDUSE", "SUBTYPE",
+    "DETAILSLANDUSE", "RESIDENTIALUNITS", "COMMERCIALUNITS", "NOOFFLOORS",
+    "MEASUREDAREA", "DISTRICT_ID", "STREETNAME", "POSTALCODE",
+    "ISBUILT", "ISLICENSED", "BUILDINGSTATUS"
+]
 
 
 def get_parcel_type_name(record):
     """Get human-readable type name for a parcel"""
-    mainlanduse = record.get("MAINLANDUSE")
-    subtype = record.get("SUBTYPE")
-    
-    main_name = LANDUSE_TYPES.get(mainlanduse, f"Unknown ({mainlanduse})")
-    sub_name = SUBTYPE_TYPES.get(subtype, f"Unknown ({subtype})")
-    
-    return main_name, sub_name
-
-
-def build_url(query_params):
-    """Build the full proxy URL with query parameters"""
-    from urllib.parse import urlencode
-    query_string = urlencode(query_params)
-    return f"{BASE_URL}?{MAP_SERVER}?{query_string}"
+    return landuse_name(record.get("MAINLANDUSE")), subtype_name(record.get("SUBTYPE"))
 
 
 def get_session():
-    """Create a session with cookies from the main site"""
-    session = requests.Session()
-    session.headers.update(HEADERS)
-    
-    # Get cookies from the main site first
-    try:
-        session.get("https://umaps.balady.gov.sa/", timeout=30)
-    except:
-        pass
-    
-    return session
+    """Return the shared pooled session, with cookies from the main site"""
+    client = get_client()
+    client.warm_up()
+    return client.session
 
 
-def fetch_with_retry(url, session=None, max_retries=5, initial_delay=5):
-    """Fetch URL with exponential backoff retry"""
+def fetch_with_retry(url, session=None, max_retries=8, data=None, limiter=None, pbf=False):
+    """
+    Fetch URL under the shared adaptive limiter (POSTs `data` as a form if given).
+    403s and errors make the limiter back off before the next attempt. With
+    pbf=True an undecodable protobuf body is raised for the caller to fall
+    back on; otherwise it is retried like any other error.
+    """
     if session is None:
-        session = requests.Session()
-        session.headers.update(HEADERS)
+        session = get_client().session
+    if limiter is None:
+        limiter = get_limiter()
+    metrics = get_metrics()
     
     for attempt in range(max_retries):
+        with metrics.stage("wait"):
+            ticket = limiter.wait()
         try:
-            response = session.get(url, timeout=120)
-            data = response.json()
-            
-            # Check for permission error
-            if "error" in data and data["error"].get("code") == 403:
-                delay = initial_delay * (2 ** attempt)
-                print(f"    Rate limited. Waiting {delay}s before retry {attempt + 1}/{max_retries}...")
-                time.sleep(delay)
-                continue
-            
-            return data
+            if data is not None:
+                response = session.post(url, data=data, timeout=120)
+            else:
+                response = session.get(url, timeout=120)
+            result = decode_response(response)
+        except PbfDecodeError:
+            if pbf:
+                limiter.release(ticket)
+                raise
+            limiter.backoff(ticket, "PbfDecodeError")
+            print(f"    Undecodable response. Backing off ({limiter.summary()}), retry {attempt + 1}/{max_retries}...")
+            metrics.inc("crawl_retries_total", reason="PbfDecodeError")
+            continue
         except Exception as e:
-            delay = initial_delay * (2 ** attempt)
-            print(f"    Error: {e}. Waiting {delay}s before retry {attempt + 1}/{max_retries}...")
-            time.sleep(delay)
+            limiter.backoff(ticket, type(e).__name__)
+            print(f"    Error: {e}. Backing off ({limiter.summary()}), retry {attempt + 1}/{max_retries}...")
+            metrics.inc("crawl_retries_total", reason=type(e).__name__)
+            continue
+        
+        # Check for permission error
+        if "error" in result and result["error"].get("code") == 403:
+            limiter.backoff(ticket, "rate_limited")
+            print(f"    Rate limited. Backing off ({limiter.summary()}), retry {attempt + 1}/{max_retries}...")
+            metrics.inc("crawl_retries_total", reason="rate_limited")
+            continue
+        
+        if get_client().served_from_cache():
+            limiter.refund(ticket)
+        else:
+            limiter.success(ticket)
+        return result
     
     return None
 
 
+def fetch_features_with_retry(params, session=None, post=False):
+    """
+    Feature query in the shared client's format (pjson or pbf) with retry.
+    A pbf body that cannot be decoded switches the client to pjson.
+    """
+    client = get_client()
+    pbf = client.feature_format == "pbf"
+    params = dict(params, f=client.feature_format)
+    try:
+        with get_metrics().stage("fetch"):
+            if post:
+                return fetch_with_retry(PROXY_QUERY_URL, session, data=params, pbf=pbf)
+            return fetch_with_retry(build_url(params), session, pbf=pbf)
+    except PbfDecodeError:
+        client.fallback_to_json()
+        return fetch_features_with_retry(params, session, post)
+
+
 def fetch_parcel_count(session=None):
     """Get total number of parcels in Riyadh"""
     params = {
@@ -188,15 +129,25 @@ def fetch_parcel_count(session=None):
     return 0
 
 
+def fetch_parcel_ids(session=None):
+    """Get the sorted OBJECTID manifest for Riyadh (None on failure)"""
+    get = lambda params: fetch_with_retry(build_url(params), session)
+    return fetch_object_ids(city_where(RIYADH_CITY_ID), get=get)
+
+
+def fetch_parcels_by_ids(ids, fields=None, session=None):
+    """Fetch an exact batch of OBJECTIDs from the manifest"""
+    post = lambda params: fetch_features_with_retry(params, session, post=True)
+    data = fetch_features_by_ids(ids, ",".join(fields or PARCEL_FIELDS), post=post)
+    if data:
+        return data.get("features", [])
+    return []
+
+
 def fetch_parcels_batch(last_objectid=0, fields=None, session=None):
     """Fetch a batch of parcels using ObjectID-based pagination"""
     if fields is None:
-        fields = [
-            "OBJECTID", "PARCEL_ID", "PARCELNAME", "MAINLANDUSE", "SUBTYPE", 
-            "DETAILSLANDUSE", "RESIDENTIALUNITS", "COMMERCIALUNITS", "NOOFFLOORS",
-            "MEASUREDAREA", "DISTRICT_ID", "STREETNAME", "POSTALCODE",
-            "ISBUILT", "ISLICENSED", "BUILDINGSTATUS"
-        ]
+        fields = PARCEL_FIELDS
     
     # Use ObjectID-based pagination for better reliability
     where_clause = f"CITY_ID = '{RIYADH_CITY_ID}' AND OBJECTID > {last_objectid}"
@@ -206,66 +157,96 @@ def fetch_parcels_batch(last_objectid=0, fields=None, session=None):
         "outFields": ",".join(fields),
         "returnGeometry": "true",
         "resultRecordCount": str(BATCH_SIZE),
-        "orderByFields": "OBJECTID ASC",
-        "f": "pjson"
+        "orderByFields": "OBJECTID ASC"
     }
     
-    url = build_url(params)
-    
-    data = fetch_with_retry(url, session)
+    data = fetch_features_with_retry(params, session)
     if data:
         return data.get("features", [])
     return []
 
 
+# Output record layout: key -> table column, or a callable deriving it per batch
+PARCEL_LAYOUT = {
+    "object_id": "object_id",
+    "parcel_id": "parcel_id",
+    "parcel_name": "parcel_name",
+    "mainlanduse_code": "mainlanduse_code",
+    "mainlanduse_name": lambda t: t.columns["mainlanduse_code"].map_values(landuse_name),
+    "subtype_code": "subtype_code",
+    "subtype_name": lambda t: t.columns["subtype_code"].map_values(subtype_name),
+    "detailslanduse": "detailslanduse",
+    "is_apartment": "is_apartment",
+    "parcel_type": lambda t: apartment_labels(t.apartment),
+    "residential_units": "residential_units",
+    "commercial_units": "commercial_units",
+    "floors": "floors",
+    "area_sqm": "area_sqm",
+    "district_id": "district_id",
+    "street_name": "street_name",
+    "postal_code": "postal_code",
+    "is_built": "is_built",
+    "is_licensed": "is_licensed",
+    "building_status": "building_status",
+    "latitude": "latitude",
+    "longitude": "longitude"
+}
+
+
+def process_batch(features):
+    """Decode a whole response batch into a columnar ParcelTable"""
+    metrics = get_metrics()
+    with metrics.stage("process"):
+        return ParcelTable.from_features(features, metrics.timed("crawl_stage_seconds", APARTMENT, stage="classify"))
+
+
 def process_parcel(feature):
     """Process a single parcel feature"""
-    attrs = feature.get("attributes", {})
-    geometry = feature.get("geometry", {})
-    
-    # Extract centroid from polygon
-    lat, lon = None, None
-    if geometry and "rings" in geometry:
-        rings = geometry["rings"]
-        if rings and rings[0]:
-            coords = rings[0]
-            lon = sum(c[0] for c in coords) / len(coords)
-            lat = sum(c[1] for c in coords) / len(coords)
-    
-    is_apt = is_apartment(attrs)
-    main_type, sub_type = get_parcel_type_name(attrs)
-    
-    return {
-        "object_id": attrs.get("OBJECTID"),
-        "parcel_id": attrs.get("PARCEL_ID"),
-        "parcel_name": attrs.get("PARCELNAME"),
-        "mainlanduse_code": attrs.get("MAINLANDUSE"),
-        "mainlanduse_name": main_type,
-        "subtype_code": attrs.get("SUBTYPE"),
-        "subtype_name": sub_type,
-        "detailslanduse": attrs.get("DETAILSLANDUSE"),
-        "is_apartment": is_apt,
-        "parcel_type": "شقق (Apartment)" if is_apt else "غير شقق (Non-Apartment)",
-        "residential_units": attrs.get("RESIDENTIALUNITS"),
-        "commercial_units": attrs.get("COMMERCIALUNITS"),
-        "floors": attrs.get("NOOFFLOORS"),
-        "area_sqm": attrs.get("MEASUREDAREA"),
-        "district_id": attrs.get("DISTRICT_ID"),
-        "street_name": attrs.get("STREETNAME"),
-        "postal_code": attrs.get("POSTALCODE"),
-        "is_built": attrs.get("ISBUILT"),
-        "is_licensed": attrs.get("ISLICENSED"),
-        "building_status": attrs.get("BUILDINGSTATUS"),
-        "latitude": lat,
-        "longitude": lon
-    }
+    return process_batch([feature]).records(PARCEL_LAYOUT)[0]
+
+
+def record_batches(parcels):
+    """Export batches from a ParcelTable (or an already-built list of records)"""
+    if isinstance(parcels, ParcelTable):
+        return parcels.iter_batches(PARCEL_LAYOUT, BATCH_SIZE)
+    return [parcels]
+
+
+def iter_paged_batches(session):
+    """Serial pagination: each request asks for OBJECTID > last seen"""
+    last_objectid = 0
+    while True:
+        features = fetch_parcels_batch(last_objectid, session=session)
+        if not features:
+            print(f"  No more features after OBJECTID {last_objectid}")
+            return
+        
+        yield features
+        
+        for obj_id in attribute_values(features, "OBJECTID"):
+            if obj_id and obj_id > last_objectid:
+                last_objectid = obj_id
+        
+        # If we got fewer than BATCH_SIZE, we're done
+        if len(features) < BATCH_SIZE:
+            return
 
 
-def scrape_riyadh_parcels(max_records=None):
+def iter_manifest_batches(object_ids, session):
+    """Exact batches from the OBJECTID manifest; no empty or partial requests"""
+    for ids in chunk_ids(object_ids, BATCH_SIZE):
+        yield fetch_parcels_by_ids(ids, session=session)
+
+
+def scrape_riyadh_parcels(max_records=None, sink=None, use_manifest=False, shapes=None):
     """
     Main scraping function
     Args:
         max_records: Limit number of records (None for all)
+        sink: Optional parcel sink (see parcel_sinks) fed each batch as it arrives
+        use_manifest: Plan batches from a returnIdsOnly manifest instead of paging
+        shapes: Optional parcel_shapes.ShapeWriter that keeps the full polygons
+    Returns the run's parcel_summary.ParcelSummary (the sink's own when it has one)
     """
     print("=" * 60)
     print("UMAPS Balady - Riyadh Parcel Scraper")
@@ -280,13 +261,28 @@ def scrape_riyadh_parcels(max_records=None):
     total_count = fetch_parcel_count(session)
     print(f"Total parcels in Riyadh: {total_count:,}")
     
+    object_ids = None
+    if use_manifest:
+        print("Fetching OBJECTID manifest...")
+        object_ids = fetch_parcel_ids(session)
+        if object_ids is None:
+            print("Could not fetch the OBJECTID manifest")
+            return ParcelSummary()
+        print(f"Manifest: {len(object_ids):,} OBJECTIDs")
+        if max_records:
+            object_ids = object_ids[:max_records]
+        total_count = len(object_ids)
+    
     if max_records:
         total_count = min(total_count, max_records)
         print(f"Limiting to {total_count:,} records")
     
-    all_parcels = []
-    apartment_count = 0
-    non_apartment_count = 0
+    # Statistics are aggregated batch by batch; a summarizing sink already does it
+    summary = getattr(sink, "summary", None)
+    own_summary = summary is None
+    if own_summary:
+        summary = ParcelSummary()
+    scraped = 0
     
     # Calculate batches
     num_batches = (total_count + BATCH_SIZE - 1) // BATCH_SIZE
@@ -294,199 +290,123 @@ def scrape_riyadh_parcels(max_records=None):
     print("-" * 60)
     
     start_time = time.time()
-    last_objectid = 0
     batch_num = 0
+    metrics = get_metrics()
     
-    while True:
+    if object_ids is not None:
+        batches = iter_manifest_batches(object_ids, session)
+    else:
+        batches = iter_paged_batches(session)
+    
+    for features in batches:
         batch_num += 1
         
-        # Progress update
-        progress = (len(all_parcels) / total_count) * 100
-        elapsed = time.time() - start_time
-        if len(all_parcels) > 0:
-            eta = (elapsed / len(all_parcels)) * (total_count - len(all_parcels))
-            eta_str = f", ETA: {eta/60:.1f} min"
-        else:
-            eta_str = ""
-        
-        print(f"Batch {batch_num} (after OBJECTID {last_objectid:,}) - {progress:.1f}% complete{eta_str}")
+        # Decode the whole batch into columns
+        table = process_batch(features)
         
-        # Fetch batch
-        features = fetch_parcels_batch(last_objectid, session=session)
+        if max_records:
+            table = table.rows(0, max_records - scraped)
         
-        if not features:
-            print(f"  No more features after OBJECTID {last_objectid}")
-            break
+        with metrics.stage("write"):
+            records = table.records(PARCEL_LAYOUT)
+            if shapes is not None:
+                shapes.write_batch(features[:len(table)])
+            if sink is not None:
+                sink.write_batch(records)
+            if own_summary:
+                summary.update(records)
         
-        # Process each feature
-        for feature in features:
-            parcel = process_parcel(feature)
-            all_parcels.append(parcel)
-            
-            if parcel["is_apartment"]:
-                apartment_count += 1
-            else:
-                non_apartment_count += 1
-            
-            # Update last_objectid for next batch
-            obj_id = feature.get("attributes", {}).get("OBJECTID", 0)
-            if obj_id > last_objectid:
-                last_objectid = obj_id
+        scraped += len(table)
+        metrics.inc("crawl_batches_total", city=RIYADH_CITY_ID)
+        metrics.inc("crawl_records_total", len(table), city=RIYADH_CITY_ID)
         
-        print(f"  Fetched {len(features)} parcels (Total: {len(all_parcels):,})")
-        
-        # Rate limiting - be respectful to avoid blocks
-        time.sleep(2)
+        # Progress update
+        progress = (scraped / max(total_count, 1)) * 100
+        elapsed = time.time() - start_time
+        eta = (elapsed / scraped) * (total_count - scraped) if scraped else 0
+        print(f"Batch {batch_num}: fetched {len(features)} parcels (Total: {scraped:,}) - {progress:.1f}% complete, ETA: {eta/60:.1f} min")
         
         # Check if we've reached the limit
-        if max_records and len(all_parcels) >= max_records:
-            all_parcels = all_parcels[:max_records]
-            break
-        
-        # If we got fewer than BATCH_SIZE, we're done
-        if len(features) < BATCH_SIZE:
+        if max_records and scraped >= max_records:
             break
     
+    apartment_count = summary.apartments
+    non_apartment_count = scraped - apartment_count
     elapsed_total = time.time() - start_time
     print("-" * 60)
     print(f"\nScraping completed in {elapsed_total/60:.1f} minutes")
-    print(f"Total parcels scraped: {len(all_parcels):,}")
-    print(f"  - Apartments: {apartment_count:,} ({apartment_count/len(all_parcels)*100:.1f}%)")
-    print(f"  - Non-Apartments: {non_apartment_count:,} ({non_apartment_count/len(all_parcels)*100:.1f}%)")
-    
-    return all_parcels
+    print(f"Total parcels scraped: {scraped:,}")
+    print(f"Final pacing: {get_limiter().summary()}")
+    if object_ids is not None:
+        print(f"  - Manifest coverage: {scraped:,} of {len(object_ids):,} OBJECTIDs")
+    if scraped:
+        print(f"  - Apartments: {apartment_count:,} ({apartment_count/scraped*100:.1f}%)")
+        print(f"  - Non-Apartments: {non_apartment_count:,} ({non_apartment_count/scraped*100:.1f}%)")
+    
+    return summary
+
+
+# GeoJSON keeps a compact property set for mapping
+GEOJSON_PROPERTIES = {
+    "parcel_id": "parcel_id",
+    "parcel_name": "parcel_name",
+    "is_apartment": "is_apartment",
+    "parcel_type": "parcel_type",
+    "mainlanduse": "mainlanduse_name",
+    "subtype": "subtype_name",
+    "residential_units": "residential_units",
+    "floors": "floors",
+    "area_sqm": "area_sqm",
+    "street_name": "street_name"
+}
+
+
+def json_metadata():
+    """Metadata block for the JSON export; totals are filled in by the sink"""
+    return {
+        "source": "UMAPS Balady (umaps.balady.gov.sa)",
+        "city": "Riyadh",
+        "city_id": RIYADH_CITY_ID,
+        "scraped_at": datetime.now().isoformat()
+    }
+
+
+def open_sinks(prefix="riyadh_parcels"):
+    """CSV, JSON and GeoJSON exports, written batch by batch during the crawl"""
+    return MultiSink([
+        CsvSink(f"{prefix}.csv"),
+        JsonSink(f"{prefix}.json"),
+        GeoJsonSink(f"{prefix}_geo.json", properties=GEOJSON_PROPERTIES),
+        SummarySink(f"{prefix}_summary.json")
+    ])
 
 
 def save_to_csv(parcels, filename="riyadh_parcels.csv"):
-    """Save parcels to CSV file"""
-    if not parcels:
+    """Save parcels (ParcelTable or list of records) to CSV file"""
+    if not len(parcels):
         print("No parcels to save")
         return
     
-    fieldnames = list(parcels[0].keys())
-    
-    with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(parcels)
-    
-    print(f"Saved {len(parcels):,} parcels to {filename}")
+    sink = CsvSink(filename)
+    for batch in record_batches(parcels):
+        sink.write_batch(batch)
+    sink.close()
 
 
 def save_to_json(parcels, filename="riyadh_parcels.json"):
-    """Save parcels to JSON file"""
-    output = {
-        "metadata": {
-            "source": "UMAPS Balady (umaps.balady.gov.sa)",
-            "city": "Riyadh",
-            "city_id": RIYADH_CITY_ID,
-            "scraped_at": datetime.now().isoformat(),
-            "total_parcels": len(parcels),
-            "apartments": sum(1 for p in parcels if p["is_apartment"]),
-            "non_apartments": sum(1 for p in parcels if not p["is_apartment"])
-        },
-        "parcels": parcels
-    }
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-    
-    print(f"Saved {len(parcels):,} parcels to {filename}")
+    """Save parcels (ParcelTable or list of records) to JSON file"""
+    sink = JsonSink(filename)
+    for batch in record_batches(parcels):
+        sink.write_batch(batch)
+    sink.close(json_metadata())
 
 
 def save_to_geojson(parcels, filename="riyadh_parcels_geo.json"):
-    """Save parcels to GeoJSON for mapping"""
-    features = []
-    for p in parcels:
-        if p["latitude"] and p["longitude"]:
-            feature = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [p["longitude"], p["latitude"]]
-                },
-                "properties": {
-                    "parcel_id": p["parcel_id"],
-                    "parcel_name": p["parcel_name"],
-                    "is_apartment": p["is_apartment"],
-                    "parcel_type": p["parcel_type"],
-                    "mainlanduse": p["mainlanduse_name"],
-                    "subtype": p["subtype_name"],
-                    "residential_units": p["residential_units"],
-                    "floors": p["floors"],
-                    "area_sqm": p["area_sqm"],
-                    "street_name": p["street_name"]
-                }
-            }
-            features.append(feature)
-    
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, ensure_ascii=False)
-    
-    print(f"Saved {len(features):,} parcels to {filename}")
-
-
-def generate_summary(parcels):
-    """Generate summary statistics"""
-    print("\n" + "=" * 60)
-    print("SUMMARY STATISTICS")
-    print("=" * 60)
-    
-    # By main land use
-    landuse_counts = {}
-    for p in parcels:
-        key = p["mainlanduse_name"]
-        landuse_counts[key] = landuse_counts.get(key, 0) + 1
-    
-    print("\nBy Main Land Use:")
-    for landuse, count in sorted(landuse_counts.items(), key=lambda x: -x[1]):
-        pct = count / len(parcels) * 100
-        print(f"  {landuse}: {count:,} ({pct:.1f}%)")
-    
-    # By subtype
-    subtype_counts = {}
-    for p in parcels:
-        key = p["subtype_name"]
-        subtype_counts[key] = subtype_counts.get(key, 0) + 1
-    
-    print("\nTop 15 Subtypes:")
-    for i, (subtype, count) in enumerate(sorted(subtype_counts.items(), key=lambda x: -x[1])[:15]):
-        pct = count / len(parcels) * 100
-        print(f"  {i+1}. {subtype}: {count:,} ({pct:.1f}%)")
-    
-    # Apartment vs Non-Apartment
-    apt_count = sum(1 for p in parcels if p["is_apartment"])
-    non_apt_count = len(parcels) - apt_count
-    
-    print(f"\nApartment Classification:")
-    print(f"  Apartments: {apt_count:,} ({apt_count/len(parcels)*100:.1f}%)")
-    print(f"  Non-Apartments: {non_apt_count:,} ({non_apt_count/len(parcels)*100:.1f}%)")
-    
-    # Apartments by residential units
-    apt_by_units = {}
-    for p in parcels:
-        if p["is_apartment"] and p["residential_units"]:
-            units = p["residential_units"]
-            if units <= 5:
-                key = "2-5 units"
-            elif units <= 10:
-                key = "6-10 units"
-            elif units <= 20:
-                key = "11-20 units"
-            else:
-                key = "20+ units"
-            apt_by_units[key] = apt_by_units.get(key, 0) + 1
-    
-    if apt_by_units:
-        print("\nApartments by Unit Count:")
-        for key in ["2-5 units", "6-10 units", "11-20 units", "20+ units"]:
-            if key in apt_by_units:
-                print(f"  {key}: {apt_by_units[key]:,}")
+    """Save parcels (ParcelTable or list of records) to GeoJSON for mapping"""
+    sink = GeoJsonSink(filename, properties=GEOJSON_PROPERTIES)
+    for batch in record_batches(parcels):
+        sink.write_batch(batch)
+    sink.close()
 
 
 if __name__ == "__main__":
@@ -495,16 +415,44 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Scrape Riyadh parcels from UMAPS Balady")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of records")
     parser.add_argument("--output", type=str, default="riyadh_parcels", help="Output filename prefix")
+    parser.add_argument("--rate", type=float, default=0.5,
+                        help="Starting request rate (requests/sec, adapts to the server; 0 = unpaced until throttled)")
+    parser.add_argument("--max-rate", type=float, default=0, help="Ceiling for the adaptive request rate (0 = none)")
+    parser.add_argument("--manifest", action="store_true", help="Plan exact batches from a returnIdsOnly OBJECTID manifest")
+    parser.add_argument("--keep-geometry", action="store_true",
+                        help="Also store full parcel polygons in <output>_shapes.geom (quantized, delta-encoded)")
+    parser.add_argument("--format", choices=FEATURE_FORMATS, default="pjson",
+                        help="Response format for feature queries (pbf is smaller and faster to decode; falls back to pjson)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Directory for the on-disk response cache; re-runs replay cached batches")
+    parser.add_argument("--cache-ttl", type=float, default=24, help="Hours before a cached response expires")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="Size bound of the response cache")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write crawl metrics snapshots here (.prom for Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-interval", type=float, default=30, help="Seconds between metrics snapshots")
     args = parser.parse_args()
     
-    # Run scraper
-    parcels = scrape_riyadh_parcels(max_records=args.limit)
+    cache = None
+    if args.cache:
+        cache = ResponseCache(args.cache, ttl=args.cache_ttl * 3600, max_bytes=args.cache_max_mb * 1024 ** 2)
+    configure_client(feature_format=args.format, cache=cache)
+    configure_limiter(rate=args.rate, max_rate=args.max_rate)
+    metrics = start_metrics(args.metrics, args.metrics_interval)
     
-    if parcels:
-        # Save outputs
-        save_to_csv(parcels, f"{args.output}.csv")
-        save_to_json(parcels, f"{args.output}.json")
-        save_to_geojson(parcels, f"{args.output}_geo.json")
-        
-        # Generate summary
-        generate_summary(parcels)
+    # Run scraper, writing outputs as batches arrive
+    sink = open_sinks(args.output)
+    shapes = ShapeWriter(f"{args.output}_shapes") if args.keep_geometry else None
+    try:
+        summary = scrape_riyadh_parcels(max_records=args.limit, sink=sink, use_manifest=args.manifest, shapes=shapes)
+    finally:
+        sink.close(json_metadata())
+        if shapes is not None:
+            shapes.close()
+        if metrics is not None:
+            metrics.close()
+    
+    if cache is not None:
+        print(f"Response cache: {cache.summary()}")
+    
+    if summary.total:
+        print_summary(summary)
@@ -0,0 +1,76 @@
+"""CrawlJournal replacement ranges, as a refresh records them, and the key kind of its ledger entries"""
+
+import json
+import os
+
+import pytest
+
+from crawl_journal import CrawlJournal, JournalKindError
+
+
+def parcels(object_ids, tag="old"):
+    return [{"object_id": oid, "is_apartment": oid % 3 == 0, "tag": tag} for oid in object_ids]
+
+
+def live(journal):
+    return {p["object_id"]: p["tag"] for p in journal.iter_parcels()}
+
+
+def test_crash_between_halves_keeps_the_unrefetched_half(tmp_path):
+    directory = str(tmp_path / "journal")
+    with CrawlJournal(directory) as journal:
+        journal.record_batch((0, 100), parcels(range(0, 100, 10)))
+        journal.record_batch((100, 200), parcels(range(100, 200, 10)))
+        # A refresh bisects the changed block and stops after its first half
+        journal.record_batch((0, 50), parcels([5, 15], "new"), replaces=True)
+
+    with CrawlJournal(directory) as journal:
+        expected = {5: "new", 15: "new", **{oid: "old" for oid in range(50, 200, 10)}}
+        assert live(journal) == expected
+        assert journal.count == len(expected)
+        assert journal.apartments == sum(1 for oid in expected if oid % 3 == 0)
+        assert sorted(journal.completed()) == [(0, 50), (50, 100), (100, 200)]
+
+        journal.record_batch((50, 100), parcels([55], "new"), replaces=True)
+        assert live(journal) == {5: "new", 15: "new", 55: "new", **{oid: "old" for oid in range(100, 200, 10)}}
+        assert journal.count == 13
+
+    with CrawlJournal(directory) as journal:
+        assert journal.count == 13
+        assert sorted(journal.completed()) == [(0, 50), (50, 100), (100, 200)]
+
+
+def test_replacement_inside_a_range_keeps_both_ends(tmp_path):
+    with CrawlJournal(str(tmp_path / "journal")) as journal:
+        journal.record_batch((0, 100), parcels(range(0, 100, 10)))
+        journal.record_batch((40, 60), parcels([45], "new"), replaces=True)
+        assert live(journal) == {0: "old", 10: "old", 20: "old", 30: "old", 45: "new",
+                                 60: "old", 70: "old", 80: "old", 90: "old"}
+        assert journal.count == 9
+
+
+def test_ledger_entries_name_their_keys(tmp_path):
+    directory = str(tmp_path / "journal")
+    with CrawlJournal(directory, keys="tiles") as journal:
+        journal.record_batch((0, 4), parcels([1]))
+    with pytest.raises(JournalKindError):
+        CrawlJournal(directory)
+    with CrawlJournal(directory, keys=None) as journal:
+        assert journal.count == 1
+        with pytest.raises(JournalKindError):
+            journal.record_batch((4, 8), parcels([5]))
+
+
+def test_entry_without_keys_is_an_error(tmp_path):
+    directory = str(tmp_path / "journal")
+    with CrawlJournal(directory) as journal:
+        journal.record_batch((0, 100), parcels([1]))
+    ledger = os.path.join(directory, "ledger.ndjson")
+    with open(ledger) as f:
+        entry = json.loads(f.read())
+    del entry["keys"]
+    with open(ledger, "w") as f:
+        f.write(json.dumps(entry) + "\n")
+    for keys in ("oid", None):
+        with pytest.raises(JournalKindError):
+            CrawlJournal(directory, keys=keys)
@@ -0,0 +1,74 @@
+"""f=pbf decoding checked against the pjson body of the same recorded query"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from esri_pbf import FeatureBatch, attribute_values, decode_feature_collection
+from parcel_crawl import process_features
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@pytest.fixture
+def responses():
+    with open(os.path.join(FIXTURES, "parcel_query.pbf"), "rb") as f:
+        pbf = decode_feature_collection(f.read())
+    with open(os.path.join(FIXTURES, "parcel_query.json"), encoding="utf-8") as f:
+        pjson = json.load(f)
+    return pbf, pjson
+
+
+def test_result_metadata(responses):
+    pbf, pjson = responses
+    assert isinstance(pbf["features"], FeatureBatch)
+    assert len(pbf["features"]) == len(pjson["features"])
+    assert pbf["exceededTransferLimit"] is True
+    assert pbf["objectIdFieldName"] == "OBJECTID"
+    assert [f["name"] for f in pbf["fields"]] == [f["name"] for f in pjson["fields"]]
+
+
+def test_attributes_match_pjson(responses):
+    pbf, pjson = responses
+    assert pbf["features"].attribute_rows() == [f["attributes"] for f in pjson["features"]]
+    assert attribute_values(pbf["features"], "OBJECTID") == attribute_values(pjson["features"], "OBJECTID")
+
+
+def test_rings_match_pjson(responses):
+    pbf, pjson = responses
+    for decoded, expected in zip(pbf["features"], pjson["features"]):
+        rings = decoded["geometry"]["rings"]
+        assert [len(ring) for ring in rings] == [len(ring) for ring in expected["geometry"]["rings"]]
+        for ring, expected_ring in zip(rings, expected["geometry"]["rings"]):
+            np.testing.assert_allclose(ring, expected_ring, atol=1e-8)
+
+
+def test_slice_and_take_keep_rings_with_their_features(responses):
+    pbf, pjson = responses
+    batch = pbf["features"]
+    for part, rows in ((batch[1:], [1, 2]), (batch.take([0, 2]), [0, 2])):
+        assert attribute_values(part, "OBJECTID") == [pjson["features"][i]["attributes"]["OBJECTID"] for i in rows]
+        for decoded, i in zip(part, rows):
+            np.testing.assert_allclose(decoded["geometry"]["rings"][0], pjson["features"][i]["geometry"]["rings"][0],
+                                       atol=1e-8)
+
+
+def test_records_match_pjson(responses):
+    pbf, pjson = responses
+    records = process_features(pbf["features"])
+    expected = process_features(pjson["features"])
+    for record, wanted in zip(records, expected):
+        assert {k: v for k, v in record.items() if k not in ("latitude", "longitude")} == \
+               {k: v for k, v in wanted.items() if k not in ("latitude", "longitude")}
+        assert record["latitude"] == pytest.approx(wanted["latitude"], abs=1e-8)
+        assert record["longitude"] == pytest.approx(wanted["longitude"], abs=1e-8)
+    assert len(records) == len(expected)
+
+
+def test_count_and_id_results():
+    # FeatureCollectionPBuffer with a CountResult (count=2000) and an ObjectIdsResult (OBJECTID: 7, 300)
+    assert decode_feature_collection(bytes.fromhex("0a03332e301205120308d00f")) == {"count": 2000}
+    ids = decode_feature_collection(bytes.fromhex("0a03332e3012111a0f0a084f424a45435449441a0307ac02"))
+    assert ids == {"objectIdFieldName": "OBJECTID", "objectIds": [7, 300]}
@@ -0,0 +1,72 @@
+"""Undecodable pjson bodies are retried under the limiter, not raised or sent back as pbf"""
+
+import pytest
+
+import scrape_riyadh_parcels as scraper
+from esri_json import decode_body
+from rate_control import configure_limiter
+from umaps_client import configure_client
+
+COUNT = b'{"count": 42}'
+FEATURES = b'{"fields": [{"name": "OBJECTID"}], "features": [{"attributes": {"OBJECTID": 7}}]}'
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+
+class Session:
+    """Replays canned bodies, repeating the last one"""
+
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.calls = 0
+
+    def send(self):
+        body = self.bodies[min(self.calls, len(self.bodies) - 1)]
+        self.calls += 1
+        return Response(body)
+
+    def get(self, url, timeout=None):
+        return self.send()
+
+    def post(self, url, data=None, timeout=None):
+        return self.send()
+
+
+@pytest.fixture(autouse=True)
+def client():
+    configure_limiter(rate=1000.0, min_rate=1000.0)
+    client = configure_client(feature_format="pjson")
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize("body", [b"<html>busy</html>", b"", b"\r\n"])
+def test_count_query_retries_bad_body(body):
+    session = Session(body, COUNT)
+    assert scraper.fetch_parcel_count(session) == 42
+    assert session.calls == 2
+
+
+@pytest.mark.parametrize("body", [b"<html>busy</html>", b""])
+def test_feature_query_retries_bad_body(client, body):
+    session = Session(body, FEATURES)
+    data = scraper.fetch_features_with_retry({"where": "1=1"}, session, post=True)
+    assert data["features"].attribute_rows() == [{"OBJECTID": 7}]
+    assert session.calls == 2
+    assert client.feature_format == "pjson"
+
+
+def test_feature_query_gives_up_after_max_retries():
+    session = Session(b"<html>busy</html>")
+    assert scraper.fetch_features_with_retry({"where": "1=1"}, session) is None
+    assert session.calls == 8
+
+
+def test_decode_body_sniffs_past_whitespace():
+    assert decode_body(b"\n  " + COUNT) == {"count": 42}
+    for body in (b"<html>busy</html>", b"", b" \n"):
+        with pytest.raises(ValueError):
+            decode_body(body)
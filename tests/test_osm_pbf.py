@@ -0,0 +1,129 @@
+"""read_elements on small generated extracts: hand-checked centers, and the same elements as the Overpass path"""
+
+import json
+
+import pytest
+
+from osm_overpass import union_query
+from osm_pbf import read_elements, replication_timestamp
+from overpass_standin import (RIYADH_AREA, ElementStore, StringTable, osm_blob, primitive_block, run_query,
+                              write_osm_pbf)
+from pbf_wire import bytes_field, pack_deltas, pack_varints, varint_field
+
+FILTERS = [("amenity", ["cafe", "restaurant"]), ("building", None), ("shop", None)]
+
+# id -> (lat, lon, tags)
+NODES = {
+    1: (24.70, 46.70, {"amenity": "cafe", "name": "قهوة"}),
+    2: (24.71, 46.71, {"amenity": "bench"}),    # value not asked for
+    3: (26.00, 46.70, {"shop": "bakery"}),      # outside the bbox
+    4: (24.95, 46.52, None),                    # relation member node
+    10: (24.80, 46.60, None), 11: (24.80, 46.62, None), 12: (24.81, 46.62, None), 13: (24.81, 46.60, None),
+    20: (24.90, 46.50, None), 21: (24.92, 46.50, None), 22: (24.92, 46.53, None),
+}
+WAYS = [
+    (100, {"building": "yes"}, [10, 11, 12, 13, 10]),
+    (101, {"highway": "residential"}, [10, 11]),
+    (102, {"building": "yes"}, [3, 3]),          # matches, but no node near the bbox
+    (300, {}, [20, 21, 22, 20]),                # untagged outer way of relation 400
+]
+RELATIONS = [(400, {"building": "yes", "type": "multipolygon"}, [(300, 1), (4, 0)])]
+
+
+def write_extract(path):
+    """OSMHeader, then one DenseNodes block and one block of ways and relations"""
+    header = bytes_field(4, b"OsmSchema-V0.6") + bytes_field(4, b"DenseNodes") + varint_field(32, 1704067200)
+
+    strings = StringTable()
+    ids = sorted(NODES)
+    keys_vals = []
+    for node_id in ids:
+        for key, value in (NODES[node_id][2] or {}).items():
+            keys_vals += [strings(key), strings(value)]
+        keys_vals.append(0)
+    dense = (bytes_field(1, pack_deltas(ids))
+             + bytes_field(8, pack_deltas([round(NODES[i][0] * 1e7) for i in ids]))
+             + bytes_field(9, pack_deltas([round(NODES[i][1] * 1e7) for i in ids]))
+             + bytes_field(10, pack_varints(keys_vals)))
+    nodes = primitive_block(strings, bytes_field(2, dense))
+
+    strings = StringTable()
+    group = []
+    for way_id, tags, refs in WAYS:
+        group.append(bytes_field(3, varint_field(1, way_id) + strings.tags(tags) + bytes_field(8, pack_deltas(refs))))
+    for relation_id, tags, members in RELATIONS:
+        group.append(bytes_field(4, varint_field(1, relation_id) + strings.tags(tags)
+                                 + bytes_field(8, pack_varints([strings("outer")] * len(members)))
+                                 + bytes_field(9, pack_deltas([ref for ref, _ in members]))
+                                 + bytes_field(10, pack_varints([member_type for _, member_type in members]))))
+    ways = primitive_block(strings, b"".join(group))
+
+    with open(path, "wb") as f:
+        f.write(osm_blob("OSMHeader", header) + nodes + ways)
+
+
+def collect(path, filters, bbox):
+    stages = {}
+    for stage, elements, _ in read_elements(path, filters, bbox, processes=1):
+        stages.setdefault(stage, []).extend(elements)
+    return stages
+
+
+def test_hand_built_extract(tmp_path):
+    path = str(tmp_path / "tiny.osm.pbf")
+    write_extract(path)
+    assert replication_timestamp(path) == "2024-01-01T00:00:00Z"
+
+    stages = collect(path, FILTERS, RIYADH_AREA)
+    assert stages["nodes"] == [{"type": "node", "id": 1, "lat": 24.7, "lon": 46.7, "tags": NODES[1][2]}]
+    assert stages["ways"] == [{"type": "way", "id": 100, "center": {"lat": 24.805, "lon": 46.61},
+                               "tags": {"building": "yes"}}]
+    # The member way and the member node together span the relation
+    assert stages["relations"] == [{"type": "relation", "id": 400, "center": {"lat": 24.925, "lon": 46.515},
+                                    "tags": RELATIONS[0][1]}]
+
+
+def test_matches_overpass_path(tmp_path):
+    store = ElementStore(elements=600, seed=3)
+    path = str(tmp_path / "standin.osm.pbf")
+    counts = write_osm_pbf(store, path, block_size=100)
+    assert counts["relations"]
+
+    filters = [("building", None), ("amenity", None), ("shop", None)]
+    _, chunks, _ = run_query(store, union_query(filters, RIYADH_AREA))
+    expected = {(e["type"], e["id"]): e for e in json.loads(b"".join(chunks))["elements"]}
+    found = {(e["type"], e["id"]): e for elements in collect(path, filters, RIYADH_AREA).values()
+             for e in elements}
+
+    assert sorted(found) == sorted(expected)
+    for key, element in found.items():
+        assert element["tags"] == expected[key]["tags"]
+        point = element.get("center", element)
+        other = expected[key].get("center", expected[key])
+        assert (point["lat"], point["lon"]) == pytest.approx((other["lat"], other["lon"]), abs=2e-7)
+    assert {t for t, _ in found} == {"node", "way", "relation"}
+
+
+def test_extract_rebuilds_a_synced_store(tmp_path, monkeypatch):
+    import fetch_osm_riyadh
+    from osm_store import OsmStore
+
+    path = str(tmp_path / "tiny.osm.pbf")
+    write_extract(path)
+    store_dir = str(tmp_path / "store")
+    with OsmStore(store_dir) as store:
+        store.begin_full()
+        store.put_batch([{"type": "node", "id": 99, "lat": 24.6, "lon": 46.6, "tags": {"shop": "gone"}}])
+        store.commit("2023-06-01T00:00:00Z")
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("--pbf must not query Overpass")
+
+    monkeypatch.setattr(fetch_osm_riyadh, "OverpassClient", no_network)
+    monkeypatch.chdir(tmp_path)
+    total, _ = fetch_osm_riyadh.main(pbf=path, processes=1, store_dir=store_dir)
+
+    assert total == 3
+    with OsmStore(store_dir) as store:
+        assert store.last_sync == "2024-01-01T00:00:00Z"
+        assert sorted(store.elements) == [("node", 1), ("relation", 400), ("way", 100)]
@@ -0,0 +1,41 @@
+"""Tile ownership: every parcel belongs to exactly one tile of the quadtree"""
+
+import pytest
+
+from parcel_tiles import RIYADH_BBOX, TilePlanner, centroids_in, city_tiles, tile_bounds
+
+
+def square(x, y, oid=1, d=0.001):
+    ring = [[x - d, y - d], [x + d, y - d], [x + d, y + d], [x - d, y + d], [x - d, y - d]]
+    return {"attributes": {"OBJECTID": oid}, "geometry": {"rings": [ring]}}
+
+
+@pytest.mark.parametrize("feature", [
+    square(46.8, 24.8),     # inner tile corner
+    square(47.4, 24.5),     # root's east edge
+    square(46.5, 25.4),     # root's north edge
+    square(47.4, 25.4),     # root's north-east corner
+    square(47.6, 24.9),     # east of the root
+    square(46.0, 24.0),     # south-west of the root
+    {"attributes": {"OBJECTID": 2}, "geometry": None},
+])
+def test_one_owner_per_parcel(feature):
+    owners = [tile for tile in city_tiles(2) if centroids_in([feature], tile_bounds(tile))]
+    assert len(owners) == 1
+
+
+def test_viewport_keeps_its_max_edges():
+    viewport = (46.7, 24.7, 46.8, 24.8)
+    inside = square(46.8, 24.75)
+    outside = square(46.81, 24.75)
+    kept = centroids_in([inside, outside], viewport, RIYADH_BBOX, viewport)
+    assert kept == [inside]
+
+
+def test_truncated_cell_is_reported(capsys):
+    planner = TilePlanner([], lambda bounds: ([square(46.8, 24.8)], True))
+    features, truncated = planner.fetch((12345, 12346))
+    assert truncated and len(features) == 1
+    assert "still truncated at the deepest level" in capsys.readouterr().out
+    planner.fetch((0, 4))
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for the UMAPS Balady MapServer proxy
+Keeps a pool of keep-alive connections so each batch only pays for the query itself
+"""
+
+import os
+import threading
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawl_metrics import SIZE_BUCKETS, get_metrics
+from esri_json import decode_response
+from response_cache import request_key
+
+# UMAPS_PROXY_URL / UMAPS_HOME_URL point the scrapers elsewhere, e.g. at mapserver_standin.py
+BASE_URL = os.environ.get("UMAPS_PROXY_URL", "https://umaps.balady.gov.sa/newProxyUDP/proxy.ashx")
+MAP_SERVER = "https://umapsudp.momrah.gov.sa/server/rest/services/Umaps/Umaps_Identify_Satatistics/MapServer/28/query"
+HOME_URL = os.environ.get("UMAPS_HOME_URL", "https://umaps.balady.gov.sa/")
+HEADERS = {
+    "Referer": "https://umaps.balady.gov.sa/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive"
+}
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 120
+
+# Response formats for feature queries: pjson, or the much smaller protobuf
+FEATURE_FORMATS = ("pjson", "pbf")
+
+
+# The proxy takes the target URL as its query string
+PROXY_QUERY_URL = f"{BASE_URL}?{MAP_SERVER}"
+LAYER_URL = MAP_SERVER.rsplit("/query", 1)[0]
+
+
+def build_url(query_params):
+    """Build the full proxy URL with query parameters"""
+    query_string = urlencode(query_params)
+    return f"{PROXY_QUERY_URL}?{query_string}"
+
+
+def _cacheable(content):
+    """Only successful JSON or PBF bodies go into the cache, never errors or HTML pages"""
+    head = content.lstrip()[:1]
+    if not head or head == b"<":
+        return False
+    return head != b"{" or b'"error"' not in content[:200]
+
+
+def request_endpoint(request):
+    """Metrics label for a prepared request: count, ids, query, layer or home"""
+    body = request.body or ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    text = f"{request.url}&{body}"
+    if "returnCountOnly=true" in text:
+        return "count"
+    if "returnIdsOnly=true" in text:
+        return "ids"
+    if "/query" in request.url:
+        return "query"
+    return "layer" if request.url.startswith(BASE_URL) else "home"
+
+
+def record_response(response, *args, **kwargs):
+    """Session response hook: status, latency and body size of every request"""
+    metrics = get_metrics()
+    endpoint = request_endpoint(response.request)
+    if response.headers.get("X-Cache") == "hit":
+        metrics.inc("umaps_cache_hits_total", endpoint=endpoint)
+        return
+    metrics.inc("umaps_responses_total", endpoint=endpoint, status=response.status_code)
+    metrics.observe("umaps_request_seconds", response.elapsed.total_seconds(), endpoint=endpoint)
+    metrics.observe("umaps_response_bytes", len(response.content), SIZE_BUCKETS, endpoint=endpoint)
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that answers proxy queries from a response_cache.ResponseCache
+    and stores successful ones. It sits below the session, so every caller
+    (fetch_with_retry, fetch_batch, manifest queries) goes through it.
+    """
+
+    def __init__(self, cache, prefix=BASE_URL, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.prefix = prefix
+        self.local = threading.local()
+
+    def send(self, request, **kwargs):
+        self.local.hit = False
+        if not request.url.startswith(self.prefix):
+            return super().send(request, **kwargs)
+
+        key = request_key(request.method, request.url, request.body)
+        content = self.cache.get(key)
+        if content is not None:
+            self.local.hit = True
+            response = requests.Response()
+            response.status_code = 200
+            response.reason = "OK"
+            response._content = content
+            response.encoding = "utf-8"
+            response.url = request.url
+            response.request = request
+            response.headers["X-Cache"] = "hit"
+            return response
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 200 and _cacheable(response.content):
+            self.cache.put(key, response.content)
+        return response
+
+
+class UmapsClient:
+    """
+    Thread-safe pooled client. One instance is meant to be shared by every
+    worker thread so connections to the proxy are reused across batches.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, feature_format="pjson", cache=None):
+        if feature_format not in FEATURE_FORMATS:
+            raise ValueError(f"feature_format must be one of {FEATURE_FORMATS}")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.feature_format = feature_format
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.hooks["response"].append(record_response)
+
+        # Block instead of opening throwaway connections when the pool is busy
+        pool = dict(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.cache = cache
+        adapter = CachingAdapter(cache, **pool) if cache is not None else HTTPAdapter(**pool)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._warm_lock = threading.Lock()
+        self._warmed = False
+
+    def warm_up(self):
+        """Pick up cookies from the main site once per client"""
+        with self._warm_lock:
+            if self._warmed:
+                return
+            self._warmed = True
+        try:
+            self.session.get(HOME_URL, timeout=30)
+        except requests.RequestException:
+            pass
+
+    def get(self, url):
+        return self.session.get(url, timeout=self.timeout)
+
+    def served_from_cache(self):
+        """Whether this thread's last request was answered by the response cache"""
+        adapter = self.session.get_adapter(BASE_URL)
+        return isinstance(adapter, CachingAdapter) and getattr(adapter.local, "hit", False)
+
+    def get_json(self, query_params):
+        """Run a MapServer query and decode the JSON body"""
+        return self.get(build_url(query_params)).json()
+
+    def post_json(self, query_params):
+        """Same as get_json but sends the parameters as a form body (long objectIds lists)"""
+        response = self.session.post(PROXY_QUERY_URL, data=query_params, timeout=self.timeout)
+        return response.json()
+
+    def get_layer_info(self):
+        """Layer metadata (fields, editor tracking), or None if unavailable"""
+        try:
+            return decode_response(self.get(f"{BASE_URL}?{LAYER_URL}?f=pjson"))
+        except (requests.RequestException, ValueError):
+            return None
+
+    def fallback_to_json(self):
+        """Stop asking for f=pbf after the server failed to deliver it"""
+        if self.feature_format != "pjson":
+            print("  PBF response not usable, falling back to pjson")
+            get_metrics().inc("umaps_format_fallbacks_total")
+            self.feature_format = "pjson"
+
+    def query_features(self, query_params, post=False):
+        """
+        Feature query in this client's feature_format. Returns the decoded
+        response dict; with pbf its "features" is an esri_pbf.FeatureBatch.
+        A pbf request that comes back undecodable or rejected (other than
+        rate limiting) switches the client to pjson and is sent again.
+        """
+        requested = self.feature_format
+        params = dict(query_params, f=requested)
+        try:
+            if post:
+                response = self.session.post(PROXY_QUERY_URL, data=params, timeout=self.timeout)
+            else:
+                response = self.get(build_url(params))
+            data = decode_response(response)
+        except ValueError:  # PbfDecodeError, or an empty or HTML body
+            data = None
+
+        rejected = data is None or ("error" in data and data["error"].get("code") != 403)
+        if requested == "pbf" and rejected:
+            self.fallback_to_json()
+            return self.query_features(query_params, post)
+        return data
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide shared client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UmapsClient()
+        return _client
+
+
+def configure_client(**kwargs):
+    """Replace the shared client, e.g. to size the pool for N workers"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = UmapsClient(**kwargs)
+        return _client